@@ -16,13 +16,31 @@ Diamond Light Source Ltd.
 2022
 """
 
-from i16_script_generator.tkscangen import ScanGenerator
-from i16_script_generator.tkscriptgen import ScriptGenerator
-from i16_script_generator.timing import scan_command_time, time_script_string, time_script
-
 __version__ = '1.0.0'
 __date__ = '06/11/22'
 
+# Attributes imported on first use, so timing doesn't import tkinter (or numpy until a scan is timed)
+LAZY_ATTRIBUTES = {
+    'ScanGenerator': 'i16_script_generator.tkscangen',
+    'ScriptGenerator': 'i16_script_generator.tkscriptgen',
+    'scan_command_time': 'i16_script_generator.timing',
+    'time_script_string': 'i16_script_generator.timing',
+    'time_script': 'i16_script_generator.timing',
+}
+
+
+def __getattr__(name):
+    if name in LAZY_ATTRIBUTES:
+        import importlib
+        value = getattr(importlib.import_module(LAZY_ATTRIBUTES[name]), name)
+        globals()[name] = value
+        return value
+    raise AttributeError('module %r has no attribute %r' % (__name__, name))
+
+
+def __dir__():
+    return sorted(list(globals()) + list(LAZY_ATTRIBUTES))
+
 
 def version_info():
     return 'i16_script_generator version %s (%s)' % (__version__, __date__)
@@ -0,0 +1,398 @@
+"""
+Dry-run script timer
+Times a script by running it against a simulated GDA namespace with a virtual clock, so loops that depend on
+values read during the script (e.g. "while abs(Ta() - tval) > 0.2:") run the correct number of times.
+
+GDA commands are translated to python calls (see gdasyntax), the script is then executed with every unknown
+name replaced by a simulated scannable. Instead of waiting, each command advances the virtual clock:
+    pos command: POS_TIME seconds
+    w(t), sleep(t), pos w t: t seconds
+    scan commands: see timing.scan_command_time
+    go, inc: POS_TIME seconds
+Readback scannables (e.g. the temperature Ta) approach the position of their setpoint scannable (e.g. tset)
+at the speed of the setpoint in the registry, see READBACKS.
+
+Runaway loops are stopped by budgets of executed lines (max_steps) and virtual time (max_time).
+
+    run = dry_run(script)
+    print(run.total, run.line_counts[lineno], run.stopped)
+    print(run.annotated_script())
+
+By Dan Porter, PhD
+Diamond Light Source Ltd
+2022
+"""
+
+import ast
+import sys
+import time
+import numbers
+import builtins
+import operator
+import collections
+
+from i16_script_generator.gdasyntax import translate_lines, first_word, GDA_CALL
+from i16_script_generator.registry import registry
+from i16_script_generator.scancommand import substitute_variables, re_identifier
+from i16_script_generator.timing import scan_command_time, lazy_frange, time_string
+
+POS_TIME = 1.0  # time per pos command, s
+MAX_STEPS = 1000000  # maximum number of executed script lines
+MAX_TIME = 30 * 24 * 3600.  # maximum virtual time, s
+READBACKS = {'Ta': 'tset', 'Tb': 'tset'}  # {readback: setpoint scannable}
+SLEEP_FUNCTIONS = ['w', 'sleep']
+SCRIPT_FILENAME = '<dryrun>'
+
+
+class BudgetExceeded(BaseException):
+    """Raised when a dry run exceeds its step or time budget, not caught by "except Exception" in scripts"""
+
+
+class VirtualClock:
+    """
+    Virtual clock, advanced by the modelled time of each command
+    :param max_time: None or float, BudgetExceeded is raised when the time exceeds max_time seconds
+    """
+
+    def __init__(self, max_time=None):
+        self.time = 0.0
+        self.max_time = max_time
+
+    def __repr__(self):
+        return 'VirtualClock(%s)' % time_string(self.time)
+
+    def advance(self, seconds):
+        """Advance the clock by seconds"""
+        self.time += seconds
+        if self.max_time is not None and self.time > self.max_time:
+            raise BudgetExceeded('virtual time budget of %s exceeded' % time_string(self.max_time))
+
+
+class SimScannable:
+    """
+    Simulated scannable, also used for any unknown name in the script
+    Calling the scannable returns its position, attributes are further simulated scannables.
+    :param name: str name
+    :param run: DryRun
+    :param position: initial position
+    """
+
+    def __init__(self, name, run, position=0.0):
+        self.name = name
+        self.run = run
+        self.position = position
+        self.previous = position  # position before the last move
+        self.moved_at = 0.0  # virtual time of the last move
+
+    def __repr__(self):
+        return '%s: %s' % (self.name, self.position)
+
+    def __call__(self, *args, **kwargs):
+        if args or kwargs:
+            return SimScannable('%s()' % self.name, self.run)  # e.g. function returning an object
+        return self.getPosition()
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        return SimScannable('%s.%s' % (self.name, name), self.run)
+
+    def __bool__(self):
+        return bool(self.getPosition())
+
+    def getPosition(self):
+        return self.position
+
+    def moveTo(self, position):
+        """Move to position, taking POS_TIME of virtual time"""
+        self.run.advance(POS_TIME)
+        self.previous = self.getPosition()
+        self.position = position
+        self.moved_at = self.run.clock.time
+
+    asynchronousMoveTo = moveTo
+
+
+def _position_operator(function, reverse=False):
+    """Return method applying function to the position of a simulated scannable"""
+    if reverse:
+        return lambda self, other: function(other, self.getPosition())
+    return lambda self, *args: function(self.getPosition(), *args)
+
+
+for _name in ['add', 'sub', 'mul', 'truediv', 'floordiv', 'mod', 'pow']:
+    setattr(SimScannable, '__%s__' % _name, _position_operator(getattr(operator, _name)))
+    setattr(SimScannable, '__r%s__' % _name, _position_operator(getattr(operator, _name), reverse=True))
+for _name in ['lt', 'le', 'gt', 'ge', 'neg', 'abs']:
+    setattr(SimScannable, '__%s__' % _name, _position_operator(getattr(operator, _name)))
+SimScannable.__float__ = _position_operator(float)
+SimScannable.__int__ = _position_operator(int)
+SimScannable.__round__ = _position_operator(round)
+
+
+class SimReadback(SimScannable):
+    """
+    Simulated readback, e.g. a temperature sensor, approaching the position of a setpoint scannable
+    :param name: str name
+    :param run: DryRun
+    :param setpoint: SimScannable
+    :param speed: float change of the readback in units per second
+    """
+
+    def __init__(self, name, run, setpoint, speed=1.0):
+        super().__init__(name, run)
+        self.setpoint = setpoint
+        self.speed = speed
+
+    def getPosition(self):
+        start, target = self.setpoint.previous, self.setpoint.position
+        try:
+            change = self.speed * (self.run.clock.time - self.setpoint.moved_at)
+            if abs(target - start) <= change:
+                return target
+            return start + change if target > start else start - change
+        except TypeError:
+            return target  # not a number
+
+    def moveTo(self, position):
+        self.setpoint.moveTo(position)
+
+
+def initial_position(info):
+    """Return initial position of scannable from registry info 'start', or 0"""
+    start = info.get('start', 0.0)
+    if isinstance(start, str):
+        try:
+            return ast.literal_eval(start)
+        except (ValueError, SyntaxError):
+            return 0.0
+    return start
+
+
+def is_value(value):
+    """Return True if value is a number or list of numbers, that can be written into a scan command"""
+    if isinstance(value, numbers.Number):
+        return True
+    return isinstance(value, (list, tuple)) and all(isinstance(val, numbers.Number) for val in value)
+
+
+class DryRun:
+    """
+    Execute a script against a simulated GDA namespace with a virtual clock
+        run = DryRun(max_steps=10000)
+        total = run.run(script)  # virtual seconds
+    :param max_steps: int maximum number of executed script lines
+    :param max_time: float maximum virtual time in seconds
+    :param readbacks: {readback: setpoint} readback scannables, default READBACKS
+    """
+
+    def __init__(self, max_steps=MAX_STEPS, max_time=MAX_TIME, readbacks=None):
+        self.max_steps = max_steps
+        self.clock = VirtualClock(max_time)
+        self.readbacks = READBACKS if readbacks is None else readbacks
+        self.namespace = {}
+        self.line_times = collections.defaultdict(float)  # {lineno: seconds}
+        self.line_counts = collections.Counter()  # {lineno: number of times line was run}
+        self.lines = []
+        self.output = []  # printed lines
+        self.warnings = []
+        self.steps = 0
+        self.lineno = 0  # current script line
+        self.stopped = None  # reason the script was stopped, or None if it finished
+        self.wall_time = 0.0
+
+    @property
+    def total(self):
+        """Total virtual time in seconds"""
+        return self.clock.time
+
+    def advance(self, seconds):
+        """Advance the virtual clock, adding the time to the current line"""
+        self.line_times[self.lineno] += seconds
+        self.clock.advance(seconds)
+
+    "------------------------------------------------------------------------"
+    "---------------------------Namespace------------------------------------"
+    "------------------------------------------------------------------------"
+
+    def device(self, name):
+        """Return simulated scannable for name, creating it if required"""
+        device = self.namespace.get(name)
+        if isinstance(device, SimScannable):
+            return device
+        if name in self.readbacks:
+            setpoint = self.device(self.readbacks[name])
+            speed, stabilisation = registry().scannable_speed(self.readbacks[name])
+            device = SimReadback(name, self, setpoint, speed)
+        else:
+            device = SimScannable(name, self, initial_position(registry().scannable_info(name)))
+        self.namespace[name] = device
+        return device
+
+    def build_namespace(self, tree):
+        """Add functions and a simulated scannable for each unknown name used in the script"""
+        self.namespace.update({
+            GDA_CALL: self.gda_command,
+            'pos': self.pos,
+            'w': self.sleep,
+            'sleep': self.sleep,
+            'frange': lazy_frange,
+            'print': self.print,
+        })
+        names = set()
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Name):
+                names.add(node.id)
+            elif isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and node.func.id == GDA_CALL:
+                # names in GDA commands, e.g. 'pos hkl hkl001'
+                names.update(match.group(1) for match in re_identifier.finditer(node.args[0].value) if match.group(1))
+        for name in sorted(names):
+            if name not in self.namespace and not hasattr(builtins, name):
+                self.device(name)
+
+    "------------------------------------------------------------------------"
+    "---------------------------Commands-------------------------------------"
+    "------------------------------------------------------------------------"
+
+    def print(self, *args, **kwargs):
+        self.output.append(' '.join(str(arg) for arg in args))
+
+    def sleep(self, seconds=0, *args):
+        self.advance(float(seconds))
+
+    def pos(self, scannable=None, position=None, *args):
+        """pos(scannable, position) - move scannable"""
+        if isinstance(scannable, SimScannable) and position is not None:
+            scannable.moveTo(position)
+        return scannable
+
+    def gda_command(self, command):
+        """Run GDA command, e.g. 'pos x 1', advancing the virtual clock"""
+        local_vars = sys._getframe(1).f_locals  # variables of the calling script function
+        name, arguments = first_word(command)
+        arguments = arguments.strip()
+        if name == 'pos':
+            scannable, expression = first_word(arguments)
+            if scannable in SLEEP_FUNCTIONS and expression.strip():
+                return self.sleep(eval(expression, self.namespace, local_vars))
+            if scannable and expression.strip():
+                self.device(scannable).moveTo(eval(expression, self.namespace, local_vars))
+        elif name == 'inc':
+            scannable, expression = first_word(arguments)
+            device = self.device(scannable)
+            device.moveTo(device.getPosition() + eval(expression, self.namespace, local_vars))
+        elif name == 'go':
+            self.advance(POS_TIME)
+        elif 'scan' in name:
+            variables = {key: val for key, val in {**self.namespace, **local_vars}.items() if is_value(val)}
+            seconds, points = scan_command_time(substitute_variables(command, variables))
+            self.advance(float(seconds))
+
+    "------------------------------------------------------------------------"
+    "---------------------------Execution------------------------------------"
+    "------------------------------------------------------------------------"
+
+    def trace(self, frame, event, arg):
+        """sys.settrace function, tracing only frames of the script"""
+        if frame.f_code.co_filename == SCRIPT_FILENAME:
+            return self.trace_line
+        return None
+
+    def trace_line(self, frame, event, arg):
+        """Count executed lines, stopping the script when max_steps is exceeded"""
+        if event == 'line':
+            self.lineno = frame.f_lineno
+            self.line_counts[self.lineno] += 1
+            self.steps += 1
+            if self.steps > self.max_steps:
+                raise BudgetExceeded('step budget of %d lines exceeded' % self.max_steps)
+        return self.trace_line
+
+    def run(self, script):
+        """
+        Execute script, returns total virtual time in seconds
+        The script is stopped at the first error or when a budget is exceeded, see stopped.
+        :param script: str multi-line GDA script
+        :return: float
+        """
+        start = time.perf_counter()
+        self.lines = script.replace('\t', '    ').splitlines()
+        source = '\n'.join(translate_lines(self.lines))
+        try:
+            tree = ast.parse(source, SCRIPT_FILENAME)
+            code = compile(tree, SCRIPT_FILENAME, 'exec')
+        except SyntaxError as xx:
+            self.stopped = 'SyntaxError: %s, line %s' % (xx.msg, xx.lineno)
+            self.warnings.append(self.stopped)
+            return self.total
+        self.build_namespace(tree)
+        previous_trace = sys.gettrace()
+        sys.settrace(self.trace)
+        try:
+            exec(code, self.namespace)
+        except BudgetExceeded as xx:
+            self.stopped = 'Line %d: %s' % (self.lineno, xx)
+            self.warnings.append(self.stopped)
+        except Exception as xx:
+            self.stopped = 'Line %d: %s: %s' % (self.lineno, type(xx).__name__, xx)
+            self.warnings.append(self.stopped)
+        finally:
+            sys.settrace(previous_trace)
+            self.wall_time = time.perf_counter() - start
+        return self.total
+
+    def annotated_script(self):
+        """Return script with the number of runs and time of each timed line added as a comment"""
+        output = list(self.lines)
+        for lineno, seconds in sorted(self.line_times.items()):
+            if 0 < lineno <= len(output) and seconds:
+                line = output[lineno - 1].split('  #')[0].rstrip()
+                output[lineno - 1] = '%s  # %d runs, %s' % (line, self.line_counts[lineno], time_string(seconds))
+        return '\n'.join(output)
+
+
+def dry_run(script, max_steps=MAX_STEPS, max_time=MAX_TIME, readbacks=None):
+    """
+    Time script by executing it with simulated scannables and a virtual clock, see DryRun
+    :param script: str multi-line GDA script
+    :param max_steps: int maximum number of executed script lines
+    :param max_time: float maximum virtual time in seconds
+    :param readbacks: {readback: setpoint} readback scannables, default READBACKS
+    :return: DryRun with total, line_times, line_counts, stopped, warnings
+    """
+    run = DryRun(max_steps, max_time, readbacks)
+    run.run(script)
+    return run
+
+
+def main(argv=None):
+    """
+    Command line dry-run timer
+        $ python -m i16_script_generator.dryrun script.py --max-hours 48
+    """
+    import argparse
+    parser = argparse.ArgumentParser(
+        prog='python -m i16_script_generator.dryrun',
+        description='Time an I16 script by running it against simulated scannables with a virtual clock'
+    )
+    parser.add_argument('script', help='script file')
+    parser.add_argument('--max-steps', type=int, default=MAX_STEPS, help='maximum number of executed lines')
+    parser.add_argument('--max-hours', type=float, default=MAX_TIME / 3600, help='maximum virtual time in hours')
+    parser.add_argument('--annotate', action='store_true', help='print the script with the time of each line')
+    parser.add_argument('--registry', default=None, help='JSON or YAML dump of the GDA namespace')
+    args = parser.parse_args(argv)
+    if args.registry:
+        from i16_script_generator.registry import set_registry_file
+        set_registry_file(args.registry)
+
+    with open(args.script) as f:
+        run = dry_run(f.read(), args.max_steps, args.max_hours * 3600)
+    if args.annotate:
+        print(run.annotated_script())
+    print('   Dry run time: %s (%d lines run in %.3g s)' % (time_string(run.total), run.steps, run.wall_time))
+    if run.stopped:
+        print('   Stopped: %s' % run.stopped)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,189 @@
+# This Python code is encoded in: utf-8
+"""
+GDA syntax functions
+Translates GDA-only command syntax into python function calls so a script can be parsed by the python ast module.
+
+GDA allows commands without brackets:
+    pos x 1                             -> _gda_command('pos x 1')
+    scancn eta 0.01 101 pil 1 roi2      -> _gda_command('scancn eta 0.01 101 pil 1 roi2')
+    pos x1 1; scan x 1 2 1              -> _gda_command('pos x1 1'); _gda_command('scan x 1 2 1')
+    if stop: pos x 1                    -> if stop: _gda_command('pos x 1')
+
+Lines are translated one-to-one, so line numbers in the translated script match the original.
+
+By Dan Porter, PhD
+Diamond Light Source Ltd
+2022
+"""
+
+import re
+import keyword
+
+GDA_CALL = '_gda_command'
+GDA_COMMANDS = ['pos', 'inc', 'go', 'con', 'scan', 'scancn', 'cscan', 'rscan', 'pscan', 'upos', 'ls', 'help', 'watch']
+CONTINUATION_KEYWORDS = ['elif', 'else', 'except', 'finally']  # continue a compound statement
+COMPOUND_KEYWORDS = ['if', 'elif', 'else', 'for', 'while', 'with', 'try', 'except', 'finally', 'def', 'class']
+BRACKETS_OPEN = '([{'
+BRACKETS_CLOSE = ')]}'
+
+re_special = re.compile(r'[#\'"()\[\]{};:\\]')  # characters that change the state of a line
+re_word = re.compile(r'\s*(\w*)')
+re_command = re.compile(r'\s*([^\W\d]\w*)\s+(\S)')  # name, first character of arguments
+
+
+def scan_line(line, quote=None, depth=0):
+    """
+    Step through the special characters of a python line, tracking strings and brackets
+      code, splits, colon, quote, depth = scan_line(line, quote, depth)
+    :param line: str single line of script
+    :param quote: None or str triple-quote open at the start of the line
+    :param depth: int bracket depth at the start of the line
+    :return code: str line with any comment removed
+    :return splits: list of positions of top-level ';' in code
+    :return colon: position of first top-level ':' in code or None
+    :return quote: None or str triple-quote left open at the end of the line
+    :return depth: int bracket depth at the end of the line
+    """
+    splits = []
+    colon = None
+    string = quote  # current string delimiter
+    position = 0  # skip matches before this position
+    for match in re_special.finditer(line):
+        n = match.start()
+        if n < position:
+            continue
+        char = match.group()
+        if string:
+            if char == '\\':
+                position = n + 2
+            elif line.startswith(string, n):
+                position = n + len(string)
+                string = None
+            continue
+        if char == '#':
+            return line[:n], splits, colon, None, depth
+        if char in '\'"':
+            string = char * 3 if line.startswith(char * 3, n) else char
+            position = n + len(string)
+        elif char in BRACKETS_OPEN:
+            depth += 1
+        elif char in BRACKETS_CLOSE:
+            depth = max(depth - 1, 0)
+        elif depth == 0 and char == ';':
+            splits.append(n)
+        elif depth == 0 and char == ':' and colon is None:
+            colon = n
+    # single quoted strings can't continue on the next line
+    quote = string if string and len(string) == 3 else None
+    return line, splits, colon, quote, depth
+
+
+def strip_comment(line):
+    """Return line with any comment removed, ignoring # within strings"""
+    return scan_line(line)[0]
+
+
+def first_word(statement):
+    """Return first word and remainder of statement"""
+    match = re_word.match(statement)
+    return match.group(1), statement[match.end():]
+
+
+def is_gda_command(statement):
+    """Return True if statement is a GDA command, e.g. 'pos x 1', rather than python"""
+    match = re_command.match(statement)
+    if match is None:
+        return False  # no arguments or no whitespace after name
+    name, char = match.groups()
+    if keyword.iskeyword(name):
+        return False
+    if char.isalnum() or char in '_\'".':
+        next_word, _ = first_word(statement[match.start(2):])
+        return not keyword.iskeyword(next_word)
+    return name in GDA_COMMANDS and char in '-[('
+
+
+def gda_command_name(command):
+    """Return the command name of a GDA command string, e.g. 'scancn eta 0.01 101' -> 'scancn'"""
+    return first_word(command)[0]
+
+
+def translate_statement(statement):
+    """Translate single statement, returning python code"""
+    if is_gda_command(statement):
+        indent = statement[:len(statement) - len(statement.lstrip())]
+        return '%s%s(%r)' % (indent, GDA_CALL, statement.strip())
+    return statement
+
+
+def translate_line(code, splits, colon):
+    """Translate a single line of code (without comments), returning python code"""
+    if not splits and colon is None:
+        return translate_statement(code)  # single simple statement
+    starts = [0] + [n + 1 for n in splits]
+    ends = splits + [len(code)]
+    statements = [code[start:end] for start, end in zip(starts, ends)]
+    # one line compound statements, e.g. "if stop: pos x 1"
+    if colon is not None and colon < ends[0] and first_word(statements[0])[0] in COMPOUND_KEYWORDS:
+        header, body = statements[0][:colon + 1], statements[0][colon + 1:]
+        statements[0] = header + (' ' + translate_statement(body).strip() if body.strip() else '')
+        statements[1:] = [translate_statement(s) for s in statements[1:]]
+    else:
+        statements = [translate_statement(s) for s in statements]
+    return ';'.join(statements)
+
+
+def translate_script(script):
+    """
+    Translate GDA script into a python script with the same number of lines
+    GDA commands such as "pos x 1" are replaced by function calls: _gda_command('pos x 1')
+    :param script: str multi-line GDA script
+    :return: str python script
+    """
+    return '\n'.join(translate_lines(script.splitlines()))
+
+
+def translate_lines(lines):
+    """Generator translating each line in a sequence of lines, yielding python code"""
+    quote = None
+    depth = 0
+    continuation = False
+    for line in lines:
+        statement_start = quote is None and depth == 0 and not continuation
+        code, splits, colon, quote, depth = scan_line(line, quote, depth)
+        continuation = code.rstrip().endswith('\\')
+        if statement_start and code.strip() and quote is None and depth == 0 and not continuation:
+            translated = translate_line(code.rstrip(), splits, colon)
+            yield translated if translated != code.rstrip() else line
+        else:
+            yield line
+
+
+def iter_blocks(lines):
+    """
+    Generator grouping lines into blocks of complete top-level statements
+    A new block starts at each un-indented statement, except where the statement continues the previous
+    block (else, elif, except, finally) or follows a decorator. Comments and blank lines are added to the
+    current block.
+    :param lines: iterable of str lines
+    :return: yields (first_line_index, list_of_lines)
+    """
+    block = []
+    start = 0
+    quote = None
+    depth = 0
+    continuation = False
+    decorator = False
+    for n, line in enumerate(lines):
+        statement_start = quote is None and depth == 0 and not continuation
+        code, splits, colon, quote, depth = scan_line(line, quote, depth)
+        continuation = code.rstrip().endswith('\\')
+        if statement_start and code.strip() and not code[0].isspace():
+            if block and not decorator and first_word(code)[0] not in CONTINUATION_KEYWORDS:
+                yield start, block
+                block = []
+                start = n
+            decorator = code.startswith('@')
+        block.append(line)
+    if block:
+        yield start, block
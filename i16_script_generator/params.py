@@ -28,10 +28,115 @@ SCANOPTIONS = [list of possible options to include in scan]
 
 EDGES = {dict of x-ray absorption edges with names '[element] [edge]' e.g. 'Co K'}
 
+SCANNABLES and DETECTORS are RegistryDicts and SCANOPTIONS is a RegistryList, any change (including to
+nested dicts and lists such as 'alt names') increments registry_version(), allowing cached scan times to
+be invalidated. Changes to other nested objects must be followed by a call to _registry_changed().
+
 By Dan Porter, PhD
 Diamond Light Source Ltd
 2022
 """
+
+_registry_version = 0
+
+
+def registry_version():
+    """Return int that is incremented each time SCANNABLES or DETECTORS are changed"""
+    return _registry_version
+
+
+def _registry_changed():
+    global _registry_version
+    _registry_version += 1
+
+
+def _registry_value(value):
+    """Convert dicts and lists to RegistryDict and RegistryList, so changes to nested values are tracked"""
+    if type(value) is dict:
+        return RegistryDict(value)
+    if type(value) is list:
+        return RegistryList(value)
+    return value
+
+
+def _changes_registry(method):
+    """Return list method that increments the registry version"""
+    def wrapper(self, *args, **kwargs):
+        output = method(self, *args, **kwargs)
+        _registry_changed()
+        return output
+    wrapper.__name__ = method.__name__
+    wrapper.__doc__ = method.__doc__
+    return wrapper
+
+
+class RegistryList(list):
+    """list that increments the registry version when changed"""
+
+    __setitem__ = _changes_registry(list.__setitem__)
+    __delitem__ = _changes_registry(list.__delitem__)
+    __iadd__ = _changes_registry(list.__iadd__)
+    __imul__ = _changes_registry(list.__imul__)
+    append = _changes_registry(list.append)
+    extend = _changes_registry(list.extend)
+    insert = _changes_registry(list.insert)
+    remove = _changes_registry(list.remove)
+    pop = _changes_registry(list.pop)
+    clear = _changes_registry(list.clear)
+    sort = _changes_registry(list.sort)
+    reverse = _changes_registry(list.reverse)
+
+
+class RegistryDict(dict):
+    """
+    dict that increments the registry version when changed
+    Nested dicts and lists are converted to RegistryDicts and RegistryLists so changes to items are also tracked.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        for key, value in self.items():
+            super().__setitem__(key, _registry_value(value))
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, _registry_value(value))
+        _registry_changed()
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        _registry_changed()
+
+    def __ior__(self, other):
+        self.update(other)
+        return self
+
+    def update(self, *args, **kwargs):
+        for key, value in dict(*args, **kwargs).items():
+            self[key] = value
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+    def pop(self, key, *default):
+        if key not in self:
+            return super().pop(key, *default)
+        value = super().pop(key)
+        _registry_changed()
+        return value
+
+    def popitem(self):
+        item = super().popitem()
+        _registry_changed()
+        return item
+
+    def clear(self):
+        if self:
+            super().clear()
+            _registry_changed()
+
+
 SCANNABLES = {
     'eta': {'desc': 'sample rotation parallel to beam'},
     'chi': {'desc': 'sample rotation perpendicular to beam'},
@@ -122,13 +227,16 @@ DETECTORS = {
     },
 }
 
-SCANOPTIONS = [
+SCANNABLES = RegistryDict(SCANNABLES)
+DETECTORS = RegistryDict(DETECTORS)
+
+SCANOPTIONS = RegistryList([
     'checkbeam',
     'msmapper',
     'autoproc',
     'tthmapper',
     'Tsample',
-]
+])
 
 EDGES = {
     'Mo L3': 2.520,
@@ -0,0 +1,278 @@
+# This Python code is encoded in: utf-8
+"""
+Beamline registry
+Lookup tables of scannables, detectors, regions of interest and scan options, built once from the
+tables in params.py and rebuilt only when the tables change (see params.registry_version).
+All other modules read scannables and detectors through registry().
+
+    reg = registry()
+    reg.detector('pil3_100k')  # 'pilatus100k'
+    reg.detector_info('pil')  # {'cmd': 'pil %.5g', 'exposure': 1, ...}
+    reg.scannable_info('phi')  # {'desc': ..., 'speed': 5, 'stabilisation': 1}
+    reg.classify('pil2ms')  # ('detector', 'pilatus2m')
+    reg.classify('roi2')  # ('roi', 'pilatus100k')
+    reg.classify('eta')  # ('scannable', 'eta')
+
+Detector names in scan commands are matched using the 'regex' entry of DETECTORS. Regular expressions
+of the form 'name' or 'name\\w*?' (name followed by any suffix, e.g. 'merlins', 'pil3_100k') are converted
+to dict lookups, so words are classified in constant time however many detectors are defined.
+
+The registry can be extended with a dump of the GDA namespace, a JSON or YAML file of the form:
+    {
+        "scannables": {"name": {"desc": "", "alt names": [], "speed": 1.0, "stabilisation": 1.0}, ...},
+        "detectors": {"name": {"cmd": "name %.5g", "exposure": 1, "alt names": [], "rois": [], ...}, ...},
+        "options": ["checkbeam", ...]
+    }
+Entries in the dump take precedence over the tables in params.py. The merged tables are cached as JSON in a
+private per-user directory (~/.cache/i16_script_generator/registry), which is used until the dump is modified.
+
+    set_registry_file('/dls_sw/i16/scripts/gda_namespace.json')  # or environment variable I16_REGISTRY
+
+By Dan Porter, PhD
+Diamond Light Source Ltd
+2022
+"""
+
+import os
+import re
+import json
+import hashlib
+import functools
+
+from i16_script_generator.params import SCANNABLES, DETECTORS, SCANOPTIONS, registry_version, _registry_changed
+
+REGISTRY_ENV = 'I16_REGISTRY'  # environment variable with filename of GDA namespace dump
+CACHE_DIR = os.path.join('~', '.cache', 'i16_script_generator', 'registry')  # cached tables of dump files
+CACHE_FORMAT = 3  # increment when Registry changes, to invalidate old cache files
+
+re_prefix = re.compile(r'(\w+)\\w\*\??$')  # regex 'pil\w*?' -> prefix 'pil'
+re_name = re.compile(r'\w+$')
+
+
+def normalise_name(name):
+    """Return lower case name with spaces, underscores and dashes removed"""
+    return name.lower().replace(' ', '').replace('_', '').replace('-', '')
+
+
+class Registry:
+    """
+    Registry of beamline names
+    Dicts from each name to the canonical name, built from scannable and detector tables.
+        Registry(SCANNABLES, DETECTORS, SCANOPTIONS)
+    """
+
+    def __init__(self, scannables, detectors, options=()):
+        # copy tables as plain dicts, with default values
+        self.scannable_table = {name: dict(info) for name, info in scannables.items()}
+        self.detector_table = {name: dict(info) for name, info in detectors.items()}
+        for name, info in self.scannable_table.items():
+            info.setdefault('desc', '')
+        for name, info in self.detector_table.items():
+            info.setdefault('desc', '')
+            info.setdefault('cmd', name + ' %.5g')
+            info.setdefault('exposure', 1)
+        self.options = {name: name for name in options}
+        # hash of the tables, e.g. to key cached timing results
+        tables = repr((self.scannable_table, self.detector_table, list(self.options)))
+        self.digest = hashlib.sha1(tables.encode()).hexdigest()
+        # scannable names and aliases
+        self.scannables = {}
+        for name, info in self.scannable_table.items():
+            self.scannables[name] = name
+            for alt in info.get('alt names', []):
+                self.scannables.setdefault(alt, name)
+        # detector names and aliases, used by detector()
+        self.aliases = {}
+        # detector words in scan commands, used by classify()
+        self.words = {}
+        self.prefixes = {}
+        self.patterns = []  # any regex that can't be converted
+        self.rois = {}
+        for det_name, det in self.detector_table.items():
+            self.aliases[det_name] = det_name
+            for alt in det.get('alt names', []):
+                self.aliases.setdefault(normalise_name(alt), det_name)
+            for roi in det.get('rois', []):
+                self.rois.setdefault(roi, det_name)
+            regex = det.get('regex', re.escape(det_name))
+            prefix = re_prefix.match(regex)
+            if prefix:
+                self.prefixes.setdefault(prefix.group(1), det_name)
+            elif re_name.match(regex):
+                self.words.setdefault(regex, det_name)
+            else:
+                self.patterns.append((re.compile(regex + '$'), det_name))
+        # check longest prefixes first
+        self.prefix_lengths = sorted({len(prefix) for prefix in self.prefixes}, reverse=True)
+
+    def __repr__(self):
+        return 'Registry(%d scannables, %d detectors)' % (len(self.scannable_table), len(self.detector_table))
+
+    @property
+    def scannable_names(self):
+        """List of scannable names"""
+        return list(self.scannable_table)
+
+    @property
+    def detector_names(self):
+        """List of detector names"""
+        return list(self.detector_table)
+
+    @property
+    def option_names(self):
+        """List of scan options"""
+        return list(self.options)
+
+    def scannable(self, name):
+        """Return canonical scannable name from name or alias, or None if not a scannable"""
+        return self.scannables.get(name)
+
+    def scannable_info(self, name):
+        """Return dict of scannable properties from name or alias, empty if not a scannable"""
+        return self.scannable_table.get(self.scannables.get(name), {})
+
+    def scannable_speed(self, name, speed=1.0, stabilisation=1.0):
+        """Return speed, stabilisation time of scannable, with defaults for unknown values"""
+        info = self.scannable_info(name)
+        return info.get('speed', speed), info.get('stabilisation', stabilisation)
+
+    def detector_info(self, name):
+        """Return dict of detector properties from name or alias, or None if not a detector"""
+        return self.detector_table.get(self.detector(name))
+
+    def detector(self, name):
+        """Return canonical detector name from name or alias, or None if not a detector"""
+        if name in self.aliases:
+            return self.aliases[name]
+        return self.aliases.get(normalise_name(name))
+
+    def detector_word(self, word):
+        """Return canonical detector name if word is a detector in a scan command, or None"""
+        if word in self.words:
+            return self.words[word]
+        for length in self.prefix_lengths:
+            if word[:length] in self.prefixes:
+                return self.prefixes[word[:length]]
+        for pattern, det_name in self.patterns:
+            if pattern.match(word):
+                return det_name
+        return None
+
+    def classify(self, word):
+        """
+        Classify word of a scan command
+        :param word: str
+        :return kind: 'scannable', 'detector', 'roi', 'option' or None
+        :return name: canonical name (detector name for rois), or word if kind is None
+        """
+        if word in self.scannables:
+            return 'scannable', word
+        if word in self.rois:
+            return 'roi', self.rois[word]
+        if word in self.options:
+            return 'option', word
+        det_name = self.detector_word(word)
+        if det_name is not None:
+            return 'detector', det_name
+        return None, word
+
+
+def read_dump(filename):
+    """
+    Read GDA namespace dump file (JSON, or YAML if the filename ends .yaml or .yml)
+    :param filename: str
+    :return scannables: {name: info}
+    :return detectors: {name: info}
+    :return options: list of option names
+    """
+    with open(filename) as f:
+        if filename.lower().endswith(('.yaml', '.yml')):
+            import yaml
+            dump = yaml.safe_load(f)
+        else:
+            dump = json.load(f)
+    return dump.get('scannables', {}), dump.get('detectors', {}), dump.get('options', [])
+
+
+def registry_cache_file(filename):
+    """Return filename of the per-user JSON cache of a GDA namespace dump, see load_registry"""
+    name = hashlib.sha1(os.path.abspath(filename).encode('utf-8', 'surrogatepass')).hexdigest()
+    return os.path.join(os.path.expanduser(CACHE_DIR), name + '.json')
+
+
+def write_private_json(filename, obj):
+    """Write obj to JSON file readable only by the current user, replacing any existing file"""
+    directory = os.path.dirname(filename)
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    tmp_file = '%s.%d.tmp' % (filename, os.getpid())
+    with os.fdopen(os.open(tmp_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'w') as f:
+        json.dump(obj, f)
+    os.replace(tmp_file, filename)
+
+
+def load_registry(filename, scannables=None, detectors=None, options=()):
+    """
+    Return Registry from GDA namespace dump, with entries added to the given tables
+    The merged tables are cached as JSON in a private per-user directory (see registry_cache_file), and are
+    read instead of the dump while the modification time of the dump and the given tables are unchanged.
+    :param filename: str filename of JSON or YAML dump
+    :param scannables: {name: info} scannables table, entries in the dump take precedence
+    :param detectors: {name: info} detectors table, entries in the dump take precedence
+    :param options: list of scan options
+    :return: Registry
+    """
+    scannables = scannables or {}
+    detectors = detectors or {}
+    stat = os.stat(filename)
+    tables = hashlib.sha1(repr((scannables, detectors, list(options))).encode()).hexdigest()
+    key = [CACHE_FORMAT, os.path.abspath(filename), stat.st_mtime_ns, stat.st_size, tables]
+    cache_file = registry_cache_file(filename)
+    try:
+        with open(cache_file) as f:
+            cache = json.load(f)
+        if cache['key'] == key:
+            return Registry(cache['scannables'], cache['detectors'], cache['options'])
+    except (OSError, ValueError, KeyError, TypeError, AttributeError):
+        pass
+
+    dump_scannables, dump_detectors, dump_options = read_dump(filename)
+    scannables = {**scannables, **dump_scannables}
+    detectors = {**detectors, **dump_detectors}
+    options = list(dict.fromkeys(list(options) + list(dump_options)))
+    try:
+        write_private_json(cache_file, {
+            'key': key, 'scannables': scannables, 'detectors': detectors, 'options': options
+        })
+    except (OSError, TypeError, ValueError):
+        pass  # e.g. read-only home directory or values that can't be written as JSON
+    return Registry(scannables, detectors, options)
+
+
+def registry_file():
+    """Return filename of GDA namespace dump used by registry(), or None"""
+    return os.environ.get(REGISTRY_ENV) or None
+
+
+def set_registry_file(filename=None):
+    """
+    Set the GDA namespace dump used by registry(), see load_registry
+    The filename is stored in environment variable I16_REGISTRY, so it is also used by sub-processes.
+    :param filename: str filename of JSON or YAML dump, or None to use only the tables in params.py
+    """
+    if filename:
+        os.environ[REGISTRY_ENV] = os.path.abspath(filename)
+    else:
+        os.environ.pop(REGISTRY_ENV, None)
+    _registry_changed()
+
+
+@functools.lru_cache(maxsize=1)
+def _build_registry(version=None, filename=None):
+    if filename:
+        return load_registry(filename, SCANNABLES, DETECTORS, SCANOPTIONS)
+    return Registry(SCANNABLES, DETECTORS, SCANOPTIONS)
+
+
+def registry():
+    """Return Registry of params tables and namespace dump, rebuilt if the tables have changed"""
+    return _build_registry(registry_version(), registry_file())
@@ -0,0 +1,238 @@
+# This Python code is encoded in: utf-8
+"""
+Scan command lexer
+Reads GDA scan command strings (scan, scancn, cscan, rscan, pscan) in a single pass,
+returning typed ScanCommand objects that can be written back out as command strings.
+
+    scan = ScanCommand.from_string('scan eta 20.5 22.8 0.01 checkbeam pil 1 roi2')
+    scan.scan_type  # 'scan'
+    scan.axes  # [('eta', [20.5, 22.8, 0.01])]
+    scan.detectors  # [('pil', 1)]
+    scan.options  # [('checkbeam', []), ('roi2', [])]
+    str(scan)  # 'scan eta 20.5 22.8 0.01 checkbeam pil 1 roi2'
+
+By Dan Porter, PhD
+Diamond Light Source Ltd
+2022
+"""
+
+import re
+import numbers
+
+from i16_script_generator.registry import registry
+
+SCAN_TYPES = ['scan', 'scancn', 'cscan', 'rscan', 'pscan']
+CENTRED_SCAN_TYPES = ['scancn', 'cscan']  # axes have 2 values
+
+re_identifier = re.compile(r'(?<![\w.])([A-Za-z_]\w*)(?![\w.])|;')
+re_token = re.compile(
+    r'\s*(?:(?P<number>[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)'
+    r'|(?P<name>[A-Za-z_][\w.]*)'
+    r'|(?P<open>[\[(])|(?P<close>[\])])|(?P<sep>[,;])|(?P<other>\S))'
+)
+
+
+def is_detector(name):
+    """Return True if name is a detector, see registry.Registry.detector_word"""
+    return registry().detector_word(name) is not None
+
+
+def number(token):
+    """Convert number token to int or float"""
+    if '.' in token or 'e' in token or 'E' in token:
+        return float(token)
+    return int(token)
+
+
+def tokenize(command):
+    """
+    Generator, single pass through command string yielding tokens
+    :param command: str scan command
+    :return: yields (kind, token) where kind is one of 'number', 'name', 'open', 'close', 'sep', 'other'
+    """
+    position = 0
+    length = len(command)
+    while position < length:
+        match = re_token.match(command, position)
+        if match is None or match.lastgroup is None:
+            break  # only whitespace remaining
+        position = match.end()
+        yield match.lastgroup, match.group(match.lastgroup)
+
+
+def canonical_command(command):
+    """
+    Return canonical form of command string, with tokens separated by single spaces and numbers written as floats
+        canonical_command('scan x  1 2.0 1E-1') == canonical_command('scan x 1.0 2 0.1') == 'scan x 1.0 2.0 0.1'
+    """
+    return ' '.join(repr(float(token)) if kind == 'number' else token for kind, token in tokenize(command))
+
+
+def substitute_variables(command, variables, placeholder='0'):
+    """
+    Replace whole identifiers in command that are known variables, in a single pass
+    Numeric values (and lists of numbers) are written into the command, other values are replaced by placeholder.
+    The first two words of each command (e.g. 'scan eta') are never replaced.
+        substitute_variables('scan x1 x 2 0.1 pil 1 roi2', {'x': 1, 'roi': 2}) -> 'scan x1 1 2 0.1 pil 1 roi2'
+    :param command: str scan command
+    :param variables: dict of {name: value}
+    :param placeholder: str used for unknown or non-numeric values
+    :return: str command
+    """
+    words = [0]  # number of words since start of command
+
+    def replace(match):
+        name = match.group(1)
+        if name is None:
+            words[0] = 0  # ';' starts a new command
+            return match.group()
+        words[0] += 1
+        if words[0] <= 2 or name not in variables:
+            return name
+        value = variables[name]
+        try:
+            if isinstance(value, numbers.Number) or all(isinstance(val, numbers.Number) for val in value):
+                return format_value(value)
+        except TypeError:
+            pass
+        return placeholder
+    return re_identifier.sub(replace, command)
+
+
+def read_list(tokens):
+    """Read tokens after an opening bracket, returning nested list of values. Unknown names are 0"""
+    values = []
+    for kind, token in tokens:
+        if kind == 'number':
+            values.append(number(token))
+        elif kind == 'name':
+            values.append(0)
+        elif kind == 'open':
+            values.append(read_list(tokens))
+        elif kind == 'close':
+            break
+    return values
+
+
+def format_value(value, precision=None):
+    """Return string of value, lists are written without spaces e.g. '[0,0,0.1]'"""
+    if hasattr(value, 'tolist'):
+        value = value.tolist()  # numpy arrays and scalars
+    if isinstance(value, (list, tuple)):
+        return '[%s]' % ','.join(format_value(val, precision) for val in value)
+    if isinstance(value, bool) or not isinstance(value, numbers.Number):
+        return str(value)
+    if isinstance(value, numbers.Integral):
+        return '%d' % value
+    return '%.*g' % (precision or 12, value)
+
+
+class ScanCommand:
+    """
+    Scan command
+    Typed representation of a single GDA scan command
+
+        scan = ScanCommand('scancn', [('eta', [0.01, 101]), ('pil', [1]), ('roi2', [])])
+        scan = ScanCommand.from_string('scancn eta 0.01 101 pil 1 roi2')
+
+    Each field of the command is a scannable or detector name followed by a list of values.
+    Fields are classified as:
+        axes: scannables with start, stop, step (or step, nsteps for scancn, halfwidth, step for cscan)
+        detectors: detector names followed by a single exposure time
+        options: any other name, with or without a value e.g. 'checkbeam', 'roi2', 'hkl [0,0,1]'
+    """
+
+    def __init__(self, scan_type='scan', fields=()):
+        self.scan_type = scan_type
+        self.fields = [(name, list(values)) for name, values in fields]
+
+    @classmethod
+    def from_string(cls, command):
+        """Create ScanCommand from command string, returns the first scan in the string or None"""
+        scans = parse_scan_commands(command)
+        return scans[0] if scans else None
+
+    @classmethod
+    def from_args(cls, scan_type, *args):
+        """Create ScanCommand from list of names and values, e.g. ('scan', 'x', 1, 2, 0.1)"""
+        fields = []
+        for arg in args:
+            if isinstance(arg, str):
+                fields.append((arg, []))
+            elif fields:
+                fields[-1][1].append(arg.tolist() if hasattr(arg, 'tolist') else arg)
+        return cls(scan_type, fields)
+
+    def __repr__(self):
+        return 'ScanCommand(%r, %r)' % (self.scan_type, self.fields)
+
+    def __str__(self):
+        return self.command()
+
+    def __eq__(self, other):
+        return isinstance(other, ScanCommand) and (self.scan_type, self.fields) == (other.scan_type, other.fields)
+
+    def field_type(self, name, values):
+        """Return 'axis', 'detector' or 'option' for field"""
+        if len(values) == 3 or (len(values) == 2 and self.scan_type in CENTRED_SCAN_TYPES):
+            return 'axis'
+        if len(values) == 1 and isinstance(values[0], numbers.Number) and is_detector(name):
+            return 'detector'
+        if len(values) > 1:
+            return 'axis'
+        return 'option'
+
+    @property
+    def axes(self):
+        """List of (scannable, values) for scanned axes"""
+        return [(name, values) for name, values in self.fields if self.field_type(name, values) == 'axis']
+
+    @property
+    def detectors(self):
+        """List of (detector, exposure)"""
+        return [(name, values[0]) for name, values in self.fields if self.field_type(name, values) == 'detector']
+
+    @property
+    def options(self):
+        """List of (name, values) for any other field"""
+        return [(name, values) for name, values in self.fields if self.field_type(name, values) == 'option']
+
+    def command(self, precision=None):
+        """Return command string, numbers are written with precision significant figures"""
+        words = [self.scan_type]
+        for name, values in self.fields:
+            words.append(name)
+            words.extend(format_value(value, precision) for value in values)
+        return ' '.join(words)
+
+
+def parse_scan_commands(command):
+    """
+    Parse command string in a single pass, returning a ScanCommand for each scan command in the string
+    Multiple commands can be separated by ';', commands that are not scans are ignored.
+    :param command: str e.g. 'pos x1 1; scan x 1 2 0.1 pil 1'
+    :return: list of ScanCommand
+    """
+    scans = []
+    scan = None
+    start = True  # start of command
+    tokens = tokenize(command)
+    for kind, token in tokens:
+        if start:
+            start = False
+            scan = ScanCommand(token) if kind == 'name' and 'scan' in token else None
+            if scan is not None:
+                scans.append(scan)
+        elif kind == 'sep' and token == ';':
+            start = True
+        elif scan is None:
+            continue
+        elif kind == 'name':
+            scan.fields.append((token, []))
+        elif kind == 'number' and scan.fields:
+            scan.fields[-1][1].append(number(token))
+        elif kind == 'open':
+            values = read_list(tokens)
+            if scan.fields:
+                scan.fields[-1][1].append(values)
+    return scans
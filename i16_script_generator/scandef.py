@@ -9,53 +9,45 @@ Diamond Light Source Ltd
 
 import numpy as np
 
-from i16_script_generator.params import SCANNABLES, DETECTORS, EDGES
+from i16_script_generator.params import EDGES
+from i16_script_generator.scancommand import ScanCommand
+from i16_script_generator.registry import registry, normalise_name
 
 
 def detector_name(name):
-    name = name.lower().replace(' ', '').replace('_', '').replace('-', '')
-    if name in DETECTORS:
-        return name
-    for det_name in DETECTORS:
-        if name in DETECTORS[det_name]['alt names']:
-            return det_name
-    return name
+    """Return canonical detector name from name or alias, see registry.Registry"""
+    det_name = registry().detector(name)
+    return normalise_name(name) if det_name is None else det_name
 
 
 def detector(name, exposure=None):
     name = detector_name(name)
-    if exposure is None:
-        exposure = DETECTORS[name]['exposure']
-    if name not in DETECTORS:
+    info = registry().detector_info(name)
+    if info is None:
         return name
-    return DETECTORS[name]['cmd'] % exposure
+    if exposure is None:
+        exposure = info['exposure']
+    return info['cmd'] % exposure
 
 
 def detector_rois(name):
-    name = detector_name(name)
-    if 'rois' in DETECTORS[name]:
-        return DETECTORS[name]['rois']
-    return []
+    info = registry().detector_info(name)
+    if info is None:
+        return []
+    return info.get('rois', [])
 
 
 def det_desc(name):
-    return '%12s | %s' % (name, DETECTORS[name]['desc'])
+    return '%12s | %s' % (name, registry().detector_info(name)['desc'])
 
 
 def scannable_desc(name):
-    return '%12s | %s' % (name, SCANNABLES[name]['desc'])
+    return '%12s | %s' % (name, registry().scannable_info(name).get('desc', ''))
 
 
 def scannable_speed(name):
     """returns speed, stabilisation_time for given scannable"""
-    speed = 1.0
-    stabilisation = 1.0
-    if name in SCANNABLES:
-        if 'speed' in SCANNABLES[name]:
-            speed = SCANNABLES[name]['speed']
-        if 'stabilisation' in SCANNABLES[name]:
-            stabilisation = SCANNABLES[name]['stabilisation']
-    return speed, stabilisation
+    return registry().scannable_speed(name)
 
 
 def energy_desc(name):
@@ -89,6 +81,41 @@ def scan_range(start, stop=None, step=None, nsteps=None, srange=None):
     return start, stop, step, nsteps, srange
 
 
+def scan_range_many(start, stop=None, step=None, nsteps=None, srange=None):
+    """
+    Broadcasting version of scan_range, calculating scan range values for many scans at once
+      start, stop, step, nsteps, srange = scan_range_many(start, stop, step, nsteps, srange)
+    Inputs are arrays with shape (N,) for N scans of a single motor, or (N, M) for N scans of a scannable
+    with M values (e.g. hkl), arrays of shape (N,) are broadcast against arrays of shape (N, M).
+    :param start: array : start positions (required)
+    :param stop: None or array : if none, requires 2 of step, nsteps, srange
+    :param step: None or array : if none, requires 2 of stop, nsteps, srange
+    :param nsteps: None or array : if none, requires 2 of stop, step, srange
+    :param srange: None or array : if none, requires 2 of stop, step, nsteps
+    :return: start, stop, step, nsteps, srange, where nsteps is an int array with shape (N,)
+    """
+    values = [None if val is None else np.asarray(val, dtype=float) for val in (start, stop, step, nsteps, srange)]
+    if any(val is not None and val.ndim > 1 for val in values):
+        values = [val.reshape(-1, 1) if val is not None and val.ndim == 1 else val for val in values]
+    start, stop, step, nsteps, srange = values
+    if stop is None:
+        if srange is None:
+            srange = step * (np.trunc(nsteps) - 1)
+        stop = start + srange
+    srange = stop - start
+
+    if step is None:
+        step = srange / (nsteps - 1)
+    distance = np.abs(stop - start + step)
+    step_size = np.abs(step)
+    if distance.ndim > 1:
+        distance = np.max(distance, axis=-1)
+    if step_size.ndim > 1:
+        step_size = np.max(step_size, axis=-1)
+    nsteps = np.round(distance / step_size).astype(int)
+    return start, stop, step, nsteps, srange
+
+
 def centred_scan_range(step=None, nsteps=None, srange=None):
     """
     Calculates centred scan range values, given varialbe inputs
@@ -102,14 +129,28 @@ def centred_scan_range(step=None, nsteps=None, srange=None):
     return step, nsteps, srange
 
 
+def centred_scan_range_many(step=None, nsteps=None, srange=None):
+    """
+    Broadcasting version of centred_scan_range, see scan_range_many
+        step, nsteps, srange = centred_scan_range_many(step, nsteps, srange)
+    :param step: None or array : if none, requires nsteps, srange
+    :param nsteps: None or array : if none, requires step, srange
+    :param srange: None or array : if none, requires step, nsteps
+    :return: step, nsteps, srange
+    """
+    start, stop, step, nsteps, srange = scan_range_many(start=0, stop=None, **locals())
+    return step, nsteps, srange
+
+
 def strfmt(value):
     return np.array2string(np.asarray(value), suppress_small=True, separator=',',
                            formatter={'float_kind': lambda x: "%.5g" % x, 'str_kind': lambda x: x})
 
 
 def scangen(scan_type, *args, **kwargs):
-    new_args = [strfmt(arg) for arg in args] + [strfmt(kwargs[arg]) for arg in kwargs]
-    return ' '.join([scan_type] + new_args)
+    """Generate scan command string from names and values, see scancommand.ScanCommand"""
+    scan = ScanCommand.from_args(scan_type, *args, *kwargs.values())
+    return scan.command(precision=5)
 
 
 "================== Scan Types ======================"
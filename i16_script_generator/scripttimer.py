@@ -0,0 +1,599 @@
+# This Python code is encoded in: utf-8
+"""
+Script timer
+Calculates the run time of a script by parsing the whole script using the python ast module.
+
+GDA commands such as "pos x 1" or "scancn eta 0.01 101 pil 1" are first translated into python function calls,
+the script is then parsed once and the tree walked, adding the time of each statement multiplied by the number
+of times it will run in any enclosing loops.
+
+Times per statement:
+    pos command: POS_TIME seconds
+    for loop: LOOP_TIME seconds per loop point
+    w(t), sleep(t), pos w t: t seconds
+    scan commands: see timing.scan_command_time
+    calls to functions defined in the script: time of the function body
+    while loops: body counted once
+    if/else: all branches counted
+
+By Dan Porter, PhD
+Diamond Light Source Ltd
+2022
+"""
+
+import ast
+import difflib
+import operator
+import threading
+
+from i16_script_generator.scancommand import substitute_variables, re_identifier
+from i16_script_generator.gdasyntax import translate_lines, gda_command_name, strip_comment, iter_blocks, GDA_CALL
+from i16_script_generator.timing import lazy_frange, LazyNumpy, eval_range, compile_expression, safe_namespace
+from i16_script_generator.timing import scan_command_time
+
+POS_TIME = 1.0  # time per pos command, s
+LOOP_TIME = 1.0  # time per for loop point, s
+PROGRESS_BLOCKS = 50  # IncrementalTimer progress is reported every PROGRESS_BLOCKS blocks
+SLEEP_FUNCTIONS = ['w', 'sleep']
+POS_COMMANDS = ['pos']
+BLOCK_FIELDS = ['body', 'orelse', 'handlers', 'finalbody', 'cases']
+AUG_OPERATORS = {
+    ast.Add: operator.add, ast.Sub: operator.sub, ast.Mult: operator.mul, ast.Div: operator.truediv,
+    ast.FloorDiv: operator.floordiv, ast.Mod: operator.mod, ast.Pow: operator.pow,
+}
+
+
+def parse_lines(lines, warnings=None, line_offset=0):
+    """
+    Parse list of translated script lines using python ast module
+    Lines that can't be parsed are replaced in lines by "pass" and a warning is added to warnings.
+    If the script still can't be parsed, each top-level block is parsed separately, see parse_blocks
+    :param lines: list of str python lines, see gdasyntax.translate_lines
+    :param warnings: None or list, warning messages are appended
+    :param line_offset: int number of script lines before lines, used in warning messages
+    :return: ast.Module
+    """
+    if warnings is None:
+        warnings = []
+    for attempt in range(len(lines) + 1):
+        try:
+            return ast.parse('\n'.join(lines))
+        except SyntaxError as se:
+            if se.lineno is None or not 0 < se.lineno <= len(lines):
+                break
+            idx = se.lineno - 1
+            msg = str(se.msg)
+            if 'expected an indented block' in msg:
+                # the block header preceding the missing block has no body
+                idx = next((n for n in range(idx - 1, -1, -1) if lines[n].strip()), idx)
+                indent = lines[idx][:len(lines[idx]) - len(lines[idx].lstrip())]
+                replacement = 'pass'
+            else:
+                if isinstance(se, IndentationError):
+                    # use the indent of the previous line
+                    previous = next((lines[n] for n in range(idx - 1, -1, -1) if lines[n].strip()), '')
+                else:
+                    previous = lines[idx]
+                indent = previous[:len(previous) - len(previous.lstrip())]
+                replacement = 'if True:' if strip_comment(lines[idx]).rstrip().endswith(':') else 'pass'
+            if lines[idx] == indent + replacement:
+                break  # replacing the line doesn't fix the error
+            warnings.append('Line %d: %s, line ignored' % (idx + 1 + line_offset, msg))
+            lines[idx] = indent + replacement
+    return parse_blocks(lines, warnings, line_offset)
+
+
+def parse_blocks(lines, warnings=None, line_offset=0):
+    """
+    Parse each top-level block of lines separately, see gdasyntax.iter_blocks
+    Blocks that can't be parsed are ignored and a warning is added to warnings
+    :param lines: list of str python lines, see gdasyntax.translate_lines
+    :param warnings: None or list, warning messages are appended
+    :param line_offset: int number of script lines before lines, used in warning messages
+    :return: ast.Module
+    """
+    if warnings is None:
+        warnings = []
+    body = []
+    for start, block in iter_blocks(lines):
+        try:
+            tree = ast.parse('\n'.join(block))
+        except SyntaxError as se:
+            lineno = start + (se.lineno or 1) + line_offset
+            warnings.append('Line %d: %s, lines %d-%d ignored' % (
+                lineno, se.msg, start + 1 + line_offset, start + len(block) + line_offset))
+            continue
+        ast.increment_lineno(tree, start)
+        body.extend(tree.body)
+    return ast.Module(body=body, type_ignores=[])
+
+
+def parse_script(script, warnings=None):
+    """
+    Translate GDA syntax and parse script using python ast module
+    :param script: str multi-line script
+    :param warnings: None or list, warning messages are appended
+    :return: ast.Module
+    """
+    lines = list(translate_lines(script.replace('\t', '    ').splitlines()))
+    return parse_lines(lines, warnings)
+
+
+def array_length(array):
+    """Return length of array, or 1 if array has no length"""
+    try:
+        return len(array)
+    except TypeError:
+        return 1
+
+
+def first_value(array, default=0):
+    """Return first value of array, or default if array is empty or has no length"""
+    try:
+        return array[0]
+    except (TypeError, IndexError):
+        return default
+
+
+def same_value(value1, value2):
+    """Return True if values are the same type and equal, including arrays"""
+    if value1 is value2:
+        return True
+    try:
+        if type(value1) is not type(value2):
+            return False
+        equal = value1 == value2
+        if isinstance(equal, bool):
+            return equal
+        import numpy as np
+        return bool(np.all(equal))  # arrays
+    except Exception:
+        return False
+
+
+def block_names(tree):
+    """
+    Return names read and stored by the statements of an ast tree
+    Identifiers in GDA commands, e.g. "pos x value", are included in reads.
+    :param tree: ast.Module
+    :return reads: set of names read
+    :return stores: set of names assigned, or defined as functions or classes
+    """
+    reads = set()
+    stores = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Name):
+            if isinstance(node.ctx, ast.Load):
+                reads.add(node.id)
+            else:
+                stores.add(node.id)
+        elif isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            stores.add(node.name)
+        elif isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and node.func.id == GDA_CALL:
+            if node.args and isinstance(node.args[0], ast.Constant):
+                reads.update(name for name in re_identifier.findall(node.args[0].value) if name)
+    return reads, stores
+
+
+def block_key(lines):
+    """Return code of block lines without comments, used to find unchanged blocks"""
+    return tuple(strip_comment(line).rstrip() for line in lines)
+
+
+class ScriptTimer(ast.NodeVisitor):
+    """
+    Script timer
+    Walks the ast tree of a script, calculating the time of each statement.
+
+        timer = ScriptTimer()
+        timer.run(script_string)
+        print(timer.total)  # total time in seconds
+        print(timer.annotated_script())  # script with time comments on scan and loop lines
+    """
+
+    def __init__(self):
+        self.namespace = safe_namespace({'frange': lazy_frange, 'dnp': LazyNumpy()})
+        self.script_vars = {}  # variables assigned in the script
+        self.functions = {}  # time of functions defined in the script
+        self.total = 0.0
+        self.multiplicity = 1
+        self.line_times = {}  # {lineno: seconds} total time of each line
+        self.annotations = {}  # {lineno: str} comment to add to line
+        self.scan_seconds = {}  # {lineno: seconds} time of a single run of the scans on a line
+        self.multiplicities = {}  # {lineno: int} multiplicity of each statement
+        self.warnings = []
+        self.lines = []  # original script lines
+        self.source = []  # translated script lines
+        self.line_offset = 0  # number of script lines before self.lines
+        self.tree = None  # ast of the last block
+
+    def run(self, script):
+        """Time script string, returns total time in seconds"""
+        return self.run_block(script.replace('\t', '    ').splitlines())
+
+    def run_block(self, lines, line_offset=0):
+        """
+        Time a block of complete statements, continuing from any previous blocks, returns total time in seconds
+        Line numbers in line_times, annotations etc. include line_offset. See gdasyntax.iter_blocks
+        :param lines: list of str script lines
+        :param line_offset: int number of script lines before lines
+        :return: float
+        """
+        self.lines = lines
+        self.source = list(translate_lines(lines))
+        self.line_offset = line_offset
+        tree = parse_lines(self.source, self.warnings, line_offset)
+        if line_offset:
+            ast.increment_lineno(tree, line_offset)
+        self.tree = tree
+        self.visit(tree)
+        return self.total
+
+    def add_time(self, lineno, seconds):
+        """Add time to line and total"""
+        seconds = float(seconds) * self.multiplicity
+        self.total += seconds
+        self.line_times[lineno] = self.line_times.get(lineno, 0) + seconds
+
+    def annotate_line(self, lineno, line):
+        """Return line with annotation added to the end, if there is one"""
+        if lineno in self.annotations:
+            return strip_comment(line).rstrip() + self.annotations[lineno]
+        return line
+
+    def annotated_script(self):
+        """Return script string with annotations added to the end of lines"""
+        first = self.line_offset + 1
+        return '\n'.join(self.annotate_line(n, line) for n, line in enumerate(self.lines, first))
+
+    def pop_line(self, lineno):
+        """Remove and return (cost, multiplicity, annotation) of line"""
+        self.scan_seconds.pop(lineno, None)
+        return (
+            self.line_times.pop(lineno, 0.0),
+            self.multiplicities.pop(lineno, None),
+            self.annotations.pop(lineno, None),
+        )
+
+    "------------------------------------------------------------------------"
+    "---------------------------Evaluation-----------------------------------"
+    "------------------------------------------------------------------------"
+
+    def segment(self, node):
+        """Return source code of expression node"""
+        first, last = node.lineno - 1 - self.line_offset, node.end_lineno - 1 - self.line_offset
+        if first == last:
+            line = self.source[first]
+            if line.isascii():
+                return line[node.col_offset:node.end_col_offset]
+            return line.encode()[node.col_offset:node.end_col_offset].decode()
+        lines = [line.encode() for line in self.source[first:last + 1]]
+        lines[-1] = lines[-1][:node.end_col_offset]
+        lines[0] = lines[0][node.col_offset:]
+        return b'\n'.join(lines).decode()
+
+    def compile(self, node):
+        """Compile expression node into code object for eval, compiled code is cached per expression string"""
+        return compile_expression(self.segment(node))[0]
+
+    def evaluate(self, node, default=0):
+        """Evaluate expression node using current script variables, returns default on failure"""
+        if isinstance(node, ast.Constant):
+            return node.value
+        try:
+            return eval(self.compile(node), self.namespace)
+        except Exception:
+            return default
+
+    def loop_values(self, node):
+        """Return values of for loop iterable, ranges are not expanded into arrays, see timing.FloatRange"""
+        try:
+            return eval_range(self.segment(node), self.namespace, as_array=False)
+        except Exception as xx:
+            self.warnings.append('Line %d: loop length unknown: %s' % (node.lineno, xx))
+            return [0]
+
+    def assign(self, target, value, script_var=True):
+        """Assign value to target in namespace"""
+        if isinstance(target, ast.Name):
+            self.namespace[target.id] = value
+            if script_var:
+                self.script_vars[target.id] = value
+        elif isinstance(target, (ast.Tuple, ast.List)):
+            try:
+                values = list(value)
+                if len(values) != len(target.elts):
+                    raise ValueError
+            except (TypeError, ValueError):
+                values = [0] * len(target.elts)
+            for elt, val in zip(target.elts, values):
+                self.assign(elt, val, script_var)
+
+    def scan_time(self, command):
+        """Return scan time of scan command, replacing script variables with their values"""
+        return scan_command_time(substitute_variables(command, self.script_vars))
+
+    "------------------------------------------------------------------------"
+    "---------------------------Statements-----------------------------------"
+    "------------------------------------------------------------------------"
+
+    def visit(self, node):
+        if isinstance(node, ast.stmt):
+            self.multiplicities.setdefault(node.lineno, self.multiplicity)
+        return super().visit(node)
+
+    def generic_visit(self, node):
+        """Visit statements in blocks and function calls in expressions"""
+        for field, value in ast.iter_fields(node):
+            if field in BLOCK_FIELDS:
+                for statement in value:
+                    self.visit(statement)
+            elif isinstance(value, ast.expr):
+                self.visit_calls(value)
+
+    def visit_calls(self, node):
+        """Add time of any function calls in an expression"""
+        if isinstance(node, (ast.Constant, ast.Name)):
+            return
+        for child in ast.walk(node):
+            if isinstance(child, ast.Call):
+                self.call(child)
+
+    def visit_Expr(self, node):
+        value = node.value
+        if isinstance(value, ast.Call) and isinstance(value.func, ast.Name) and value.func.id == GDA_CALL:
+            self.gda_command(value.args[0].value, node.lineno)
+        elif isinstance(value, ast.Name) and value.id in POS_COMMANDS:
+            self.gda_command(value.id, node.lineno)  # bare "pos"
+        else:
+            self.visit_calls(value)
+
+    def visit_Assign(self, node):
+        self.visit_calls(node.value)
+        value = self.evaluate(node.value)
+        for target in node.targets:
+            self.assign(target, value)
+
+    def visit_AugAssign(self, node):
+        self.visit_calls(node.value)
+        if isinstance(node.target, ast.Name):
+            value = self.evaluate(node.value)
+            try:
+                current = self.namespace.get(node.target.id, 0)
+                self.assign(node.target, AUG_OPERATORS[type(node.op)](current, value))
+            except Exception:
+                self.assign(node.target, 0)
+
+    def visit_For(self, node):
+        values = self.loop_values(node.iter)
+        npoints = array_length(values)
+        self.annotations[node.lineno] = '  # %s points' % npoints
+        self.add_time(node.lineno, npoints * LOOP_TIME)
+        self.assign(node.target, first_value(values))  # scans in the loop are timed with the first value
+        multiplicity = self.multiplicity
+        self.multiplicity *= npoints
+        for statement in node.body:
+            self.visit(statement)
+        self.multiplicity = multiplicity
+        for statement in node.orelse:
+            self.visit(statement)
+
+    visit_AsyncFor = visit_For
+
+    def visit_FunctionDef(self, node):
+        """Time the function body once, adding the time at each call. Body lines are not added to line_times"""
+        total, multiplicity, namespace, line_times = self.total, self.multiplicity, self.namespace, self.line_times
+        self.total, self.multiplicity, self.namespace, self.line_times = 0.0, 1, dict(namespace), {}
+        for arg in node.args.args + node.args.kwonlyargs:
+            self.namespace[arg.arg] = 0
+        for statement in node.body:
+            self.visit(statement)
+        self.functions[node.name] = self.total
+        self.total, self.multiplicity, self.namespace, self.line_times = total, multiplicity, namespace, line_times
+        self.namespace[node.name] = lambda *args, **kwargs: 0
+
+    visit_AsyncFunctionDef = visit_FunctionDef
+
+    def call(self, node):
+        """Add time of function call"""
+        func = node.func
+        name = func.id if isinstance(func, ast.Name) else func.attr if isinstance(func, ast.Attribute) else None
+        if name in SLEEP_FUNCTIONS and node.args:
+            self.add_time(node.lineno, self.evaluate(node.args[0], 0))
+        elif name in POS_COMMANDS:
+            self.add_time(node.lineno, POS_TIME)
+        elif isinstance(func, ast.Name) and name in self.functions:
+            self.add_time(node.lineno, self.functions[name])
+
+    def gda_command(self, command, lineno):
+        """Add time of GDA command"""
+        name = gda_command_name(command)
+        if name in POS_COMMANDS:
+            self.add_time(lineno, POS_TIME)
+            words = command.split()
+            if len(words) > 2 and words[1] in SLEEP_FUNCTIONS:
+                try:
+                    self.add_time(lineno, float(words[2]))
+                except ValueError:
+                    pass
+        elif 'scan' in name:
+            try:
+                scan_seconds, scan_points = self.scan_time(command)
+            except Exception as xx:
+                self.warnings.append('Line %d: scan time unknown: %s' % (lineno, xx))
+                return
+            self.add_time(lineno, scan_seconds)
+            # multiple scans on one line are summed
+            self.scan_seconds[lineno] = self.scan_seconds.get(lineno, 0) + scan_seconds
+            self.annotations[lineno] = '  # %.4gs * %s' % (self.scan_seconds[lineno], self.multiplicity)
+
+
+class TimedBlock:
+    """
+    Timing result of a top-level block of a script, see IncrementalTimer
+    Line numbers in line_times and annotations are relative to the first line of the block.
+    """
+
+    def __init__(self, key, reads, stores):
+        self.key = key  # block code without comments
+        self.reads = reads  # names read by the block
+        self.stores = stores  # names assigned or defined by the block
+        self.values = {}  # {name: value} of stored names after the block
+        self.script_vars = set()  # stored names that are script variables
+        self.functions = {}  # {name: seconds} functions defined in the block
+        self.total = 0.0
+        self.line_times = {}
+        self.annotations = {}
+        self.warnings = []
+
+
+class IncrementalTimer:
+    """
+    Incremental script timer
+    Keeps the timing of each top-level block of a script (see gdasyntax.iter_blocks) with the names each
+    block reads and stores. When the script is updated, only changed blocks are re-timed, along with any
+    later blocks that read a name whose value has changed. Loops are top-level blocks, so editing a line in
+    a loop re-times the whole loop.
+
+        timer = IncrementalTimer()
+        timer.update(script)  # times every block
+        timer.update(edited_script)  # times only the edited blocks and their dependents
+        print(timer.total, timer.retimed)
+    """
+
+    def __init__(self):
+        self.blocks = []  # TimedBlock for each block
+        self.starts = []  # first line index of each block
+        self.lines = []
+        self.total = 0.0
+        self.retimed = 0  # number of blocks timed in the last update
+        self._lock = threading.Lock()
+
+    @property
+    def warnings(self):
+        """List of warnings from all blocks"""
+        return [warning for block in self.blocks for warning in block.warnings]
+
+    @property
+    def line_times(self):
+        """{lineno: seconds} total time of each line"""
+        return {start + n: seconds for start, block in zip(self.starts, self.blocks)
+                for n, seconds in block.line_times.items()}
+
+    def annotated_lines(self):
+        """Return {lineno: (line, annotated_line)} for each line with an annotation"""
+        output = {}
+        for start, block in zip(self.starts, self.blocks):
+            for n, annotation in block.annotations.items():
+                line = self.lines[start + n - 1]
+                output[start + n] = (line, strip_comment(line).rstrip() + annotation)
+        return output
+
+    def annotated_script(self):
+        """Return script string with annotations added to the end of lines"""
+        output = list(self.lines)
+        for lineno, (line, annotated) in self.annotated_lines().items():
+            output[lineno - 1] = annotated
+        return '\n'.join(output)
+
+    @staticmethod
+    def apply_block(timer, block):
+        """Set the names stored by a previously timed block in timer"""
+        for name, value in block.values.items():
+            timer.namespace[name] = value
+            if name in block.script_vars:
+                timer.script_vars[name] = value
+        for name, seconds in block.functions.items():
+            timer.functions[name] = seconds
+            timer.namespace[name] = lambda *args, **kwargs: 0
+
+    @staticmethod
+    def time_block(timer, lines, start, key):
+        """Time block of lines using timer, returns TimedBlock"""
+        total = timer.total
+        timer.line_times, timer.annotations, timer.scan_seconds, timer.multiplicities = {}, {}, {}, {}
+        timer.warnings = []
+        timer.run_block(lines, start)
+        reads, stores = block_names(timer.tree)
+        block = TimedBlock(key, reads, stores)
+        block.total = timer.total - total
+        block.line_times = {n - start: seconds for n, seconds in timer.line_times.items()}
+        block.annotations = {n - start: annotation for n, annotation in timer.annotations.items()}
+        block.warnings = timer.warnings
+        for name in stores:
+            if name in timer.functions and name not in timer.script_vars:
+                block.functions[name] = timer.functions[name]
+            elif name in timer.namespace:
+                block.values[name] = timer.namespace[name]
+                if name in timer.script_vars:
+                    block.script_vars.add(name)
+        return block
+
+    def update(self, script, progress=None, cancel=None):
+        """
+        Update the timing of script, re-timing only changed blocks and blocks that depend on them
+        Can be run in a background thread, the timer is only changed once the update is complete.
+        :param script: str multi-line script
+        :param progress: None or function(n, nblocks) called as blocks are timed
+        :param cancel: None or threading.Event, if set the update stops and returns None
+        :return: float total time in seconds, or None if cancelled
+        """
+        lines = script.replace('\t', '    ').splitlines()
+        new_blocks = list(iter_blocks(lines))
+        keys = [block_key(lines) for start, lines in new_blocks]
+        old_blocks = self.blocks
+        # match unchanged blocks between the old and new scripts, first at the start and end of the script
+        prefix = 0
+        while prefix < min(len(keys), len(old_blocks)) and keys[prefix] == old_blocks[prefix].key:
+            prefix += 1
+        suffix = 0
+        while suffix < min(len(keys), len(old_blocks)) - prefix and keys[-1 - suffix] == old_blocks[-1 - suffix].key:
+            suffix += 1
+        matched = {n: old_blocks[n] for n in range(prefix)}  # {new index: old block}
+        matched.update((len(keys) - n, old_blocks[-n]) for n in range(1, suffix + 1))
+        old_middle = old_blocks[prefix:len(old_blocks) - suffix]
+        matcher = difflib.SequenceMatcher(None, [block.key for block in old_middle], keys[prefix:len(keys) - suffix],
+                                          autojunk=False)
+        for old_idx, new_idx, size in matcher.get_matching_blocks():
+            for n in range(size):
+                matched[prefix + new_idx + n] = old_middle[old_idx + n]
+        # names stored by removed or changed blocks may have changed
+        dirty = set()
+        unchanged = {id(block) for block in matched.values()}
+        for block in old_blocks:
+            if id(block) not in unchanged:
+                dirty.update(block.stores)
+
+        timer = ScriptTimer()
+        blocks = []
+        retimed = 0
+        for n, ((start, block_lines), key) in enumerate(zip(new_blocks, keys)):
+            if cancel is not None and cancel.is_set():
+                return None
+            if progress is not None and n % PROGRESS_BLOCKS == 0:
+                progress(n, len(new_blocks))
+            previous = matched.get(n)
+            if previous is not None and not previous.reads & dirty:
+                self.apply_block(timer, previous)
+                blocks.append(previous)
+                continue
+            block = self.time_block(timer, block_lines, start, key)
+            retimed += 1
+            if previous is None:
+                dirty.update(block.stores)
+            else:
+                changed = {name for name in block.stores | previous.stores
+                           if not same_value(block.values.get(name), previous.values.get(name))
+                           or block.functions.get(name) != previous.functions.get(name)}
+                dirty = (dirty - block.stores) | changed
+            blocks.append(block)
+
+        with self._lock:
+            if cancel is not None and cancel.is_set():
+                return None
+            self.lines = lines
+            self.blocks = blocks
+            self.starts = [start for start, block_lines in new_blocks]
+            self.retimed = retimed
+            self.total = sum(block.total for block in blocks)
+        return self.total
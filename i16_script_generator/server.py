@@ -0,0 +1,377 @@
+"""
+Local timing service
+HTTP/JSON server that keeps the registry, compiled expressions and timing caches in memory, so other tools
+(GDA, shell scripts) can time scans and scripts without starting Python for each call.
+Connections are kept open between requests (HTTP/1.1), over a Unix domain socket or localhost TCP.
+
+By default the server listens on a Unix domain socket readable only by the current user
+(~/.cache/i16_script_generator/timing.sock). Over TCP, every request must send the server token in an
+"Authorization: Bearer <token>" header. The token is written to ~/.cache/i16_script_generator/timing.token
+(readable only by the current user), where TimingClient reads it. POST requests must have
+Content-Type application/json. Loop ranges and variables in scripts are evaluated without builtins or
+attribute access, see timing.compile_expression.
+
+    $ python -m i16_script_generator.server
+    $ python -m i16_script_generator.server --port 8416
+
+Requests are POSTed as JSON objects:
+    POST /scan_command_time  {"command": "scancn eta 0.01 101 pil 1"}
+        -> {"seconds": 203.0, "points": 101, "duration": "3 mins, 23s"}
+    POST /time_script_string  {"script": "..."}
+        -> {"seconds": 3600.0, "duration": "1 hours, 0s", "annotated": "..."}
+    POST /batch  {"requests": [{"method": "scan_command_time", "command": "..."}, ...]}
+        -> {"results": [{...}, ...]}
+    GET /status
+        -> {"version": "1.0.0", "registry": "...", "requests": 10}
+
+    client = TimingClient()  # or TimingClient(port=8416)
+    seconds, points = client.scan_command_time('scancn eta 0.01 101 pil 1')
+
+By Dan Porter, PhD
+Diamond Light Source Ltd
+2022
+"""
+
+import os
+import hmac
+import json
+import socket
+import secrets
+import threading
+import http.client
+import socketserver
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from i16_script_generator import __version__
+from i16_script_generator.registry import registry
+from i16_script_generator.timing import scan_command_time, time_script_string, time_string
+
+DEFAULT_HOST = '127.0.0.1'  # only accept local connections
+DEFAULT_PORT = 8416  # suggested TCP port, the server uses a Unix domain socket unless a port is given
+SERVER_DIR = os.path.join('~', '.cache', 'i16_script_generator')  # private directory of socket and token files
+DEFAULT_SOCKET = os.path.join(SERVER_DIR, 'timing.sock')
+TOKEN_FILE = os.path.join(SERVER_DIR, 'timing.token')
+TOKEN_ENV = 'I16_TIMING_TOKEN'  # environment variable with the token of a TCP server
+MAX_REQUEST_BYTES = 16 * 1024 * 1024  # largest accepted request body
+
+
+def request_scan_command_time(request):
+    """Time scan command, request = {"command": str}"""
+    seconds, points = scan_command_time(request['command'])
+    return {'seconds': float(seconds), 'points': int(points), 'duration': time_string(float(seconds))}
+
+
+def request_time_script_string(request):
+    """Time script, request = {"script": str, "cache": bool}"""
+    tot_time, annotated = time_script_string(request['script'], request.get('cache', False))
+    seconds = tot_time.total_seconds()
+    return {'seconds': seconds, 'duration': time_string(seconds), 'annotated': annotated}
+
+
+def request_batch(request):
+    """Run many requests, request = {"requests": [{"method": str, ...}, ...]}, failed requests return an error"""
+    results = []
+    for item in request['requests']:
+        try:
+            if item.get('method') == 'batch':
+                raise ValueError('batch requests can not be nested')
+            results.append(run_request(item['method'], item))
+        except Exception as xx:
+            results.append({'error': '%s: %s' % (type(xx).__name__, xx)})
+    return {'results': results}
+
+
+METHODS = {
+    'scan_command_time': request_scan_command_time,
+    'time_script_string': request_time_script_string,
+    'batch': request_batch,
+}
+
+
+def run_request(method, request):
+    """Return dict result of request, raises KeyError for unknown methods or missing parameters"""
+    if method not in METHODS:
+        raise KeyError('unknown method %r, available: %s' % (method, ', '.join(METHODS)))
+    return METHODS[method](request)
+
+
+class TimingRequestHandler(BaseHTTPRequestHandler):
+    """HTTP/JSON request handler, the path of each request is the method name, see METHODS"""
+    protocol_version = 'HTTP/1.1'  # keep connections open
+    server_version = 'I16Timing/%s' % __version__
+
+    def setup(self):
+        super().setup()
+        if self.connection.family != socket.AF_UNIX:
+            # headers and body are written separately, don't wait for the ack of the headers
+            self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, True)
+
+    def send_json(self, status, result):
+        body = json.dumps(result).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def authorised(self):
+        """Return True if the request has the server token, or is on a Unix domain socket, otherwise send 401"""
+        token = self.server.token
+        if token is None:
+            return True
+        header = self.headers.get('Authorization', '')
+        if hmac.compare_digest(header.encode(), ('Bearer %s' % token).encode()):
+            return True
+        self.close_connection = True
+        self.send_json(401, {'error': 'missing or wrong token, see %s' % TOKEN_FILE})
+        return False
+
+    def do_GET(self):
+        if not self.authorised():
+            return
+        if self.path.strip('/') != 'status':
+            return self.send_json(404, {'error': 'GET /status, or POST to: %s' % ', '.join(METHODS)})
+        self.send_json(200, {
+            'version': __version__,
+            'registry': repr(registry()),
+            'methods': list(METHODS),
+            'requests': self.server.requests,
+        })
+
+    def do_POST(self):
+        if not self.authorised():
+            return
+        if self.headers.get_content_type() != 'application/json':
+            self.close_connection = True
+            return self.send_json(415, {'error': 'Content-Type must be application/json'})
+        length = int(self.headers.get('Content-Length', 0))
+        if length > MAX_REQUEST_BYTES:
+            self.close_connection = True
+            return self.send_json(413, {'error': 'request larger than %d bytes' % MAX_REQUEST_BYTES})
+        body = self.rfile.read(length)
+        self.server.requests += 1
+        try:
+            request = json.loads(body or b'{}')
+            result = run_request(self.path.strip('/'), request)
+        except Exception as xx:
+            return self.send_json(400, {'error': '%s: %s' % (type(xx).__name__, xx)})
+        self.send_json(200, result)
+
+    def address_string(self):
+        # client_address is an empty string for Unix domain sockets
+        return self.client_address[0] if self.client_address else 'unix'
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+class TimingServer(ThreadingHTTPServer):
+    """Threaded HTTP timing server on a TCP port, requests must send the token, see new_token"""
+    daemon_threads = True
+    verbose = False
+    requests = 0
+    token = None
+
+
+class UnixTimingServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """Threaded HTTP timing server on a Unix domain socket, readable and writable only by the current user"""
+    daemon_threads = True
+    verbose = False
+    requests = 0
+    token = None
+
+    def server_bind(self):
+        os.makedirs(os.path.dirname(self.server_address) or '.', mode=0o700, exist_ok=True)
+        if os.path.exists(self.server_address):
+            os.remove(self.server_address)  # left by a previous server
+        umask = os.umask(0o177)
+        try:
+            super().server_bind()
+        finally:
+            os.umask(umask)
+        os.chmod(self.server_address, 0o600)
+
+
+def new_token(token_file=None):
+    """Return new random token for a TCP server, written to token_file (default TOKEN_FILE) readable only by the user"""
+    token = secrets.token_urlsafe(32)
+    token_file = os.path.expanduser(token_file or TOKEN_FILE)
+    os.makedirs(os.path.dirname(token_file), mode=0o700, exist_ok=True)
+    if os.path.exists(token_file):
+        os.remove(token_file)
+    with os.fdopen(os.open(token_file, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600), 'w') as f:
+        f.write(token)
+    return token
+
+
+def read_token(token_file=None):
+    """Return token of a TCP server from environment variable I16_TIMING_TOKEN or token_file (default TOKEN_FILE)"""
+    token = os.environ.get(TOKEN_ENV)
+    if token:
+        return token
+    try:
+        with open(os.path.expanduser(token_file or TOKEN_FILE)) as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+def warm_up():
+    """Build the registry and import the timing modules before the first request"""
+    registry()
+    scan_command_time('scan x 1 2 1 pil 1')
+    time_script_string('pos x 1', cache=False)
+
+
+def make_server(host=DEFAULT_HOST, port=None, socket_file=None, verbose=False, token=None):
+    """
+    Create timing server, run using server.serve_forever()
+    :param host: str host name, use localhost to only accept local connections
+    :param port: None or int TCP port, 0 to choose a free port (see server.server_address). If None, the server
+        uses a Unix domain socket
+    :param socket_file: None or str Unix domain socket filename, default DEFAULT_SOCKET
+    :param verbose: if True, log each request
+    :param token: None or str token required by a TCP server, None to create one, see new_token
+    :return: TimingServer or UnixTimingServer
+    """
+    if port is None:
+        server = UnixTimingServer(os.path.expanduser(socket_file or DEFAULT_SOCKET), TimingRequestHandler)
+    else:
+        server = TimingServer((host, port), TimingRequestHandler)
+        server.token = token or new_token()
+    server.verbose = verbose
+    warm_up()
+    return server
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    """HTTPConnection over a Unix domain socket"""
+
+    def __init__(self, socket_file, timeout=60):
+        super().__init__('localhost', timeout=timeout)
+        self.socket_file = socket_file
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_file)
+
+
+class TimingClient:
+    """
+    Client for the timing server, keeping the connection open between requests
+        client = TimingClient()  # or TimingClient(port=8416)
+        seconds, points = client.scan_command_time('scan x 1 2 0.1 pil 1')
+        total_seconds, annotated = client.time_script_string(script)
+    :param host: str server host name
+    :param port: None or int server port, if None the Unix domain socket is used
+    :param socket_file: None or str Unix domain socket filename, default DEFAULT_SOCKET
+    :param timeout: float seconds to wait for a response
+    :param token: None or str token of a TCP server, None to use read_token
+    """
+
+    def __init__(self, host=DEFAULT_HOST, port=None, socket_file=None, timeout=60, token=None):
+        self.headers = {}
+        if port is None:
+            self.connection = UnixHTTPConnection(os.path.expanduser(socket_file or DEFAULT_SOCKET), timeout)
+        else:
+            self.connection = http.client.HTTPConnection(host, port, timeout=timeout)
+            token = token or read_token()
+            if token:
+                self.headers['Authorization'] = 'Bearer %s' % token
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return 'TimingClient(%r)' % getattr(self.connection, 'socket_file', self.connection.host)
+
+    def request(self, method, **params):
+        """Send request, returns dict result, raises RuntimeError if the server returns an error"""
+        body = json.dumps(params).encode()
+        headers = {'Content-Type': 'application/json', **self.headers}
+        with self._lock:
+            try:
+                self.connection.request('POST', '/' + method, body, headers)
+                response = self.connection.getresponse()
+            except (http.client.RemoteDisconnected, BrokenPipeError, ConnectionResetError):
+                # server closed the idle connection, reconnect once
+                self.connection.close()
+                self.connection.request('POST', '/' + method, body, headers)
+                response = self.connection.getresponse()
+            result = json.loads(response.read())
+        if response.status != 200:
+            raise RuntimeError(result.get('error', response.reason))
+        return result
+
+    def status(self):
+        """Return dict of server status"""
+        with self._lock:
+            self.connection.request('GET', '/status', headers=self.headers)
+            response = self.connection.getresponse()
+            result = json.loads(response.read())
+        if response.status != 200:
+            raise RuntimeError(result.get('error', response.reason))
+        return result
+
+    def scan_command_time(self, command):
+        """Return scan time in seconds and number of points, see timing.scan_command_time"""
+        result = self.request('scan_command_time', command=command)
+        return result['seconds'], result['points']
+
+    def time_script_string(self, script_string, cache=False):
+        """Return total time in seconds and annotated script, see timing.time_script_string"""
+        result = self.request('time_script_string', script=script_string, cache=cache)
+        return result['seconds'], result['annotated']
+
+    def batch(self, requests):
+        """Run list of requests {"method": str, ...} in one call, returns list of results"""
+        return self.request('batch', requests=requests)['results']
+
+    def close(self):
+        self.connection.close()
+
+
+def main(argv=None):
+    """
+    Command line timing server
+        $ python -m i16_script_generator.server
+        $ python -m i16_script_generator.server --port 8416
+    """
+    import argparse
+    parser = argparse.ArgumentParser(
+        prog='python -m i16_script_generator.server',
+        description='Local HTTP/JSON service timing I16 scan commands and scripts'
+    )
+    parser.add_argument('--host', default=DEFAULT_HOST, help='host name, default: %s' % DEFAULT_HOST)
+    parser.add_argument('-p', '--port', type=int, default=None,
+                        help='TCP port (e.g. %d), requests must send the token in %s' % (DEFAULT_PORT, TOKEN_FILE))
+    parser.add_argument('-s', '--socket', default=None, help='Unix domain socket file, default: %s' % DEFAULT_SOCKET)
+    parser.add_argument('-v', '--verbose', action='store_true', help='log each request')
+    parser.add_argument('--registry', default=None, help='JSON or YAML dump of the GDA namespace')
+    parser.add_argument('--no-cache', action='store_true', help='re-time every script, ignoring the timing cache')
+    args = parser.parse_args(argv)
+    if args.registry:
+        from i16_script_generator.registry import set_registry_file
+        set_registry_file(args.registry)
+    if args.no_cache:
+        from i16_script_generator.timingcache import disable_cache
+        disable_cache()
+
+    server = make_server(args.host, args.port, args.socket, args.verbose, os.environ.get(TOKEN_ENV))
+    if args.port is None:
+        print('I16 timing server listening on %s' % server.server_address)
+    else:
+        print('I16 timing server listening on http://%s:%d' % server.server_address[:2])
+        print('   token: %s' % (TOKEN_ENV if os.environ.get(TOKEN_ENV) else os.path.expanduser(TOKEN_FILE)))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if args.port is None and os.path.exists(server.server_address):
+            os.remove(server.server_address)
+
+
+if __name__ == '__main__':
+    main()
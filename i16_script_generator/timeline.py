@@ -0,0 +1,298 @@
+"""
+Script timeline
+Index of when each statement of a script runs, for shift planning and handover notes.
+
+The script is timed once using a dry run (see dryrun), recording each timed statement in the order it runs:
+its duration, line number and the iteration of each enclosing loop. The start of each record is the prefix
+sum of the durations, so queries are answered by bisection without re-timing the script:
+    timeline = script_timeline(script)
+    timeline.at(3 * 3600)  # TimelineRecord running 3 hours after the start of the script
+    timeline.remaining(lineno)  # seconds from the first run of line lineno to the end of the script
+    timeline.iteration_start(loop_lineno, 5)  # seconds from the start of the script to loop iteration 5
+
+    $ python -m i16_script_generator.timeline script.py --every 1
+    $ python -m i16_script_generator.timeline script.py --at 3.5 --from-line 20
+
+By Dan Porter, PhD
+Diamond Light Source Ltd
+2022
+"""
+
+import ast
+import array
+import bisect
+import itertools
+import collections
+
+from i16_script_generator.dryrun import DryRun, MAX_STEPS, MAX_TIME
+from i16_script_generator.timing import time_string
+
+TimelineRecord = collections.namedtuple('TimelineRecord', ['start', 'duration', 'lineno', 'iterations', 'command'])
+ScriptLoop = collections.namedtuple('ScriptLoop', ['lineno', 'first', 'last'])  # header line, body line range
+
+
+class ScriptTimeline:
+    """
+    Timeline of a script, with the start, duration, loop iterations and command of each timed statement
+        timeline = ScriptTimeline(lines, durations, linenos, iterations, iteration_starts)
+        record = timeline.at(seconds)
+    :param lines: list of str script lines
+    :param durations: sequence of float seconds of each record, in the order they run
+    :param linenos: sequence of int line number of each record
+    :param iterations: sequence of tuple iteration of each enclosing loop of each record, outermost first
+    :param iteration_starts: {(loop_lineno, iterations): seconds} start of each loop iteration
+    :param stopped: None or str reason the dry run was stopped
+    """
+
+    def __init__(self, lines, durations, linenos, iterations, iteration_starts=None, stopped=None):
+        self.lines = lines
+        self.durations = array.array('d', durations)
+        self.linenos = array.array('l', linenos)
+        self.iterations = list(iterations)
+        self.stopped = stopped
+        # prefix sum of durations: starts[n] is the start of record n, starts[-1] is the total time
+        self.starts = array.array('d', itertools.accumulate(self.durations, initial=0.0))
+        self.iteration_starts = dict(iteration_starts or {})
+        self.first_iterations = {}  # {(loop_lineno, iteration): seconds} first start of each iteration number
+        for (lineno, loop_iterations), seconds in sorted(self.iteration_starts.items(), key=lambda x: x[1]):
+            self.first_iterations.setdefault((lineno, loop_iterations[-1]), seconds)
+        # first_record[lineno]: index of the first record run at or after line lineno of the script
+        self.first_record = [len(self.durations)] * (len(lines) + 2)
+        for index in range(len(self.linenos) - 1, -1, -1):
+            lineno = min(max(self.linenos[index], 0), len(lines) + 1)
+            self.first_record[lineno] = index
+        for lineno in range(len(lines), -1, -1):
+            self.first_record[lineno] = min(self.first_record[lineno], self.first_record[lineno + 1])
+
+    def __repr__(self):
+        return 'ScriptTimeline(%d records, %s)' % (len(self), time_string(self.total))
+
+    def __len__(self):
+        return len(self.durations)
+
+    def __getitem__(self, index):
+        return self.record(index)
+
+    def __iter__(self):
+        return (self.record(index) for index in range(len(self)))
+
+    @property
+    def total(self):
+        """Total time in seconds"""
+        return self.starts[-1]
+
+    def command(self, lineno):
+        """Return str command on script line lineno"""
+        if 0 < lineno <= len(self.lines):
+            return self.lines[lineno - 1].strip()
+        return ''
+
+    def record(self, index):
+        """Return TimelineRecord(start, duration, lineno, iterations, command) of record index"""
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('timeline record %d out of range' % index)
+        lineno = self.linenos[index]
+        return TimelineRecord(
+            self.starts[index], self.durations[index], lineno, self.iterations[index], self.command(lineno)
+        )
+
+    def index_at(self, seconds):
+        """Return index of the record running at seconds from the start, or None if outside the script"""
+        if not 0 <= seconds < self.total:
+            return None
+        return bisect.bisect_right(self.starts, seconds) - 1
+
+    def at(self, seconds):
+        """Return TimelineRecord running at seconds from the start of the script, or None if outside the script"""
+        index = self.index_at(seconds)
+        return None if index is None else self.record(index)
+
+    def between(self, start, end):
+        """Return list of TimelineRecords running between start and end seconds"""
+        first = max(bisect.bisect_right(self.starts, start) - 1, 0)
+        last = min(bisect.bisect_left(self.starts, end), len(self))
+        return [self.record(index) for index in range(first, last)]
+
+    def line_start(self, lineno):
+        """Return seconds from the start of the script to the first run of line lineno, or later lines"""
+        lineno = min(max(lineno, 0), len(self.lines) + 1)
+        return self.starts[self.first_record[lineno]]
+
+    def remaining(self, lineno):
+        """Return seconds from the first run of line lineno to the end of the script"""
+        return self.total - self.line_start(lineno)
+
+    def iteration_start(self, lineno, *iterations):
+        """
+        Return seconds from the start of the script to the start of a loop iteration
+            timeline.iteration_start(10, 3)  # start of iteration 3 (from 0) of loop on line 10
+            timeline.iteration_start(12, 3, 0)  # first iteration of loop on line 12, inside iteration 3 of line 10
+        For a nested loop, a single iteration returns the first time that iteration starts.
+        :param lineno: int line number of the for or while statement
+        :param iterations: int iteration of the loop, preceded by the iterations of enclosing loops
+        :return: float seconds, or None if the iteration doesn't run
+        """
+        seconds = self.iteration_starts.get((lineno, iterations))
+        if seconds is None and len(iterations) == 1:
+            seconds = self.first_iterations.get((lineno, iterations[0]))
+        return seconds
+
+    def schedule(self, interval=3600.):
+        """Return list of TimelineRecords running at each interval from the start of the script"""
+        return [self.at(n * interval) for n in range(int(self.total // interval) + 1) if n * interval < self.total]
+
+
+class TimelineRun(DryRun):
+    """
+    Dry run recording each timed statement and the start of each loop iteration, see ScriptTimeline
+        run = TimelineRun()
+        run.run(script)
+        timeline = run.timeline()
+    """
+
+    def __init__(self, max_steps=MAX_STEPS, max_time=MAX_TIME, readbacks=None):
+        super().__init__(max_steps, max_time, readbacks)
+        self.loop_headers = {}  # {lineno of for or while statement: ScriptLoop}
+        self.active_loops = []  # [[frame, ScriptLoop, iteration], ...] outermost first
+        self.loop_iterations = ()  # iteration of each active loop
+        self.record_durations = array.array('d')
+        self.record_linenos = array.array('l')
+        self.record_iterations = []  # identical tuples are shared between records
+        self.record_step = -1  # step of the last record
+        self.iteration_starts = {}
+        self.next_iteration = None  # (active loop, key, seconds) start of an iteration that may not run
+
+    def build_namespace(self, tree):
+        """Add simulated namespace and find the loops of the script"""
+        super().build_namespace(tree)
+        for node in ast.walk(tree):
+            if isinstance(node, (ast.For, ast.While)):
+                self.loop_headers[node.lineno] = ScriptLoop(node.lineno, node.lineno, node.end_lineno)
+
+    def advance(self, seconds):
+        """Advance the virtual clock, recording the time of the current statement"""
+        if seconds > 0:
+            self.start_iteration()
+            if self.record_step == self.steps and self.record_linenos and self.record_linenos[-1] == self.lineno:
+                self.record_durations[-1] += seconds  # several commands in one statement
+            else:
+                self.record_durations.append(seconds)
+                self.record_linenos.append(self.lineno)
+                self.record_iterations.append(self.loop_iterations)
+                self.record_step = self.steps
+        super().advance(seconds)
+
+    def trace_line(self, frame, event, arg):
+        """Count executed lines and the iterations of loops"""
+        loops = self.active_loops
+        if event == 'line':
+            lineno = frame.f_lineno
+            # leave loops of this frame that don't contain the line
+            while loops and loops[-1][0] is frame and not loops[-1][1].first <= lineno <= loops[-1][1].last:
+                self.leave_loop()
+            # any other line runs within the iteration started by the last loop header
+            self.start_iteration()
+            # the loop header runs before each iteration, and once more when the loop finishes
+            loop = self.loop_headers.get(lineno)
+            if loop is not None:
+                if loops and loops[-1][0] is frame and loops[-1][1] is loop:
+                    loops[-1][2] += 1
+                else:
+                    loops.append([frame, loop, 0])
+                self.next_iteration = (loops[-1], (loop.lineno, self.current_iterations()), self.clock.time)
+            elif len(loops) != len(self.loop_iterations):
+                self.current_iterations()
+        elif event == 'return':
+            while loops and loops[-1][0] is frame:
+                self.leave_loop()
+            self.current_iterations()
+        return super().trace_line(frame, event, arg)
+
+    def start_iteration(self):
+        """Record the start of the iteration begun by the last loop header, once the iteration runs"""
+        if self.next_iteration is not None:
+            active_loop, key, seconds = self.next_iteration
+            self.iteration_starts.setdefault(key, seconds)
+            self.next_iteration = None
+
+    def leave_loop(self):
+        """Remove the innermost active loop, dropping the iteration started when its header last ran"""
+        active_loop = self.active_loops.pop()
+        if self.next_iteration is not None and self.next_iteration[0] is active_loop:
+            self.next_iteration = None
+
+    def current_iterations(self):
+        """Update and return tuple of the iteration of each active loop"""
+        self.loop_iterations = tuple(iteration for frame, loop, iteration in self.active_loops)
+        return self.loop_iterations
+
+    def timeline(self):
+        """Return ScriptTimeline of the run"""
+        return ScriptTimeline(
+            self.lines, self.record_durations, self.record_linenos, self.record_iterations,
+            self.iteration_starts, self.stopped
+        )
+
+
+def script_timeline(script, max_steps=MAX_STEPS, max_time=MAX_TIME, readbacks=None):
+    """
+    Return ScriptTimeline of script, timed using a dry run, see dryrun.DryRun
+    :param script: str multi-line GDA script
+    :param max_steps: int maximum number of executed script lines
+    :param max_time: float maximum virtual time in seconds
+    :param readbacks: {readback: setpoint} readback scannables, default dryrun.READBACKS
+    :return: ScriptTimeline
+    """
+    run = TimelineRun(max_steps, max_time, readbacks)
+    run.run(script)
+    return run.timeline()
+
+
+def record_string(record):
+    """Return str description of TimelineRecord"""
+    if record is None:
+        return 'script finished'
+    loops = ', iteration %s' % ','.join(str(n) for n in record.iterations) if record.iterations else ''
+    return 'line %d%s: %s  (started T+%s)' % (record.lineno, loops, record.command, time_string(record.start))
+
+
+def main(argv=None):
+    """
+    Command line script timeline
+        $ python -m i16_script_generator.timeline script.py --every 1
+        $ python -m i16_script_generator.timeline script.py --at 3.5 --from-line 20
+    """
+    import argparse
+    parser = argparse.ArgumentParser(
+        prog='python -m i16_script_generator.timeline',
+        description='List what an I16 script is running at times after it starts'
+    )
+    parser.add_argument('script', help='script file')
+    parser.add_argument('--every', type=float, default=1.0, help='list the running command every N hours')
+    parser.add_argument('--at', type=float, nargs='*', default=[], help='hours after the start of the script')
+    parser.add_argument('--from-line', type=int, nargs='*', default=[], help='print time remaining from line')
+    parser.add_argument('--max-steps', type=int, default=MAX_STEPS, help='maximum number of executed lines')
+    parser.add_argument('--max-hours', type=float, default=MAX_TIME / 3600, help='maximum virtual time in hours')
+    parser.add_argument('--registry', default=None, help='JSON or YAML dump of the GDA namespace')
+    args = parser.parse_args(argv)
+    if args.registry:
+        from i16_script_generator.registry import set_registry_file
+        set_registry_file(args.registry)
+
+    with open(args.script) as f:
+        timeline = script_timeline(f.read(), args.max_steps, args.max_hours * 3600)
+    hours = args.at if args.at or args.from_line else [n * args.every for n in range(
+        int(timeline.total / 3600 // args.every) + 1)]
+    for hour in hours:
+        print('At %6.3g hours: %s' % (hour, record_string(timeline.at(hour * 3600))))
+    for lineno in args.from_line:
+        print('Remaining from line %d: %s' % (lineno, time_string(timeline.remaining(lineno))))
+    print('   Total time: %s (%d timed statements)' % (time_string(timeline.total), len(timeline)))
+    if timeline.stopped:
+        print('   Stopped: %s' % timeline.stopped)
+
+
+if __name__ == '__main__':
+    main()
@@ -9,19 +9,43 @@ Diamond Light Source Ltd
 2022
 """
 
-import numpy as np
 import re
+import ast
+import math
 import datetime
-
-from i16_script_generator.params import DETECTORS
-from i16_script_generator.scandef import centred_scan_range, scannable_speed, scan_range
+import collections
+import functools
+import builtins
+import types
+
+from i16_script_generator.params import registry_version
+from i16_script_generator.scancommand import parse_scan_commands, canonical_command, is_detector
+
+SCAN_CACHE_SIZE = 1024  # maximum number of cached scan command times
+EVAL_CACHE_SIZE = 4096  # maximum number of cached compiled expressions
+# builtins available to evaluated script expressions, see compile_expression
+SAFE_BUILTINS = {name: getattr(builtins, name) for name in [
+    'abs', 'all', 'any', 'bool', 'divmod', 'enumerate', 'float', 'int', 'len', 'list', 'max', 'min', 'pow',
+    'range', 'reversed', 'round', 'sorted', 'str', 'sum', 'tuple', 'zip', 'True', 'False', 'None',
+]}
+BUILTINS = frozenset(SAFE_BUILTINS)
+# attributes that can be used in evaluated script expressions, {name: attributes}
+SAFE_ATTRIBUTES = {
+    'dnp': frozenset([
+        'arange', 'linspace', 'logspace', 'array', 'asarray', 'concatenate', 'append', 'hstack', 'ones', 'zeros',
+        'abs', 'round', 'floor', 'ceil', 'sqrt', 'exp', 'log', 'log10', 'sin', 'cos', 'tan', 'arcsin', 'arccos',
+        'arctan', 'deg2rad', 'rad2deg', 'radians', 'degrees', 'pi', 'min', 'max', 'sum', 'flip', 'sort',
+    ]),
+}
+
+STREAM_CHUNK_LINES = 100  # lines timed together by iter_script_timing
+STREAM_ENGINE = 'iter_script_timing'  # engine name of timing cache entries of script_file_timing
+LineTiming = collections.namedtuple('LineTiming', ['lineno', 'line', 'annotated', 'cumulative', 'multiplicity', 'cost'])
 
 re_scan = re.compile(r' \w+ -?\d+\.?\d* -?\d+\.?\d* -?\d+\.?\d*')  # scannable, start, stop, step
 re_scancn = re.compile(r' \w+ -?\d+\.?\d* \d+')  # scannable, step, nsteps
 re_cscan = re.compile(r' \w+ -?\d+\.?\d* -?\d+\.?\d*')  # scannable, range, step
-detector_list = [DETECTORS[det]['regex'] for det in DETECTORS]
-re_detector = re.compile('|'.join([r'\s%s\s+\.?\d+\.?\d*' % det for det in detector_list]))
-re_errorname = re.compile(r"'([^']*)'")
+re_name_number = re.compile(r'(?<!\S)(\w+)\s+(\.?\d+\.?\d*)')  # name, number
 re_lists_or_float = re.compile(r'\[.+?\]|\(.+?\)|-?\.?\d+\.?\d*')
 re_variables = re.compile(r'[a-zA-Z]\w*')
 re_assignment = re.compile(r'^\s*[\w_,\s]+\s*=[^=]+')
@@ -32,12 +56,165 @@ re_sleep = re.compile(r'sleep\s?\(\s*(\d+\.?\d*)|w\s?\(\s*(\d+\.?\d*)|pos\s+w\s+
 
 def frange(start, stop=None, step=1):
     """Equivlent to GDA frange"""
+    import numpy as np
     if stop is None:
         stop = start
         start = 0
     return np.arange(start, stop + step, step).tolist()
 
 
+class FloatRange:
+    """
+    Lazy equivalent of np.arange(start, stop, step)
+    The length and values are calculated in closed form without creating the array.
+    Arrays are only created when converted, e.g. np.asarray(FloatRange(0, 360, 0.01))
+    """
+
+    def __init__(self, start, stop=None, step=1):
+        if stop is None:
+            stop = start
+            start = 0
+        if step == 0:
+            raise ZeroDivisionError('FloatRange step cannot be zero')
+        self.start = start
+        self.stop = stop
+        self.step = step
+        self.length = max(int(math.ceil((stop - start) / step)), 0)
+
+    def __repr__(self):
+        return 'FloatRange(%r, %r, %r)' % (self.start, self.stop, self.step)
+
+    def __eq__(self, other):
+        if isinstance(other, FloatRange):
+            return (self.start, self.stop, self.step) == (other.start, other.stop, other.step)
+        return NotImplemented
+
+    __hash__ = None
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            return self.tolist()[item]
+        if item < 0:
+            item += self.length
+        if not 0 <= item < self.length:
+            raise IndexError('FloatRange index out of range')
+        return self.start + item * self.step
+
+    def __iter__(self):
+        start, step = self.start, self.step
+        return (start + n * step for n in range(self.length))
+
+    def __add__(self, other):
+        if isinstance(other, (list, tuple, range, FloatRange, RangeChain)):
+            return RangeChain([self, other])
+        return NotImplemented
+
+    def __radd__(self, other):
+        if isinstance(other, (list, tuple, range)):
+            return RangeChain([other, self])
+        return NotImplemented
+
+    def __array__(self, dtype=None, copy=None):
+        import numpy as np
+        return np.arange(self.start, self.stop, self.step, dtype=dtype)
+
+    def tolist(self):
+        """Return list of values"""
+        import numpy as np
+        return np.arange(self.start, self.stop, self.step).tolist()
+
+    def bounds(self):
+        """Return (min, max) of values"""
+        if not self.length:
+            raise ValueError('FloatRange is empty')
+        first, last = self[0], self[-1]
+        return min(first, last), max(first, last)
+
+
+class RangeChain:
+    """
+    Lazy concatenation of sequences, e.g. frange(0, 1, 0.1) + frange(2, 3, 0.1) + [5, 6]
+    """
+
+    def __init__(self, parts):
+        self.parts = []
+        for part in parts:
+            self.parts.extend(part.parts if isinstance(part, RangeChain) else [part])
+
+    def __repr__(self):
+        return ' + '.join(repr(part) for part in self.parts)
+
+    def __eq__(self, other):
+        if isinstance(other, RangeChain):
+            return self.parts == other.parts
+        return NotImplemented
+
+    __hash__ = None
+
+    def __len__(self):
+        return sum(len(part) for part in self.parts)
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            return self.tolist()[item]
+        if item < 0:
+            item += len(self)
+        for part in self.parts:
+            if 0 <= item < len(part):
+                return part[item]
+            item -= len(part)
+        raise IndexError('RangeChain index out of range')
+
+    def __iter__(self):
+        for part in self.parts:
+            yield from part
+
+    def __add__(self, other):
+        if isinstance(other, (list, tuple, range, FloatRange, RangeChain)):
+            return RangeChain([self, other])
+        return NotImplemented
+
+    def __radd__(self, other):
+        if isinstance(other, (list, tuple, range)):
+            return RangeChain([other, self])
+        return NotImplemented
+
+    def __array__(self, dtype=None, copy=None):
+        import numpy as np
+        return np.array(self.tolist(), dtype=dtype)
+
+    def tolist(self):
+        """Return list of values"""
+        return [value for part in self.parts for value in (part.tolist() if hasattr(part, 'tolist') else part)]
+
+    def bounds(self):
+        """Return (min, max) of values"""
+        bounds = [part.bounds() if hasattr(part, 'bounds') else (min(part), max(part)) for part in self.parts if len(part)]
+        if not bounds:
+            raise ValueError('RangeChain is empty')
+        return min(b[0] for b in bounds), max(b[1] for b in bounds)
+
+
+def lazy_frange(start, stop=None, step=1):
+    """Equivalent to GDA frange, returning a FloatRange rather than a list"""
+    if stop is None:
+        stop = start
+        start = 0
+    return FloatRange(start, stop + step, step)
+
+
+class LazyNumpy:
+    """Stand in for the GDA dnp module, dnp.arange returns a FloatRange, other attributes are from numpy"""
+    arange = staticmethod(FloatRange)
+
+    def __getattr__(self, name):
+        import numpy as np
+        return getattr(np, name)
+
+
 def time_string(tot_seconds):
     """Return formatted str"""
     hours = tot_seconds // 3600
@@ -49,24 +226,85 @@ def time_string(tot_seconds):
     return '%s%s%ss' % (hours, mins, secs)
 
 
-def eval_range(cmd, variables=None):
-    """Evaluate a range string, setting unknown varialbes as items in the list, returns an array"""
-    local_vars = {'frange': frange, 'dnp': np}
-    if variables is not None:
-        local_vars.update(variables)
+class StandIn(list):
+    """Stand in value for unknown names in expressions, behaves as [0], returns 0 when called"""
 
-    success = False
-    array = np.array([])
-    while not success:
-        try:
-            array = np.asarray(eval(cmd, local_vars)) #.reshape(-1)
-            success = True
-        except NameError as ne:
-            name = re_errorname.findall(str(ne))[0]
-            local_vars[name] = [0]
-        except Exception as xx:
-            print('Warning: Loop didnt complete: %s' % xx)
-            success = True
+    def __init__(self):
+        super().__init__([0])
+
+    def __call__(self, *args, **kwargs):
+        return 0
+
+    def __getattr__(self, name):
+        return self
+
+
+def code_names(code):
+    """Return frozenset of names used by a code object, including any nested code such as comprehensions"""
+    names = set(code.co_names)
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType):
+            names.update(code_names(const))
+    return frozenset(names)
+
+
+def check_expression(tree):
+    """
+    Raise ValueError if an expression tree uses private names or attributes, other than those in SAFE_ATTRIBUTES
+    Expressions from scripts are evaluated using only SAFE_BUILTINS, so without attribute access they can
+    only do arithmetic and call functions of the timing namespace, e.g. frange.
+    :param tree: ast.Expression
+    """
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Attribute):
+            value = node.value
+            if not (isinstance(value, ast.Name) and node.attr in SAFE_ATTRIBUTES.get(value.id, ())):
+                raise ValueError('attribute access is not evaluated: .%s' % node.attr)
+        elif isinstance(node, ast.Name) and node.id.startswith('__'):
+            raise ValueError('name is not evaluated: %s' % node.id)
+
+
+@functools.lru_cache(maxsize=EVAL_CACHE_SIZE)
+def compile_expression(expression):
+    """
+    Compile expression string for eval, returns code, names where names are the names used by the code
+    Expressions with attribute access or private names raise ValueError, see check_expression.
+    Evaluate the code with safe_namespace, so only SAFE_BUILTINS are available.
+    """
+    tree = ast.parse(expression.strip(), '<string>', 'eval')
+    check_expression(tree)
+    code = compile(tree, '<string>', 'eval')
+    return code, code_names(code)
+
+
+def safe_namespace(*namespaces):
+    """Return dict for eval of compiled expressions, combining namespaces with only SAFE_BUILTINS"""
+    output = {}
+    for namespace in namespaces:
+        output.update(namespace)
+    output['__builtins__'] = SAFE_BUILTINS
+    return output
+
+
+def eval_range(cmd, variables=None, as_array=True):
+    """
+    Evaluate a range string, setting unknown varialbes as items in the list, returns an array
+    Unknown names are found from the compiled code and all set to StandIn() ([0]) before evaluation.
+    The expression is evaluated without attribute access and with only SAFE_BUILTINS, see compile_expression.
+    If as_array is False, sequences such as range or FloatRange are returned without creating the array
+    Any error evaluating the expression is raised.
+    :param cmd: str expression or code object
+    :param variables: None or dict of known variables
+    :param as_array: if True, returns np.ndarray
+    :return: array
+    """
+    local_vars = safe_namespace({'frange': frange, 'dnp': LazyNumpy()}, variables or {})
+    code, names = compile_expression(cmd) if isinstance(cmd, str) else (cmd, code_names(cmd))
+    local_vars.update((name, StandIn()) for name in names if name not in local_vars and name not in BUILTINS)
+    array = eval(code, local_vars)
+    if as_array or not hasattr(array, '__len__'):
+        import numpy as np
+        array = np.asarray(array)  # .reshape(-1)
     return array
 
 
@@ -81,7 +319,10 @@ def eval_for(line, time_per_point=1, local_vars=None):
     time = 0
     npoints = 0
     for range_str in range_find:
-        array = eval_range(range_str, local_vars)
+        try:
+            array = eval_range(range_str, local_vars)
+        except Exception:
+            continue  # loop length unknown
         npoints += len(array)
         time += len(array) * time_per_point
     return time, npoints
@@ -116,11 +357,22 @@ def top_comment_lines(script):
 
 def scan_time(nsteps, srange, exposure=1, motor_speed=1, motor_stabilisation=1):
     """Return total scan time in seconds"""
+    import numpy as np
     return (nsteps * exposure) + (nsteps * motor_stabilisation) + np.max(srange / motor_speed)
 
 
+def scan_time_many(nsteps, srange, exposure=1, motor_speed=1, motor_stabilisation=1):
+    """Return array of total scan times in seconds, for arrays of scans, see scandef.scan_range_many"""
+    import numpy as np
+    move_time = np.asarray(srange / motor_speed)
+    if move_time.ndim > 1:
+        move_time = np.max(move_time, axis=-1)
+    return (nsteps * exposure) + (nsteps * motor_stabilisation) + move_time
+
+
 def scan_command_time_old(cmd):
     """Use regular expressions to determine scan time from command"""
+    from i16_script_generator.scandef import scan_range, centred_scan_range, scannable_speed
     cmds = cmd.split(';')
     tot_time = 0
     tot_points = 0
@@ -158,175 +410,563 @@ def scan_command_time_old(cmd):
                 cmd_time += scan_time(nsteps, srange, exposure=0, motor_speed=speed, motor_stabilisation=stabilisation)
                 cmd_points *= nsteps
         # Detector exposure
-        for val in re_detector.findall(cmd):
-            exposure = float(val.split()[-1])
-            cmd_time += cmd_points * exposure
+        for name, exposure in re_name_number.findall(cmd):
+            if is_detector(name):
+                cmd_time += cmd_points * float(exposure)
         tot_time += cmd_time
         tot_points += cmd_points
     return tot_time, tot_points
 
 
-def scan_command_time(cmd, debug=False):
-    """Use regular expressions to determine scan time from command"""
-    cmds = cmd.split(';')
+def scan_values(values):
+    """Convert list of scan command values to floats or arrays"""
+    import numpy as np
+    return [np.asarray(val, dtype=float) if isinstance(val, list) else float(val) for val in values]
+
+
+def scan_object_time(scan, debug=False):
+    """
+    Return scan time and number of points of a ScanCommand object
+    :param scan: scancommand.ScanCommand
+    :param debug: if True, print each step
+    :return tot_time: float time in seconds
+    :return tot_points: int number of points
+    """
+    from i16_script_generator.scandef import scan_range, centred_scan_range, scannable_speed
+    cmd_time = 1
+    cmd_points = 1
+    scan_type = scan.scan_type
+    # loop through fields analysing numbers/ lists after
+    for var, values in scan.fields:
+        if debug:
+            print('  ', var, values)
+        if len(values) == 3:
+            # start, stop, step
+            start, stop, step, nsteps, srange = scan_range(*scan_values(values))
+            speed, stabilisation = scannable_speed(var)
+            if debug:
+                print('    scan', var, start, stop, step, nsteps, srange, speed, stabilisation)
+            cmd_time += scan_time(nsteps, srange, exposure=0, motor_speed=speed, motor_stabilisation=stabilisation)
+            cmd_points *= nsteps
+        elif len(values) == 2 and scan_type == 'scancn':
+            # step, nsteps
+            step, nsteps = scan_values(values)
+            step, nsteps, srange = centred_scan_range(step=step, nsteps=nsteps)
+            speed, stabilisation = scannable_speed(var)
+            if debug:
+                print('    scancn', var, step, nsteps, srange, speed, stabilisation)
+            cmd_time *= scan_time(nsteps, srange, exposure=0, motor_speed=speed, motor_stabilisation=stabilisation)
+            cmd_points *= nsteps
+        elif len(values) == 2 and scan_type == 'cscan':
+            # halfrange, step
+            halfrange, step = scan_values(values)
+            step, nsteps, srange = centred_scan_range(step=step, srange=halfrange * 2)
+            speed, stabilisation = scannable_speed(var)
+            if debug:
+                print('    cscan', var, step, nsteps, srange, speed, stabilisation)
+            cmd_time *= scan_time(nsteps, srange, exposure=0, motor_speed=speed, motor_stabilisation=stabilisation)
+            cmd_points *= nsteps
+        elif scan.field_type(var, values) == 'detector':
+            # detector exposure, should be after scans
+            exposure = float(values[0])
+            if debug:
+                print('    detector %s: %s * %s' % (var, cmd_points, exposure))
+            cmd_time += cmd_points * exposure
+    return cmd_time, cmd_points
+
+
+def calculate_scan_command_time(cmd, debug=False):
+    """Use the scan command lexer to determine scan time from command, see scancommand.ScanCommand"""
     tot_time = 0
     tot_points = 0
-    for cmd in cmds:  # split multiplle commands by ;
-        if 'scan' not in cmd:
-            continue
+    for scan in parse_scan_commands(cmd):  # split multiple commands by ;
         if debug:
-            print('Scan command time: %s' % cmd)
-        cmd_time = 1
-        cmd_points = 1
-        # split command by variable names e.g. scan, hkl, pil
-        variables = re_variables.findall(cmd)
-        params = re_variables.split(cmd)
-        if len(params) < 2:
-            continue
-        scan_type = variables[0]
-        # loop through variables analysing numbers/ lists after
-        for var, param in zip(variables[1:], params[2:]):
-            values = [eval_range(a) for a in re_lists_or_float.findall(param)]  # list of arrays
-            if debug:
-                print('  ', var, param, values)
+            print('Scan command time: %s' % scan)
+        cmd_time, cmd_points = scan_object_time(scan, debug)
+        tot_time += cmd_time
+        tot_points += cmd_points
+    return tot_time, tot_points
+
+
+@functools.lru_cache(maxsize=SCAN_CACHE_SIZE)
+def cached_canonical_command(command):
+    """Cached scancommand.canonical_command, repeated commands in a script are only tokenized once"""
+    return canonical_command(command)
+
+
+@functools.lru_cache(maxsize=SCAN_CACHE_SIZE)
+def cached_scan_command_time(command, version=None):
+    """Cached scan command time, command should be in canonical form and version the registry version"""
+    return calculate_scan_command_time(command)
+
+
+def scan_command_time(cmd, debug=False):
+    """
+    Return scan time and number of points of scan command
+    Results are cached using the canonical form of the command, the cache is invalidated when
+    SCANNABLES or DETECTORS change. See scan_cache_info.
+    :param cmd: str scan command, multiple commands can be separated by ';'
+    :param debug: if True, print each step (cache not used)
+    :return tot_time: float time in seconds
+    :return tot_points: int number of points
+    """
+    if debug:
+        return calculate_scan_command_time(cmd, debug)
+    return cached_scan_command_time(cached_canonical_command(cmd), registry_version())
+
+
+def value_shape(value):
+    """Return shape of nested list value, () for numbers"""
+    shape = ()
+    while isinstance(value, list):
+        shape += (len(value),)
+        value = value[0] if value else None
+    return shape
+
+
+def scan_structure(scan):
+    """Return hashable structure of ScanCommand: scan type, field names and shapes of values"""
+    return scan.scan_type, tuple((name, tuple(value_shape(val) for val in values)) for name, values in scan.fields)
+
+
+def scan_command_time_many(commands):
+    """
+    Return scan times and number of points of many scan commands, calculated using numpy arrays
+    Commands with the same structure (scan type, scannables, detectors and number of values) are
+    timed together in a single pass, e.g. candidate scans with different steps or exposures.
+        times, points = scan_command_time_many(['scan x 1 2 0.1 pil 1', 'scan x 1 2 0.01 pil 1'])
+    Each command is still parsed, to time many scans of one structure without writing commands,
+    use the arrays of parameters directly, see ScanTimeModel.time_many
+    :param commands: list of str scan commands (multiple commands can be separated by ';') or ScanCommand objects
+    :return times: array of float time in seconds, shape (N,)
+    :return points: array of int number of points, shape (N,)
+    """
+    import numpy as np
+    from i16_script_generator.scandef import scannable_speed, scan_range_many, centred_scan_range_many
+    times = np.zeros(len(commands))
+    points = np.zeros(len(commands), dtype=int)
+    groups = {}
+    for index, cmd in enumerate(commands):
+        scans = parse_scan_commands(cmd) if isinstance(cmd, str) else [cmd]
+        for scan in scans:
+            groups.setdefault(scan_structure(scan), []).append((index, scan))
+
+    for (scan_type, fields), group in groups.items():
+        index = np.array([idx for idx, scan in group])
+        cmd_time = np.ones(len(group))
+        cmd_points = np.ones(len(group), dtype=int)
+        scan = group[0][1]
+        for n, (var, shapes) in enumerate(fields):
+            values = [np.array([s.fields[n][1][m] for idx, s in group], dtype=float) for m in range(len(shapes))]
             if len(values) == 3:
                 # start, stop, step
-                start, stop, step, nsteps, srange = scan_range(*values)
+                start, stop, step, nsteps, srange = scan_range_many(*values)
                 speed, stabilisation = scannable_speed(var)
-                if debug:
-                    print('    scan', var, start, stop, step, nsteps, srange, speed, stabilisation)
-                cmd_time += scan_time(nsteps, srange, exposure=0, motor_speed=speed, motor_stabilisation=stabilisation)
+                cmd_time += scan_time_many(nsteps, srange, 0, speed, stabilisation)
                 cmd_points *= nsteps
             elif len(values) == 2 and scan_type == 'scancn':
                 # step, nsteps
-                step, nsteps, srange = centred_scan_range(step=values[0], nsteps=values[1])
+                step, nsteps, srange = centred_scan_range_many(step=values[0], nsteps=values[1])
                 speed, stabilisation = scannable_speed(var)
-                if debug:
-                    print('    scancn', var, step, nsteps, srange, speed, stabilisation)
-                cmd_time *= scan_time(nsteps, srange, exposure=0, motor_speed=speed, motor_stabilisation=stabilisation)
+                cmd_time *= scan_time_many(nsteps, srange, 0, speed, stabilisation)
                 cmd_points *= nsteps
             elif len(values) == 2 and scan_type == 'cscan':
                 # halfrange, step
-                # print('cscan', var, values)
-                step, nsteps, srange = centred_scan_range(step=values[1], srange=values[0] * 2)
+                step, nsteps, srange = centred_scan_range_many(step=values[1], srange=values[0] * 2)
                 speed, stabilisation = scannable_speed(var)
-                if debug:
-                    print('    cscan', var, step, nsteps, srange, speed, stabilisation)
-                cmd_time *= scan_time(nsteps, srange, exposure=0, motor_speed=speed, motor_stabilisation=stabilisation)
+                cmd_time *= scan_time_many(nsteps, srange, 0, speed, stabilisation)
                 cmd_points *= nsteps
-            elif len(values) == 1:
+            elif scan.field_type(var, scan.fields[n][1]) == 'detector':
                 # detector exposure, should be after scans
-                for val in re_detector.findall(' '.join(['', var, param])):
-                    exposure = float(val.split()[-1])
-                    if debug:
-                        print('    detector %s: %s * %s' % (val, cmd_points, exposure))
-                    cmd_time += cmd_points * exposure
-        tot_time += cmd_time
-        tot_points += cmd_points
-    return tot_time, tot_points
+                cmd_time += cmd_points * values[0]
+        np.add.at(times, index, cmd_time)
+        np.add.at(points, index, cmd_points)
+    return times, points
 
 
-def time_script_string(script_string):
+class ScanTimeModel:
+    """
+    Timing model for scans of one scan type and set of scannables
+    Scannable speeds are looked up once, so the time of scans with different values can be calculated
+    without writing and parsing a scan command. Gives the same time as scan_command_time.
+        model = ScanTimeModel('scan', ['eta'])
+        time, npoints = model.time([[1, 2, 0.1]], exposure=1)
+    :param scan_type: str e.g. 'scan', 'scancn', 'cscan'
+    :param scannables: list of str scannable names
+    """
+
+    def __init__(self, scan_type, scannables):
+        from i16_script_generator.scandef import scannable_speed
+        self.scan_type = scan_type
+        self.scannables = list(scannables)
+        self.speeds = [scannable_speed(name) for name in self.scannables]
+
+    def __repr__(self):
+        return 'ScanTimeModel(%r, %r)' % (self.scan_type, self.scannables)
+
+    def time(self, values, exposure=0):
+        """
+        Return scan time and number of points
+        :param values: list of values for each scannable, e.g. [[start, stop, step]]
+        :param exposure: float detector exposure in seconds, 0 if there is no detector
+        :return tot_time: float time in seconds
+        :return tot_points: int number of points
+        """
+        from i16_script_generator.scandef import scan_range, centred_scan_range
+        cmd_time = 1
+        cmd_points = 1
+        for axis_values, (speed, stabilisation) in zip(values, self.speeds):
+            if len(axis_values) == 3:
+                # start, stop, step
+                start, stop, step, nsteps, srange = scan_range(*scan_values(axis_values))
+                cmd_time += scan_time(nsteps, srange, 0, speed, stabilisation)
+                cmd_points *= nsteps
+            elif len(axis_values) == 2 and self.scan_type == 'scancn':
+                # step, nsteps
+                step, nsteps = scan_values(axis_values)
+                step, nsteps, srange = centred_scan_range(step=step, nsteps=nsteps)
+                cmd_time *= scan_time(nsteps, srange, 0, speed, stabilisation)
+                cmd_points *= nsteps
+            elif len(axis_values) == 2 and self.scan_type == 'cscan':
+                # halfrange, step
+                halfrange, step = scan_values(axis_values)
+                step, nsteps, srange = centred_scan_range(step=step, srange=halfrange * 2)
+                cmd_time *= scan_time(nsteps, srange, 0, speed, stabilisation)
+                cmd_points *= nsteps
+        cmd_time += cmd_points * exposure
+        return cmd_time, cmd_points
+
+    def time_many(self, values, exposure=0):
+        """
+        Return scan times and number of points of many scans, calculated using numpy arrays in a single pass
+            model = ScanTimeModel('scan', ['eta'])
+            times, points = model.time_many([[[1, 2, 0.1], [1, 2, 0.01]]], exposure=[1, 0.5])
+        :param values: list of arrays for each scannable, with shape (N, 3) for start, stop, step, or (N, 2) for
+            step, nsteps (scancn) or halfrange, step (cscan). Scannables with M values (e.g. hkl) have shape (N, 3, M)
+        :param exposure: float or array of shape (N,), detector exposure in seconds, 0 if there is no detector
+        :return times: array of float time in seconds, shape (N,)
+        :return points: array of int number of points, shape (N,)
+        """
+        import numpy as np
+        from i16_script_generator.scandef import scan_range_many, centred_scan_range_many
+        values = [np.asarray(axis_values, dtype=float) for axis_values in values]
+        exposure = np.asarray(exposure, dtype=float)
+        nscans = len(values[0]) if values else exposure.size
+        cmd_time = np.ones(nscans)
+        cmd_points = np.ones(nscans, dtype=int)
+        for axis_values, (speed, stabilisation) in zip(values, self.speeds):
+            columns = [axis_values[:, n] for n in range(axis_values.shape[1])]
+            if len(columns) == 3:
+                # start, stop, step
+                start, stop, step, nsteps, srange = scan_range_many(*columns)
+                cmd_time += scan_time_many(nsteps, srange, 0, speed, stabilisation)
+                cmd_points *= nsteps
+            elif len(columns) == 2 and self.scan_type == 'scancn':
+                # step, nsteps
+                step, nsteps, srange = centred_scan_range_many(step=columns[0], nsteps=columns[1])
+                cmd_time *= scan_time_many(nsteps, srange, 0, speed, stabilisation)
+                cmd_points *= nsteps
+            elif len(columns) == 2 and self.scan_type == 'cscan':
+                # halfrange, step
+                step, nsteps, srange = centred_scan_range_many(step=columns[1], srange=columns[0] * 2)
+                cmd_time *= scan_time_many(nsteps, srange, 0, speed, stabilisation)
+                cmd_points *= nsteps
+        cmd_time += cmd_points * exposure
+        return cmd_time, cmd_points
+
+
+@functools.lru_cache(maxsize=SCAN_CACHE_SIZE)
+def cached_scan_time_model(scan_type, scannables, version=None):
+    """Cached ScanTimeModel, scannables should be a tuple and version the registry version"""
+    return ScanTimeModel(scan_type, scannables)
+
+
+def scan_time_model(scan_type, scannables):
+    """
+    Return timing model for scans of scan_type and scannables, see ScanTimeModel
+    Models are cached until SCANNABLES change.
+    :param scan_type: str e.g. 'scan', 'scancn', 'cscan'
+    :param scannables: list of str scannable names
+    :return: ScanTimeModel
+    """
+    return cached_scan_time_model(scan_type, tuple(scannables), registry_version())
+
+
+def scan_cache_info():
+    """Return scan command time cache statistics (hits, misses, maxsize, currsize)"""
+    return cached_scan_command_time.cache_info()
+
+
+def scan_cache_clear():
+    """Clear scan command time cache"""
+    cached_canonical_command.cache_clear()
+    cached_scan_command_time.cache_clear()
+
+
+def time_script_string(script_string, cache=False):
     """
     Analyse a script and calcualte the run time by calculating scan length and number of loops.
+    The script is parsed using the python ast module, see scripttimer.ScriptTimer
     :param script_string: multiline string of script
+    :param cache: if True, use results of a previous timing of the same script, see timingcache
     :return total_time: datetime.timedelta
     :return script: updated script string
     """
-    output_str = []
-    tot_time = 0
-    comment_zone = False
-    bracket_count = 0
-    bracket_var = ''
-    bracket_str = ''
-    local_vars = {'frange': frange, 'dnp': np}
-    loop_points = [1]
-    tab = "    "
-    script_string = script_string.replace('\t', tab)
-    for line in script_string.splitlines():
-        cmd = re_comment.sub('', line)  # remove comments
-        cmd = cmd.replace("'''", '"""')
-        if cmd.count('"""') % 2 == 1:
-            comment_zone = not comment_zone
-        if comment_zone or not cmd.strip() or cmd.strip()[0] in ['#', '\'', '\"']:
-            output_str += [line]
-            continue
-        if bracket_count > 0:
-            bracket_str += cmd
-            bracket_count += cmd.count('[') - cmd.count(']')
-            if bracket_count == 0:
-                # Close bracket
-                # print('close bracket: %s = %s' % (bracket_var, bracket_str.replace('\n', '')))
-                # print('close bracket: %s =' % bracket_var, eval_range(bracket_str.replace('\n', '')) )
-                local_vars[bracket_var] = eval_range(bracket_str.replace('\n', ''))
-                bracket_str = ''
-                # output_str += [line + '  # %s = %s' % (bracket_var, local_vars[bracket_var])]
-                # continue
-
-        # variable assignment inc. multiline
-        if re_assignment.search(cmd):
-            var, value = cmd.split('=')
-            if cmd.count('[') > cmd.count(']'):
-                bracket_count += cmd.count('[') - cmd.count(']')
-                bracket_var = var.strip()
-                bracket_str = value
-            else:
-                try:
-                    value = value.split(';')[0]
-                    if ',' in var:  # Tuple assignemtn a,b,c = 1,2,3
-                        for tvar, tval in zip(var.split(','), value.split(',')):
-                            local_vars[tvar.strip()] = eval(tval, local_vars)
-                    local_vars[var.strip()] = eval(value, local_vars)  # breaks if e.g. hkl=hkl()
-                except NameError:
-                    local_vars[var.strip()] = 0
-                # output_str += [line + '  # %s = %s' % (var.strip(), local_vars[var.strip()])]
-                # continue
-
-        # Tab position of line
-        line_tab_pos = calc_tabpos(cmd)
-        if line_tab_pos < len(loop_points):
-            loop_points = loop_points[:line_tab_pos + 1]
-        cmd = cmd.strip()
-
-        # For loop in line
-        if cmd.startswith('for'):
-            for_time, for_points = eval_for(cmd, local_vars=local_vars)
-            tot_time += for_time
-            loop_points += [for_points]
-            output_str += [tab * line_tab_pos + cmd + '  # %s points' % for_points]
-            continue
-
-        # pos commands
-        tot_loop_points = np.prod(loop_points)
-        tot_time += cmd.count('pos') * tot_loop_points
-        tot_time += eval_sleep(cmd)
-
-        # scan commands
-        if 'scan' in cmd:
-            # replace any local variables with zeros
-            orig = cmd
-            for var in local_vars:
-                cmd = cmd.replace(var, '0')
-            scan_seconds, scan_points = scan_command_time(cmd)
-            tot_time += scan_seconds * tot_loop_points
-            output_str += [(tab * line_tab_pos) + orig + '  # %.4gs * %s' % (scan_seconds, tot_loop_points)]
-            continue
-        output_str += [line]
-    return datetime.timedelta(seconds=float(tot_time)), '\n'.join(output_str)
+    from i16_script_generator.scripttimer import ScriptTimer
+    from i16_script_generator.timingcache import timing_cache
+    timings = timing_cache() if cache else None
+    entry = timings.get(script_string, 'ScriptTimer') if timings else None
+    if entry is not None:
+        return datetime.timedelta(seconds=entry.total), entry.annotated
+    timer = ScriptTimer()
+    tot_time = timer.run(script_string)
+    annotated = timer.annotated_script()
+    if timings:
+        timings.put(script_string, tot_time, timer.line_times, annotated, timer.warnings, engine='ScriptTimer')
+    return datetime.timedelta(seconds=float(tot_time)), annotated
+
+
+def iter_chunks(blocks, min_lines=100):
+    """Generator combining consecutive (start, lines) blocks into chunks of at least min_lines lines"""
+    chunk = []
+    chunk_start = 0
+    for start, block in blocks:
+        if not chunk:
+            chunk_start = start
+        chunk.extend(block)
+        if len(chunk) >= min_lines:
+            yield chunk_start, chunk
+            chunk = []
+    if chunk:
+        yield chunk_start, chunk
+
+
+def iter_script_timing(file_or_lines, warnings=None):
+    """
+    Generator timing a script line by line, yielding a LineTiming record for each line
+    The script is read and timed in chunks of complete top-level blocks (see gdasyntax.iter_blocks), so output
+    starts immediately and memory use does not grow with the length of the script.
+        for record in iter_script_timing('script.py'):
+            print(record.lineno, record.cumulative, record.multiplicity, record.cost, record.annotated)
+    :param file_or_lines: str filename, open file or iterable of str lines
+    :param warnings: None or list, warning messages are appended
+    :return: yields LineTiming(lineno, line, annotated, cumulative, multiplicity, cost)
+    """
+    from i16_script_generator.scripttimer import ScriptTimer
+    from i16_script_generator.gdasyntax import iter_blocks
+
+    if isinstance(file_or_lines, str):
+        with open(file_or_lines) as f:
+            yield from iter_script_timing(f, warnings)
+        return
+
+    lines = (line.rstrip('\r\n').replace('\t', '    ') for line in file_or_lines)
+    timer = ScriptTimer()
+    if warnings is not None:
+        timer.warnings = warnings
+    cumulative = 0.0
+    for start, block in iter_chunks(iter_blocks(lines), STREAM_CHUNK_LINES):
+        timer.run_block(block, start)
+        multiplicity = 1
+        for lineno, line in enumerate(block, start + 1):
+            annotated = timer.annotate_line(lineno, line)
+            cost, line_multiplicity, annotation = timer.pop_line(lineno)
+            multiplicity = multiplicity if line_multiplicity is None else line_multiplicity
+            cumulative += cost
+            yield LineTiming(lineno, line, annotated, cumulative, multiplicity, cost)
+
+
+def write_script_timing(file_or_lines, output_filename):
+    """
+    Stream annotated script to file, see iter_script_timing
+    :param file_or_lines: str filename, open file or iterable of str lines
+    :param output_filename: str file to write
+    :return total_time: datetime.timedelta
+    """
+    cumulative = 0.0
+    with open(output_filename, 'w') as f:
+        for record in iter_script_timing(file_or_lines):
+            f.write(record.annotated + '\n')
+            cumulative = record.cumulative
+    return datetime.timedelta(seconds=float(cumulative))
 
 
-def time_script(filename, print_script=False):
+def script_file_timing(filename, cache=False, errors=False):
+    """
+    Time script file, using results of a previous timing of the same script if available
+    :param filename: str file to open
+    :param cache: if True, use the timing cache, see timingcache
+    :param errors: if True, timing errors are added to warnings and the partial result returned (not cached)
+    :return: timingcache.TimingEntry(total, line_times, annotated, warnings)
+    """
+    import io
+    from i16_script_generator.timingcache import TimingEntry, timing_cache
+    with open(filename) as f:
+        script = f.read()
+    timings = timing_cache() if cache else None
+    entry = timings.get(script, STREAM_ENGINE) if timings else None
+    if entry is not None:
+        return entry
+
+    warnings = []
+    line_times = {}
+    annotated = []
+    cumulative = 0.0
+    try:
+        for record in iter_script_timing(io.StringIO(script), warnings):
+            annotated.append(record.annotated)
+            if record.cost:
+                line_times[record.lineno] = record.cost
+            cumulative = record.cumulative
+    except Exception as xx:
+        if not errors:
+            raise
+        warnings.append('Timing failed: %s' % xx)
+        return TimingEntry(float(cumulative), line_times, '\n'.join(annotated), warnings)
+    entry = TimingEntry(float(cumulative), line_times, '\n'.join(annotated), warnings)
+    if timings:
+        timings.put(script, *entry, engine=STREAM_ENGINE)
+    return entry
+
+
+def time_script(filename, print_script=False, cache=False):
     """
     Analyse a script and calcualte the run time by calculating scan length and number of loops.
+    The script is read line by line, see iter_script_timing
     :param filename: str file to open
     :param print_script: Bool, if True, prints updated str
+    :param cache: if True, use results of a previous timing of the same script, see timingcache
     :return total_time: datetime.timedelta
     """
-    with open(filename) as f:
-        tot_time, output_str = time_script_string(f.read())
-        if print_script:
-            print('----- Time Script: %s -----' % filename)
-            print(output_str)
-            print('----- End Time Script: %s -----' % filename)
-            print(f'   Script total time: %s' % time_string(tot_time.total_seconds()))
+    if print_script:
+        print('----- Time Script: %s -----' % filename)
+    entry = script_file_timing(filename, cache)
+    if print_script and entry.annotated:
+        print(entry.annotated)
+    tot_time = datetime.timedelta(seconds=entry.total)
+    if print_script:
+        print('----- End Time Script: %s -----' % filename)
+        print(f'   Script total time: %s' % time_string(tot_time.total_seconds()))
     return tot_time
+
+
+def time_script_summary(filename, cache=False):
+    """
+    Time script file, returning a summary dict
+    :param filename: str file to open
+    :param cache: if True, use results of a previous timing of the same script, see timingcache
+    :return: {'file': str, 'seconds': float, 'duration': str, 'lines': int, 'warnings': list}
+    """
+    try:
+        entry = script_file_timing(filename, cache, errors=True)
+    except Exception as xx:
+        return {'file': filename, 'seconds': 0.0, 'duration': time_string(0), 'lines': 0,
+                'warnings': ['Timing failed: %s' % xx]}
+    return {
+        'file': filename,
+        'seconds': entry.total,
+        'duration': time_string(entry.total),
+        'lines': entry.annotated.count('\n') + 1 if entry.annotated else 0,
+        'warnings': entry.warnings,
+    }
+
+
+def time_directory(directory, jobs=None, pattern='*.py', recursive=False, sort='time', cache=False):
+    """
+    Time every script in a directory, using a pool of processes
+    :param directory: str directory, e.g. '/dls_sw/i16/scripts/2022/mm12345-1'
+    :param jobs: None or int number of processes, None uses the number of cpus, 1 times in this process
+    :param pattern: str glob pattern of script files
+    :param recursive: if True, also search sub-directories
+    :param sort: 'time' (longest first), 'name' or 'lines'
+    :param cache: if True, use results of a previous timing of the same script, see timingcache
+    :return: list of summary dicts, see time_script_summary
+    """
+    import glob
+    import os
+    if recursive:
+        files = glob.glob(os.path.join(directory, '**', pattern), recursive=True)
+    else:
+        files = glob.glob(os.path.join(directory, pattern))
+    files = [file for file in files if os.path.isfile(file)]
+
+    if jobs == 1 or len(files) < 2:
+        results = [time_script_summary(file, cache) for file in files]
+    else:
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(jobs) as pool:
+            results = list(pool.map(functools.partial(time_script_summary, cache=cache), files))
+
+    return sort_summaries(results, sort)
+
+
+def sort_summaries(results, sort='time'):
+    """Return list of script summaries sorted by 'time' (longest first), 'name' or 'lines'"""
+    if sort == 'name':
+        return sorted(results, key=lambda r: r['file'])
+    if sort == 'lines':
+        return sorted(results, key=lambda r: r['lines'], reverse=True)
+    return sorted(results, key=lambda r: r['seconds'], reverse=True)
+
+
+def summary_table(results):
+    """Return str table of script summaries, see time_directory"""
+    import os
+    width = max([len(os.path.basename(r['file'])) for r in results] + [6])
+    out = '%-*s | %24s | %8s | %s\n' % (width, 'Script', 'Duration', 'Lines', 'Warnings')
+    out += '-' * (width + 50) + '\n'
+    for r in results:
+        out += '%-*s | %24s | %8d | %d\n' % (width, os.path.basename(r['file']), r['duration'], r['lines'], len(r['warnings']))
+        for warning in r['warnings']:
+            out += '%*s   %s\n' % (width, '', warning)
+    total = sum(r['seconds'] for r in results)
+    out += '-' * (width + 50) + '\n'
+    out += '%-*s | %24s | %8d |\n' % (width, 'Total', time_string(total), sum(r['lines'] for r in results))
+    return out
+
+
+def main(argv=None):
+    """
+    Command line script timer
+        $ python -m i16_script_generator.timing /dls_sw/i16/scripts/2022/mm12345-1 --jobs 8
+        $ python -m i16_script_generator.timing script.py
+    """
+    import argparse
+    import json
+    import os
+    parser = argparse.ArgumentParser(
+        prog='python -m i16_script_generator.timing',
+        description='Predict the run time of every I16 script in a directory'
+    )
+    parser.add_argument('path', help='script directory or single script file')
+    parser.add_argument('-j', '--jobs', type=int, default=None, help='number of processes, default: number of cpus')
+    parser.add_argument('--pattern', default='*.py', help='glob pattern of script files, default: *.py')
+    parser.add_argument('-r', '--recursive', action='store_true', help='include sub-directories')
+    parser.add_argument('--sort', choices=['time', 'name', 'lines'], default='time', help='table order')
+    parser.add_argument('--json', action='store_true', help='output JSON rather than a table')
+    parser.add_argument('--registry', default=None, help='JSON or YAML dump of the GDA namespace')
+    parser.add_argument('--no-cache', action='store_true', help='re-time every script, ignoring the timing cache')
+    args = parser.parse_args(argv)
+    if args.no_cache:
+        from i16_script_generator.timingcache import disable_cache
+        disable_cache()
+    if args.registry:
+        from i16_script_generator.registry import set_registry_file
+        set_registry_file(args.registry)
+
+    # use the imported module so the process pool can pickle the functions
+    from i16_script_generator import timing
+    if os.path.isfile(args.path):
+        results = [timing.time_script_summary(args.path, cache=not args.no_cache)]
+    else:
+        results = timing.time_directory(args.path, args.jobs, args.pattern, args.recursive, args.sort,
+                                        cache=not args.no_cache)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print(summary_table(results))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,221 @@
+"""
+Timing cache
+On-disk cache of script timing results, stored in an SQLite database.
+
+Entries are keyed on the timing engine (e.g. 'ScriptTimer', 'IncrementalTimer'), a hash of the source code of
+the timing modules, a hash of the registry tables (see registry.Registry.digest) and a hash of the script text,
+so unchanged scripts are not re-timed until the timing code or the scannable or detector tables change. Each
+entry holds the total time, the time of each line, the annotated script and any warnings.
+
+    cache = timing_cache()  # None if the cache is disabled
+    entry = cache.get(script, 'ScriptTimer')  # TimingEntry or None
+    cache.put(script, total, line_times, annotated, warnings, engine='ScriptTimer')
+
+The cache is only used where it is asked for, e.g. time_script_string(script, cache=True), the command line
+tools and the GUI.
+
+The database is ~/.cache/i16_script_generator/timing.sqlite, or the file in environment variable
+I16_TIMING_CACHE. Set I16_TIMING_CACHE=off (or use disable_cache) to always re-time scripts. The least
+recently used entries are removed when the stored scripts exceed MAX_CACHE_BYTES.
+
+By Dan Porter, PhD
+Diamond Light Source Ltd
+2022
+"""
+
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import functools
+import collections
+
+CACHE_ENV = 'I16_TIMING_CACHE'  # environment variable with filename of cache, or 'off'
+CACHE_FILE = os.path.join('~', '.cache', 'i16_script_generator', 'timing.sqlite')
+CACHE_FORMAT = 2  # increment when the format of entries changes, to invalidate old entries
+MAX_CACHE_BYTES = 64 * 1024 * 1024  # size of stored results before old entries are removed
+DEFAULT_ENGINE = 'ScriptTimer'  # name of the timing engine of cache entries
+TIMING_MODULES = ['timing', 'scripttimer', 'scancommand', 'gdasyntax', 'scandef', 'params', 'registry']  # hashed in the key
+
+TimingEntry = collections.namedtuple('TimingEntry', ['total', 'line_times', 'annotated', 'warnings'])
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS timing (
+    key TEXT PRIMARY KEY,
+    total REAL,
+    line_times TEXT,
+    annotated TEXT,
+    warnings TEXT,
+    size INTEGER,
+    accessed REAL
+)
+"""
+
+
+@functools.lru_cache(maxsize=1)
+def code_digest():
+    """Return str hash of the source code of the timing modules, so results are re-timed when the code changes"""
+    from i16_script_generator import __version__
+    sha = hashlib.sha1(__version__.encode())
+    directory = os.path.dirname(os.path.abspath(__file__))
+    for module in TIMING_MODULES:
+        try:
+            with open(os.path.join(directory, module + '.py'), 'rb') as f:
+                sha.update(f.read())
+        except OSError:
+            sha.update(module.encode())  # e.g. installed without source files
+    return sha.hexdigest()
+
+
+def script_key(script, engine=DEFAULT_ENGINE, registry_digest=None):
+    """
+    Return str hash of timing engine, timing code, registry tables and script text
+    :param script: str script
+    :param engine: str name of the timing engine, e.g. 'ScriptTimer' or 'IncrementalTimer'
+    :param registry_digest: str hash of registry tables, None to use the current registry
+    :return: str
+    """
+    if registry_digest is None:
+        from i16_script_generator.registry import registry
+        registry_digest = registry().digest
+    script_hash = hashlib.sha1(script.encode('utf-8', 'surrogatepass')).hexdigest()
+    return '%d:%s:%s:%s:%s' % (CACHE_FORMAT, engine, code_digest(), registry_digest, script_hash)
+
+
+class TimingCache:
+    """
+    SQLite cache of script timing results
+    A new connection is used for each operation, so the cache can be shared between threads and processes.
+        cache = TimingCache('timing.sqlite')
+        cache.put(script, total, line_times, annotated, engine='ScriptTimer')
+        total, line_times, annotated, warnings = cache.get(script, 'ScriptTimer')
+    :param filename: str database file, created if it doesn't exist
+    :param max_bytes: int maximum size of stored results, least recently used entries are removed
+    """
+
+    def __init__(self, filename, max_bytes=MAX_CACHE_BYTES):
+        self.filename = filename
+        self.max_bytes = max_bytes
+
+    def __repr__(self):
+        return 'TimingCache(%r)' % self.filename
+
+    def _connect(self):
+        """Connect to the database, readable only by the user as it stores script contents"""
+        directory = os.path.dirname(self.filename)
+        if directory:
+            os.makedirs(directory, mode=0o700, exist_ok=True)
+        if not os.path.exists(self.filename):
+            os.close(os.open(self.filename, os.O_WRONLY | os.O_CREAT, 0o600))
+        elif os.stat(self.filename).st_mode & 0o077:
+            os.chmod(self.filename, 0o600)  # created by an earlier version
+        connection = sqlite3.connect(self.filename, timeout=10)
+        connection.execute(SCHEMA)
+        return connection
+
+    def get(self, script, engine=DEFAULT_ENGINE):
+        """Return TimingEntry of script, or None if the script hasn't been timed by engine with the current registry"""
+        key = script_key(script, engine)
+        try:
+            connection = self._connect()
+            try:
+                with connection:
+                    row = connection.execute(
+                        'SELECT total, line_times, annotated, warnings FROM timing WHERE key = ?', (key,)
+                    ).fetchone()
+                    if row is None:
+                        return None
+                    connection.execute('UPDATE timing SET accessed = ? WHERE key = ?', (time.time(), key))
+            finally:
+                connection.close()
+        except (OSError, sqlite3.Error):
+            return None  # e.g. locked or corrupt database
+        total, line_times, annotated, warnings = row
+        line_times = {lineno: seconds for lineno, seconds in json.loads(line_times)}
+        return TimingEntry(total, line_times, annotated, json.loads(warnings))
+
+    def put(self, script, total, line_times, annotated, warnings=(), engine=DEFAULT_ENGINE):
+        """
+        Store timing result of script
+        :param script: str script that was timed
+        :param total: float total time in seconds
+        :param line_times: {lineno: seconds} time of each line
+        :param annotated: str annotated script
+        :param warnings: list of str warnings
+        :param engine: str name of the timing engine, e.g. 'ScriptTimer' or 'IncrementalTimer'
+        """
+        key = script_key(script, engine)
+        line_times = json.dumps([[int(lineno), float(seconds)] for lineno, seconds in line_times.items()])
+        warnings = json.dumps([str(warning) for warning in warnings])
+        size = len(annotated) + len(line_times) + len(warnings)
+        try:
+            connection = self._connect()
+            try:
+                with connection:
+                    connection.execute(
+                        'INSERT OR REPLACE INTO timing VALUES (?, ?, ?, ?, ?, ?, ?)',
+                        (key, float(total), line_times, annotated, warnings, size, time.time())
+                    )
+                    self._evict(connection)
+            finally:
+                connection.close()
+        except (OSError, sqlite3.Error):
+            pass  # e.g. read-only directory
+
+    def _evict(self, connection):
+        """Remove least recently used entries until the stored size is below max_bytes"""
+        stored = connection.execute('SELECT COALESCE(SUM(size), 0) FROM timing').fetchone()[0]
+        if stored <= self.max_bytes:
+            return
+        remove = []
+        for key, size in connection.execute('SELECT key, size FROM timing ORDER BY accessed'):
+            if stored <= self.max_bytes:
+                break
+            remove.append((key,))
+            stored -= size
+        connection.executemany('DELETE FROM timing WHERE key = ?', remove)
+
+    def info(self):
+        """Return {'file': str, 'entries': int, 'bytes': int}"""
+        connection = self._connect()
+        try:
+            entries, stored = connection.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM timing').fetchone()
+        finally:
+            connection.close()
+        return {'file': self.filename, 'entries': entries, 'bytes': stored}
+
+    def clear(self):
+        """Remove all entries"""
+        connection = self._connect()
+        try:
+            with connection:
+                connection.execute('DELETE FROM timing')
+        finally:
+            connection.close()
+
+
+def cache_file():
+    """Return filename of the timing cache, or None if the cache is disabled"""
+    filename = os.environ.get(CACHE_ENV) or CACHE_FILE
+    if filename.lower() == 'off':
+        return None
+    return os.path.expanduser(filename)
+
+
+def set_cache_file(filename):
+    """Set the timing cache file, stored in environment variable I16_TIMING_CACHE so it is used by sub-processes"""
+    os.environ[CACHE_ENV] = os.path.abspath(filename)
+
+
+def disable_cache():
+    """Disable the timing cache, scripts are always re-timed"""
+    os.environ[CACHE_ENV] = 'off'
+
+
+def timing_cache():
+    """Return TimingCache, or None if the cache is disabled"""
+    filename = cache_file()
+    if filename is None:
+        return None
+    return TimingCache(filename)
@@ -0,0 +1,248 @@
+# This Python code is encoded in: utf-8
+"""
+Incremental syntax highlighting for tkinter Text widgets
+
+Each line is split into tokens (keywords, GDA commands, strings, comments, triple-quoted strings) by a
+single regular expression. The lexer state at the start of each line (inside or outside a triple-quoted
+string) is stored, so after an edit only the changed lines are re-lexed, continuing until the state
+matches the stored state. One tag is used per token class.
+
+Changed lines are found by intercepting the insert and delete commands of the Text widget, in the same way
+as the IDLE editor.
+
+    highlighter = Highlighter(text_widget, {'keyword': 'red', 'command': 'blue', ...})
+    highlighter.highlight()  # after each edit
+
+By Dan Porter, PhD
+Diamond Light Source Ltd
+2022
+"""
+
+import re
+
+KEYWORDS = [
+    'False', 'None', 'True', 'and', 'as', 'assert', 'async', 'await', 'break', 'class', 'continue', 'def',
+    'del', 'elif', 'else', 'except', 'finally', 'for', 'from', 'global', 'if', 'import', 'in', 'is', 'lambda',
+    'nonlocal', 'not', 'or', 'pass', 'raise', 'return', 'try', 'while', 'with', 'yield'
+]
+COMMANDS = ['scan', 'scancn', 'cscan', 'frange', 'pos', 'inc', 'go']
+TOKEN_CLASSES = ['keyword', 'command', 'string', 'comment', 'docstring']
+UNLEXED = object()  # lexer state of lines that haven't been highlighted
+
+re_python_token = re.compile(
+    r'(?P<comment>#.*)'
+    r'|(?P<triple>\'\'\'|""")'
+    r'|(?P<string>"(?:[^"\\]|\\.)*"|\'(?:[^\'\\]|\\.)*\')'
+    r'|\b(?P<keyword>%s)\b'
+    r'|\b(?P<command>%s)\b' % ('|'.join(KEYWORDS), '|'.join(COMMANDS))
+)
+
+
+def lex_line(line, state=None):
+    """
+    Split line into highlighted tokens
+        tokens, state = lex_line(line, state)
+    :param line: str single line
+    :param state: None or str triple-quote delimiter if the line starts inside a triple-quoted string
+    :return tokens: list of (start, end, token_class)
+    :return state: None or str triple-quote delimiter if the line ends inside a triple-quoted string
+    """
+    tokens = []
+    position = 0
+    if state:
+        end = line.find(state)
+        if end < 0:
+            return [(0, len(line), 'docstring')], state
+        position = end + 3
+        tokens.append((0, position, 'docstring'))
+    while True:
+        match = re_python_token.search(line, position)
+        if match is None:
+            return tokens, None
+        kind = match.lastgroup
+        if kind == 'triple':
+            delimiter = match.group()
+            end = line.find(delimiter, match.end())
+            if end < 0:
+                tokens.append((match.start(), len(line), 'docstring'))
+                return tokens, delimiter
+            position = end + 3
+            tokens.append((match.start(), position, 'docstring'))
+        else:
+            position = match.end()
+            tokens.append((match.start(), position, kind))
+
+
+def line_state(line, state=None):
+    """Return lexer state at the end of line, see lex_line. Faster than lex_line for most lines"""
+    if state:
+        if state not in line:
+            return state
+    elif '"""' not in line and "'''" not in line:
+        return None
+    return lex_line(line, state)[1]
+
+
+class Highlighter:
+    """
+    Incremental syntax highlighter for a tkinter Text widget
+    The insert and delete commands of the widget are intercepted to record which lines have changed and to
+    keep the lexer state of each line aligned with the text. highlight() then re-lexes only the changed lines,
+    continuing past them only while the lexer state differs from the stored state.
+        highlighter = Highlighter(text_widget, colours)
+        highlighter.highlight()  # after each edit, or debounced
+        highlighter.highlight(first, last)  # only highlight lines first-last, e.g. the visible lines
+    When a range of lines is given, lexer states are only calculated up to the last line, so the cost
+    doesn't depend on the length of the text after the range.
+    :param text: tkinter.Text widget
+    :param colours: {token_class: colour} for each of TOKEN_CLASSES
+    """
+
+    def __init__(self, text, colours):
+        self.text = text
+        self.tags = list(colours)
+        for tag, colour in colours.items():
+            text.tag_configure(tag, foreground=colour)
+        self._widget = str(text)
+        self._original = self._widget + '_highlight_original'
+        nlines = int(text.index('end-1c').split('.')[0])
+        self.states = [None] * (nlines + 1)  # lexer state at the end of each line, states[0] is the start
+        self.lexed = [UNLEXED] * (nlines + 1)  # lexer state used to highlight each line
+        self.valid = 0  # states up to this line are correct
+        self.dirty = None  # first, last changed line
+        self.relexed = 0  # number of lines lexed in the last call to highlight
+        # intercept widget commands
+        text.tk.call('rename', self._widget, self._original)
+        text.tk.createcommand(self._widget, self._dispatch)
+
+    def line_count(self):
+        """Return number of lines in the text widget"""
+        return self._line('end-1c')
+
+    def _call(self, *args):
+        return self.text.tk.call((self._original,) + args)
+
+    def _line(self, index):
+        return int(self._call('index', index).split('.')[0])
+
+    def _dispatch(self, operation, *args):
+        """Pass widget commands to the original widget, recording changed lines"""
+        # the final newline is never deleted, so indexes are limited to the last line
+        if operation == 'insert' and len(args) > 1:
+            # args = index, chars, ?tagList chars tagList ...?
+            line = min(self._line(args[0]), self.line_count())
+            result = self._call(operation, *args)
+            self.splice(line, 0, sum(chars.count('\n') for chars in args[1::2]))
+            return result
+        if operation == 'delete' and args:
+            first = min(self._line(args[0]), self.line_count())
+            last = min(self._line(args[1] if len(args) > 1 else '%s +1c' % args[0]), self.line_count())
+            result = self._call(operation, *args)
+            self.splice(first, max(last - first, 0), 0)
+            return result
+        if operation == 'replace' and len(args) > 2:
+            first = min(self._line(args[0]), self.line_count())
+            last = min(self._line(args[1]), self.line_count())
+            result = self._call(operation, *args)
+            self.splice(first, max(last - first, 0), sum(chars.count('\n') for chars in args[2::2]))
+            return result
+        return self._call(operation, *args)
+
+    def splice(self, line, removed, added):
+        """Record that line has changed, with removed lines after it replaced by added lines"""
+        del self.states[line:line + removed]
+        del self.lexed[line:line + removed]
+        self.states[line:line] = [None] * added
+        self.lexed[line:line + 1] = [UNLEXED] * (added + 1)
+        if self.valid >= line + removed:
+            self.valid += added - removed
+        elif self.valid >= line:
+            self.valid = line - 1
+        shift = added - removed
+        first, last = line, line + added
+        if self.dirty is not None:
+            old_first, old_last = self.dirty
+            if old_last > line:
+                old_last = max(line, old_last + shift)
+            first, last = min(first, old_first), max(last, old_last)
+        self.dirty = (first, last)
+
+    def iter_lines(self, first, chunk=1000):
+        """Yield (lineno, line) from line first to the end of the text, reading chunks of lines"""
+        nlines = self.line_count()
+        while first <= nlines:
+            last = min(first + chunk - 1, nlines)
+            for n, line in enumerate(self._call('get', '%d.0' % first, '%d.end' % last).split('\n'), first):
+                yield n, line
+            first = last + 1
+
+    def _walk(self, start, first, last, ranges, stop=None, known=0):
+        """
+        Update lexer states from line start, lexing lines first-last for highlighting
+        If stop is given, stop once the state after line stop matches a previous state, up to line known
+        """
+        state = self.states[start - 1]
+        n = start - 1
+        for n, line in self.iter_lines(start):
+            if first <= n <= last:
+                self.lexed[n] = state
+                tokens, state = lex_line(line, state)
+                ranges[n] = tokens
+            else:
+                state = line_state(line, state)
+            previous = self.states[n]
+            self.states[n] = state
+            if stop is not None and stop <= n <= known and state == previous:
+                self.valid = known  # following states are unchanged
+                return
+            if n >= last:
+                break
+        self.valid = n
+
+    def highlight(self, first=1, last=None):
+        """
+        Highlight changed lines
+        :param first: int first line to highlight
+        :param last: int last line to highlight, or None for the last line of the text
+        """
+        nlines = self.line_count()
+        last = nlines if last is None else min(last, nlines)
+        first = max(1, first)
+        ranges = {}  # {lineno: tokens}
+        if self.dirty is not None:
+            start, stop = self.dirty
+            self.dirty = None
+            known = self.valid
+            self.valid = min(self.valid, start - 1)
+            if self.valid < last:
+                self._walk(self.valid + 1, first, last, ranges, stop, known)
+        if self.valid < last:
+            self._walk(self.valid + 1, first, last, ranges)
+        # lines not highlighted with the current lexer state
+        stale = [n for n in range(first, last + 1) if n not in ranges and self.lexed[n] != self.states[n - 1]]
+        if stale:
+            lines = self._call('get', '%d.0' % stale[0], '%d.end' % stale[-1]).split('\n')
+            for n in stale:
+                self.lexed[n] = self.states[n - 1]
+                ranges[n] = lex_line(lines[n - stale[0]], self.states[n - 1])[0]
+        self.relexed = len(ranges)
+        if not ranges:
+            return
+
+        # remove tags from each run of re-lexed lines, then add tags for each token class
+        lines = sorted(ranges)
+        remove = []
+        for n in lines:
+            if remove and remove[-1] == '%d.end' % (n - 1):
+                remove[-1] = '%d.end' % n
+            else:
+                remove.extend(('%d.0' % n, '%d.end' % n))
+        add = {tag: [] for tag in self.tags}
+        for n in lines:
+            for start, end, kind in ranges[n]:
+                if kind in add:
+                    add[kind].extend(('%d.%d' % (n, start), '%d.%d' % (n, end)))
+        for tag in self.tags:
+            self._call('tag', 'remove', tag, *remove)
+            if add[tag]:
+                self._call('tag', 'add', tag, *add[tag])
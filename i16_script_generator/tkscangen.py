@@ -9,19 +9,23 @@ Diamond Light Source Ltd
 import tkinter as tk
 from tkinter import ttk
 
-from i16_script_generator.params import SCANNABLES, DETECTORS, EDGES, SCANOPTIONS
+from i16_script_generator.params import EDGES
+from i16_script_generator.registry import registry
+from i16_script_generator.scancommand import ScanCommand, is_detector
 from i16_script_generator.scandef import scannable_desc, det_desc, energy_desc, scan, scan_range, strfmt, scancn, \
     centred_scan_range, cscan, theta2theta_horiz, theta2theta_vert, energy_pol, energy, scan2d, psi_scancn, psi, \
     detector, detector_rois, detector_name
-from i16_script_generator.timing import scan_command_time, time_string
+from i16_script_generator.timing import scan_command_time, scan_time_model, time_string
 from i16_script_generator.tkwidgets import TF, BF, SF, MF, bkg, ety, btn, opt, btn_active, opt_active, txtcol, ety_txt, \
     SelectionBox
 
+PREVIEW_DELAY = 100  # ms after the last change before the scan time is updated
+
 
 def select_scannable(parent):
     """Returns scannable name"""
 
-    options = [scannable_desc(name) for name in SCANNABLES]
+    options = [scannable_desc(name) for name in registry().scannable_names]
     out = SelectionBox(parent, options, title='Scannables', multiselect=False).show()
     name = out[0].split('|')[0].strip()
     return name
@@ -30,7 +34,7 @@ def select_scannable(parent):
 def select_detector(parent):
     """Returns detector name"""
 
-    options = [det_desc(name) for name in DETECTORS]
+    options = [det_desc(name) for name in registry().detector_names]
     out = SelectionBox(parent, options, title='Detectors', multiselect=False).show()
     name = out[0].split('|')[0].strip()
     return name
@@ -47,6 +51,7 @@ def select_energy(parent):
 
 class AbsoluteScan:
     """Absolute Scan tab"""
+    scan_type = 'scan'  # scan command filled by set_scan
 
     def __init__(self, parent, update_function=None):
         self.parent = parent
@@ -109,6 +114,11 @@ class AbsoluteScan:
         _, _, _, nsteps, srange = scan_range(start, stop, step)
         return scan(scannable, start, stop, step)
 
+    def scan_axes(self):
+        """Return scan type and list of (scannable, values), for timing without generating the command"""
+        values = [eval(self.scan_start.get()), eval(self.scan_stop.get()), eval(self.scan_step.get())]
+        return 'scan', [(self.scannable.get(), values)]
+
     def get_sss(self):
         start = self.scan_start.get()
         stop = self.scan_stop.get()
@@ -154,23 +164,35 @@ class AbsoluteScan:
         opt = select_scannable(self.parent)
         if opt:
             self.scannable.set(opt)
-            if 'start' in SCANNABLES[opt]:
-                self.scan_start.set(SCANNABLES[opt]['start'])
+            info = registry().scannable_info(opt)
+            if 'start' in info:
+                self.scan_start.set(info['start'])
             else:
                 self.scan_start.set(0)
-            if 'stop' in SCANNABLES[opt]:
-                self.scan_stop.set(SCANNABLES[opt]['stop'])
+            if 'stop' in info:
+                self.scan_stop.set(info['stop'])
             else:
                 self.scan_stop.set(1)
-            if 'step' in SCANNABLES[opt]:
-                self.scan_step.set(SCANNABLES[opt]['step'])
+            if 'step' in info:
+                self.scan_step.set(info['step'])
             else:
                 self.scan_step.set(0.1)
             self.get_sss()
 
+    def set_scan(self, scannable, values):
+        """Fill the tab from a scan axis, values = [start, stop, step]"""
+        start, stop, step, nsteps, srange = scan_range(*values)
+        self.scannable.set(scannable)
+        self.scan_start.set(strfmt(start))
+        self.scan_stop.set(strfmt(stop))
+        self.scan_step.set(strfmt(step))
+        self.scan_nsteps.set(strfmt(nsteps))
+        self.scan_range.set(strfmt(srange))
+
 
 class CentreScan:
     """Centred Scan tab"""
+    scan_type = 'scancn'  # scan command filled by set_scan
 
     def __init__(self, parent, update_function=None):
         self.parent = parent
@@ -217,6 +239,11 @@ class CentreScan:
         nsteps = eval(self.scan_nsteps.get())
         return scancn(scannable, step, nsteps)
 
+    def scan_axes(self):
+        """Return scan type and list of (scannable, values), for timing without generating the command"""
+        values = [eval(self.scan_step.get()), eval(self.scan_nsteps.get())]
+        return 'scancn', [(self.scannable.get(), values)]
+
     def get_sss(self):
         step = self.scan_step.get()
         nsteps = self.scan_nsteps.get()
@@ -250,15 +277,25 @@ class CentreScan:
         opt = select_scannable(self.parent)
         if opt:
             self.scannable.set(opt)
-            if 'step' in SCANNABLES[opt]:
-                self.scan_step.set(SCANNABLES[opt]['step'])
+            info = registry().scannable_info(opt)
+            if 'step' in info:
+                self.scan_step.set(info['step'])
             else:
                 self.scan_step.set(0.1)
             self.get_sss()
 
+    def set_scan(self, scannable, values):
+        """Fill the tab from a scan axis, values = [step, nsteps]"""
+        step, nsteps, srange = centred_scan_range(step=values[0], nsteps=values[1])
+        self.scannable.set(scannable)
+        self.scan_step.set(strfmt(step))
+        self.scan_nsteps.set(strfmt(nsteps))
+        self.scan_range.set(strfmt(srange))
+
 
 class CentreScan2:
     """Centred Scan tab"""
+    scan_type = 'cscan'  # scan command filled by set_scan
 
     def __init__(self, parent, update_function=None):
         self.parent = parent
@@ -305,6 +342,11 @@ class CentreScan2:
         srange = eval(self.scan_range.get())
         return cscan(scannable, step, srange)
 
+    def scan_axes(self):
+        """Return scan type and list of (scannable, values), for timing without generating the command"""
+        values = [eval(self.scan_range.get()) / 2, eval(self.scan_step.get())]
+        return 'cscan', [(self.scannable.get(), values)]
+
     def get_sss(self):
         step = self.scan_step.get()
         nsteps = self.scan_nsteps.get()
@@ -338,12 +380,21 @@ class CentreScan2:
         opt = select_scannable(self.parent)
         if opt:
             self.scannable.set(opt)
-            if 'step' in SCANNABLES[opt]:
-                self.scan_step.set(SCANNABLES[opt]['step'])
+            info = registry().scannable_info(opt)
+            if 'step' in info:
+                self.scan_step.set(info['step'])
             else:
                 self.scan_step.set(0.1)
             self.get_sss()
 
+    def set_scan(self, scannable, values):
+        """Fill the tab from a scan axis, values = [halfwidth, step]"""
+        step, nsteps, srange = centred_scan_range(step=values[1], srange=2 * values[0])
+        self.scannable.set(scannable)
+        self.scan_step.set(strfmt(step))
+        self.scan_nsteps.set(strfmt(nsteps))
+        self.scan_range.set(strfmt(srange))
+
 
 class Theta2ThetaScan:
     """Absolute Scan tab"""
@@ -433,6 +484,12 @@ class Theta2ThetaScan:
             return theta2theta_horiz(gamma_start=start, gamma_stop=stop, gamma_step=step, mu_start=theta)
         return theta2theta_vert(delta_start=start, delta_stop=stop, delta_step=step, eta_start=theta)
 
+    def scan_axes(self):
+        """Return scan type and list of (scannable, values), for timing without generating the command"""
+        scannable = 'gam' if self.geometry.get() == 'Horizontal' else 'delta'
+        values = [eval(self.tth_start.get()), eval(self.tth_stop.get()), eval(self.tth_step.get())]
+        return 'scan', [(scannable, values)]
+
     def get_sss(self):
         start = self.tth_start.get()
         stop = self.tth_stop.get()
@@ -589,6 +646,11 @@ class EnergyScan:
         self.opt_hkl.set(True)
         self.opt_pol.set(True)
 
+    def scan_axes(self):
+        """Return scan type and list of (scannable, values), for timing without generating the command"""
+        values = [eval(self.scan_start.get()), eval(self.scan_stop.get()), eval(self.scan_step.get())]
+        return 'scan', [('energy', values)]
+
     def get_sss(self):
         start = self.scan_start.get()
         stop = self.scan_stop.get()
@@ -761,6 +823,12 @@ class TwoDimScan:
         step2 = eval(self.scan_step2.get())
         return scan2d(scannable1, start1, stop1, step1, scannable2, start2, stop2, step2)
 
+    def scan_axes(self):
+        """Return scan type and list of (scannable, values), for timing without generating the command"""
+        values1 = [eval(self.scan_start.get()), eval(self.scan_stop.get()), eval(self.scan_step.get())]
+        values2 = [eval(self.scan_start2.get()), eval(self.scan_stop2.get()), eval(self.scan_step2.get())]
+        return 'scan', [(self.scannable.get(), values1), (self.scannable2.get(), values2)]
+
     def get_sss(self):
         start = self.scan_start.get()
         stop = self.scan_stop.get()
@@ -806,16 +874,17 @@ class TwoDimScan:
         opt = select_scannable(self.parent)
         if opt:
             self.scannable.set(opt)
-            if 'start' in SCANNABLES[opt]:
-                self.scan_start.set(SCANNABLES[opt]['start'])
+            info = registry().scannable_info(opt)
+            if 'start' in info:
+                self.scan_start.set(info['start'])
             else:
                 self.scan_start.set(0)
-            if 'stop' in SCANNABLES[opt]:
-                self.scan_stop.set(SCANNABLES[opt]['stop'])
+            if 'stop' in info:
+                self.scan_stop.set(info['stop'])
             else:
                 self.scan_stop.set(1)
-            if 'step' in SCANNABLES[opt]:
-                self.scan_step.set(SCANNABLES[opt]['step'])
+            if 'step' in info:
+                self.scan_step.set(info['step'])
             else:
                 self.scan_step.set(0.1)
             self.get_sss()
@@ -865,16 +934,17 @@ class TwoDimScan:
         opt = select_scannable(self.parent)
         if opt:
             self.scannable2.set(opt)
-            if 'start' in SCANNABLES[opt]:
-                self.scan_start2.set(SCANNABLES[opt]['start'])
+            info = registry().scannable_info(opt)
+            if 'start' in info:
+                self.scan_start2.set(info['start'])
             else:
                 self.scan_start2.set(0)
-            if 'stop' in SCANNABLES[opt]:
-                self.scan_stop2.set(SCANNABLES[opt]['stop'])
+            if 'stop' in info:
+                self.scan_stop2.set(info['stop'])
             else:
                 self.scan_stop2.set(1)
-            if 'step' in SCANNABLES[opt]:
-                self.scan_step2.set(SCANNABLES[opt]['step'])
+            if 'step' in info:
+                self.scan_step2.set(info['step'])
             else:
                 self.scan_step2.set(0.1)
             self.get_sss2()
@@ -943,6 +1013,13 @@ class PsiScan:
         step = eval(self.scan_step.get())
         return psi(start, stop, step)
 
+    def scan_axes(self):
+        """Return scan type and list of (scannable, values), for timing without generating the command"""
+        if self.opt_cen.get():
+            return 'scancn', [('psic', [eval(self.scan_step.get()), eval(self.scan_nsteps.get())])]
+        values = [eval(self.scan_start.get()), eval(self.scan_stop.get()), eval(self.scan_step.get())]
+        return 'scan', [('psic', values)]
+
     def get_sss(self):
         start = self.scan_start.get()
         stop = self.scan_stop.get()
@@ -988,16 +1065,17 @@ class PsiScan:
         opt = select_scannable(self.parent)
         if opt:
             self.scannable.set(opt)
-            if 'start' in SCANNABLES[opt]:
-                self.scan_start.set(SCANNABLES[opt]['start'])
+            info = registry().scannable_info(opt)
+            if 'start' in info:
+                self.scan_start.set(info['start'])
             else:
                 self.scan_start.set(0)
-            if 'stop' in SCANNABLES[opt]:
-                self.scan_stop.set(SCANNABLES[opt]['stop'])
+            if 'stop' in info:
+                self.scan_stop.set(info['stop'])
             else:
                 self.scan_stop.set(1)
-            if 'step' in SCANNABLES[opt]:
-                self.scan_step.set(SCANNABLES[opt]['step'])
+            if 'step' in info:
+                self.scan_step.set(info['step'])
             else:
                 self.scan_step.set(0.1)
             self.get_sss()
@@ -1033,7 +1111,7 @@ class ScanOptions:
         self.lst_options.bind('<Double-Button-1>', self.lst_doubleclick)
 
         # Populate list box
-        for name in SCANOPTIONS:
+        for name in registry().option_names:
             self.lst_options.insert(tk.END, name)
         self.lst_options.pack(side=tk.TOP, fill=tk.BOTH, expand=tk.YES)
         scly.config(command=self.lst_options.yview)
@@ -1146,6 +1224,19 @@ class ScanOptions:
             self.lst_include.insert(tk.END, item)
 
 
+# Scan tabs of ScanGenerator, (title, class). Classes take (parent frame, update_function) and have
+# a command() method returning the scan command. Tabs are only built when first selected.
+SCAN_TABS = [
+    ('Absolute\nScan', AbsoluteScan),
+    ('Centred\nScan', CentreScan),
+    ('Centred\nScan2', CentreScan2),
+    ('θ\n2θ', Theta2ThetaScan),
+    ('Energy\nScan', EnergyScan),
+    ('2D\nScan', TwoDimScan),
+    ('Psi\nScan', PsiScan)
+]
+
+
 class ScanGenerator:
     """
     A Tabbed window for generating scan commands
@@ -1156,12 +1247,19 @@ class ScanGenerator:
     Use as part of a parent GUI:
         root = tk.Tk()
         cmd = ScanGenerator(root).show()  # Waits for user to press "insert"
+
+    With reuse=True, the window is hidden rather than destroyed, so it can be shown again keeping its settings:
+        generator = ScanGenerator(root, reuse=True)
+        cmd = generator.show('scancn eta 0.01 101 pil 1')  # pre-fill from a scan command
+        generator.destroy()  # when finished
     """
 
-    def __init__(self, parent=None, initial_command=''):
+    def __init__(self, parent=None, initial_command='', reuse=False):
         """Initialise"""
 
         self.parent = parent
+        self.reuse = reuse and parent is not None  # hide the window rather than destroy it
+        self.output = ''
 
         # Create Tk inter instance
         if self.parent is None:
@@ -1196,32 +1294,29 @@ class ScanGenerator:
         self.exposure = tk.DoubleVar(self.root, 1)
         self.time = tk.StringVar(self.root, '')
         self.command = tk.StringVar(self.root, initial_command)
+        self.result = tk.StringVar(self.root, '')  # written when the window is closed, see show
+        self._preview_after = None
+        self.detector.trace_add('write', self.schedule_preview)
+        self.exposure.trace_add('write', self.schedule_preview)
 
         "----------- TOP Scan Tabs -----------"
         frm = ttk.Frame(self.root)
         frm.pack(side=tk.TOP, expand=tk.YES, fill=tk.BOTH)
 
         self.tabControl = ttk.Notebook(frm)
-        tab_def = [
-            ('Absolute\nScan', AbsoluteScan),
-            ('Centred\nScan', CentreScan),
-            ('Centred\nScan2', CentreScan2),
-            ('θ\n2θ', Theta2ThetaScan),
-            ('Energy\nScan', EnergyScan),
-            ('2D\nScan', TwoDimScan),
-            ('Psi\nScan', PsiScan)
-        ]
         self.tabs = [{
             'title': title,
             'tab': ttk.Frame(self.tabControl),
             'class': tab_class,
-        } for title, tab_class in tab_def
+            'obj': None,
+        } for title, tab_class in SCAN_TABS
         ]
 
-        # Generate scan tabs
+        # Add empty scan tabs, the contents are generated when the tab is selected
         for tab in self.tabs:
             self.tabControl.add(tab['tab'], text=tab['title'])
-            tab['obj'] = tab['class'](tab['tab'], self.generate_command)
+        self.build_tab(0)
+        self.tabControl.bind('<<NotebookTabChanged>>', self.tab_changed)
         self.tabControl.pack(expand=tk.YES, fill=tk.BOTH)
 
         "----------- Middle Detector -----------"
@@ -1293,6 +1388,46 @@ class ScanGenerator:
     "--------------------------General Functions-----------------------------"
     "------------------------------------------------------------------------"
 
+    def build_tab(self, index):
+        """Return scan tab object, generating the tab contents if it hasn't been selected before"""
+        tab = self.tabs[index]
+        if tab['obj'] is None:
+            tab['obj'] = tab['class'](tab['tab'], self.generate_command)
+            # update the scan time as the tab values are edited
+            for var in vars(tab['obj']).values():
+                if isinstance(var, tk.Variable):
+                    var.trace_add('write', self.schedule_preview)
+        return tab['obj']
+
+    def tab_changed(self, event=None):
+        """Generate contents of selected tab"""
+        self.build_tab(self.tabControl.index(self.tabControl.select()))
+        self.schedule_preview()
+
+    def schedule_preview(self, *args):
+        """Update the scan time after PREVIEW_DELAY ms, restarting the delay on each change"""
+        self.cancel_preview()
+        self._preview_after = self.root.after(PREVIEW_DELAY, self.preview)
+
+    def cancel_preview(self):
+        """Cancel pending update of the scan time"""
+        if self._preview_after is not None:
+            self.root.after_cancel(self._preview_after)
+            self._preview_after = None
+
+    def preview(self):
+        """Update scan time from the values of the selected tab, using a timing model of the scan type"""
+        self._preview_after = None
+        index = self.tabControl.index(self.tabControl.select())
+        try:
+            scan_type, axes = self.build_tab(index).scan_axes()
+            exposure = self.exposure.get() if is_detector(detector_name(self.detector.get())) else 0
+            model = scan_time_model(scan_type, [name for name, values in axes])
+            time, npoints = model.time([values for name, values in axes], exposure)
+        except Exception:
+            return  # values incomplete while typing
+        self.time.set('%s (%s points)' % (time_string(time), npoints))
+
     def detector_command(self):
         """Generate detector command"""
         det_name = self.detector.get()
@@ -1309,7 +1444,7 @@ class ScanGenerator:
         det = select_detector(self.root)
         if det:
             self.detector.set(det)
-            self.exposure.set(DETECTORS[det]['exposure'])
+            self.exposure.set(registry().detector_info(det)['exposure'])
             rois = detector_rois(det)
             opts = self.options.lst_options.get(0, tk.END)
             for roi in rois:
@@ -1321,7 +1456,7 @@ class ScanGenerator:
         det_name = self.detector.get()
         det_name = detector_name(det_name)
         self.detector.set(det_name)
-        self.exposure.set(DETECTORS[det_name]['exposure'])
+        self.exposure.set(registry().detector_info(det_name)['exposure'])
         rois = detector_rois(det_name)
         opts = self.options.lst_options.get(0, tk.END)
         for roi in rois:
@@ -1339,7 +1474,7 @@ class ScanGenerator:
         """Generate command"""
         # Get scan tab
         index = self.tabControl.index(self.tabControl.select())
-        scan_command = self.tabs[index]['obj'].command()
+        scan_command = self.build_tab(index).command()
         detector_command = self.detector_command()
         options_command = self.options.command()
         cmd = ' '.join([scan_command, detector_command, options_command])
@@ -1352,17 +1487,72 @@ class ScanGenerator:
         self.root.clipboard_append(self.command.get())
         self.root.update()
 
+    def set_command(self, command):
+        """Fill the window from a scan command, e.g. 'scan eta 1 2 0.1 pil 1 roi2'"""
+        self.command.set(command.strip())
+        scan = ScanCommand.from_string(command)
+        if scan is not None:
+            self.fill_scan(scan)
+        self.cancel_preview()  # show the time of the whole command
+        self.ety_command()
+
+    def fill_scan(self, scan):
+        """Fill detector, options and scan tab from ScanCommand"""
+        for det_name, exposure in scan.detectors[:1]:
+            self.detector.set(det_name)
+            self.exposure.set(exposure)
+        self.options.lst_include.delete(0, tk.END)
+        for name, values in scan.options:
+            if not values:
+                self.options.lst_include.insert(tk.END, name)
+        axes = scan.axes
+        if len(axes) != 1:
+            return
+        for index, tab in enumerate(self.tabs):
+            if getattr(tab['class'], 'scan_type', None) == scan.scan_type:
+                try:
+                    self.build_tab(index).set_scan(*axes[0])
+                except (TypeError, ValueError, IndexError, ZeroDivisionError):
+                    return  # values not understood by the tab
+                self.tabControl.select(index)
+                return
+
     def insert_command(self):
-        """Insert command in parent, destroy window"""
-        self.root.destroy()
+        """Insert command in parent, hide or destroy window"""
+        self.close(self.command.get())
+
+    def close(self, output=''):
+        """Set the output of show, hide the window if it is reused, otherwise destroy it"""
+        self.cancel_preview()
+        self.output = output
+        if self.reuse:
+            self.root.withdraw()
+            self.result.set(output)
+        else:
+            self.root.destroy()
 
-    def show(self):
-        """Run the selection box, wait for response"""
+    def destroy(self):
+        """Destroy the window"""
+        self.cancel_preview()
+        self.root.destroy()
 
-        # self.root.deiconify()  # show window
-        self.root.wait_window()  # wait for window
-        return self.command.get()
+    def show(self, initial_command=None):
+        """
+        Show the window, wait for response
+        :param initial_command: None or str scan command to fill the window with
+        :return: str command if insert was pressed, '' if the window was closed
+        """
+        if initial_command:
+            self.set_command(initial_command)
+        self.output = ''
+        self.root.deiconify()  # show window
+        self.root.lift()
+        if self.reuse:
+            self.root.wait_variable(self.result)  # wait for insert or close
+        else:
+            self.root.wait_window()  # wait for window
+        return self.output
 
     def f_exit(self):
-        self.root.destroy()
+        self.close('')
 
@@ -9,15 +9,20 @@ Diamond Light Source Ltd
 
 import os
 import re
+import queue
 import datetime
+import threading
 import tkinter as tk
 from tkinter import ttk
 from tkinter import messagebox
 
-from i16_script_generator.params import SCANNABLES
-from i16_script_generator.timing import time_script_string, time_string, calc_tabpos, top_comment_lines
+from i16_script_generator.registry import registry
+from i16_script_generator.timing import time_string, calc_tabpos, top_comment_lines
+from i16_script_generator.scripttimer import IncrementalTimer
+from i16_script_generator.timingcache import timing_cache
+from i16_script_generator.tkhighlight import Highlighter
 from i16_script_generator.tkwidgets import TF, BF, SF, MF, bkg, ety, btn, opt, btn_active, opt_active, txtcol, \
-    ety_txt, SelectionBox, popup_about, popup_message, popup_help, topmenu, filedialog
+    ety_txt, SelectionBox, LineNumbers, popup_about, popup_message, popup_help, topmenu, filedialog
 from i16_script_generator.tkscangen import select_scannable, scan_range, strfmt, ScanGenerator
 
 
@@ -44,6 +49,13 @@ for chi_val in frange(84, 96, 2):
     scancn eta 0.01 101 pil 1 roi2
 ''' % datetime.datetime.now().strftime('%Y-%m-%d %H:%M')
 
+TIMING_DELAY = 500  # ms after typing stops before the script is timed
+HIGHLIGHT_DELAY = 50  # ms after typing stops before changed lines are highlighted
+POLL_TIME = 50  # ms between checks for timing results
+LARGE_FILE_LINES = 5000  # scripts with more lines are loaded in chunks and only the visible lines highlighted
+LOAD_CHUNK_LINES = 5000  # lines inserted into the editor at a time when loading large scripts
+VIEW_MARGIN = 50  # lines above and below the visible lines that are highlighted in large scripts
+
 # Define colors for the variouse types of tokens
 normal = '#eaeaea'  # rgb((234, 234, 234))
 keywords = '#ea5f5f'  # rgb((234, 95, 95))
@@ -54,30 +66,14 @@ function = '#5fd3ea'  # rgb((95, 211, 234))
 background = '#2a2a2a'  # rgb((42, 42, 42))
 font = 'Consolas 15'
 
-# Define a list of Regex Pattern that should be colored in a certain way
-REPL = [
-    [
-        r'(?:^|\s|\W)(False|None|True|and|as|assert|async|await|break|class|continue|def|del|elif|else|except|finally|' +
-        r'for|from|global|if|import|in|is|lambda|nonlocal|not|or|pass|raise|return|try|while|with|yield)(?:$|\s|\W)',
-        keywords
-    ],
-    [r'(?:^|\s|\W)(scan|scancn|cscan|frange|pos|inc|go)(?:$|\s|\W)', commands],
-    ['".*?"', string],
-    ['\'.*?\'', string],
-    ['#.*?$', comments],
-]
-
-
-def search_re(pattern, text):
-    matches = []
-    text = text.splitlines()
-    for i, line in enumerate(text):
-        for match in re.finditer(pattern, line):
-            if match.groups():
-                matches.append((f"{i + 1}.{match.span(1)[0]}", f"{i + 1}.{match.span(1)[1]}"))
-            else:
-                matches.append((f"{i + 1}.{match.start()}", f"{i + 1}.{match.end()}"))
-    return matches
+# Colours of each token class, see tkhighlight.Highlighter
+COLOURS = {
+    'keyword': keywords,
+    'command': commands,
+    'string': string,
+    'comment': comments,
+    'docstring': comments,
+}
 
 
 class TemplateSelector:
@@ -293,16 +289,17 @@ class LoopGen:
         opt = select_scannable(self.root)
         if opt:
             self.scannable.set(opt)
-            if 'start' in SCANNABLES[opt]:
-                self.scan_start.set(SCANNABLES[opt]['start'])
+            info = registry().scannable_info(opt)
+            if 'start' in info:
+                self.scan_start.set(info['start'])
             else:
                 self.scan_start.set('0')
-            if 'stop' in SCANNABLES[opt]:
-                self.scan_stop.set(SCANNABLES[opt]['stop'])
+            if 'stop' in info:
+                self.scan_stop.set(info['stop'])
             else:
                 self.scan_stop.set('1')
-            if 'step' in SCANNABLES[opt]:
-                self.scan_step.set(SCANNABLES[opt]['step'])
+            if 'step' in info:
+                self.scan_step.set(info['step'])
             else:
                 self.scan_step.set('0.1')
             self.get_sss()
@@ -364,6 +361,7 @@ class ScriptGenerator:
             'Tools': {
                 'Scan Generator': self.menu_scan,
                 'Script timer': self.menu_timer,
+                'Load namespace...': self.menu_registry,
             },
             'Help': {
                 'Docs': popup_help,
@@ -375,7 +373,15 @@ class ScriptGenerator:
         # Variables
         self.filename = tk.StringVar(self.root, filename)
         self.time_str = tk.StringVar(self.root, '0 s')
-        self.script_string = script_string
+        self.script_string = script_string  # script in the editor, read from the text widget after edits
+        self._edited = False  # text widget edited since script_string was read, see current_script
+        self.timer = IncrementalTimer()
+        self._timing = None  # (cancel, results, annotate) of running timing job
+        self._timing_after = None
+        self._loading = None  # after id while a large script is loaded
+        self._annotations = {}  # {lineno: (line, annotated_line)} not yet added in large scripts
+        self.large_file = False
+        self.scan_generator = None  # ScanGenerator window, kept hidden between scans
 
         "----------- TOP Filename -----------"
         frm = ttk.LabelFrame(self.root, text='Filename', relief=tk.RIDGE)
@@ -427,11 +433,21 @@ class ScriptGenerator:
         frm.pack(side=tk.TOP, expand=tk.YES, fill=tk.BOTH, padx=5, pady=5)
 
         # Add a hefty border width so we can achieve a little bit of padding
-        self.text = tk.Text(frm, background=background, foreground=normal, insertbackground=normal, relief=tk.FLAT,
+        box = tk.Frame(frm, background=background)
+        box.pack(side=tk.TOP, fill=tk.BOTH, expand=tk.YES)
+        self.text = tk.Text(box, background=background, foreground=normal, insertbackground=normal, relief=tk.FLAT,
                             borderwidth=30, font=font, undo=True, autoseparators=True, maxundo=-1)
-        self.text.pack(fill=tk.BOTH, expand=1)
-        self.text.insert('1.0', self.script_string)
-        self.text.bind('<KeyRelease>', self.changes)
+        self.gutter = LineNumbers(box, self.text, colour=comments, background=background)
+        self.gutter.pack(side=tk.LEFT, fill=tk.Y)
+        self.scrollbar = tk.Scrollbar(box, command=self.text.yview)
+        self.scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        self.text.configure(yscrollcommand=self.scrolled)
+        self.text.pack(side=tk.LEFT, fill=tk.BOTH, expand=tk.YES)
+        self.highlighter = Highlighter(self.text, COLOURS)
+        self._highlight_after = None
+        self.load_script(self.script_string)
+        self.text.bind('<Configure>', self.gutter.redraw, add='+')
+        self.text.bind('<<Modified>>', self.changes)
         self.text.bind('<Return>', self.auto_indent)
         self.text.bind('<KP_Enter>', self.auto_indent)
         self.text.bind('<Tab>', self.tab)
@@ -450,7 +466,7 @@ class ScriptGenerator:
         var.pack(side=tk.LEFT, padx=4)
 
         "-------------------------Start Mainloop------------------------------"
-        self.changes()
+        self.schedule_timing()
         self.root.protocol("WM_DELETE_WINDOW", self.f_exit)
         if self.parent is None:
             self.root.mainloop()
@@ -460,37 +476,191 @@ class ScriptGenerator:
     "------------------------------------------------------------------------"
 
     def changes(self, event=None):
-        """ Register Changes made to the Editor Content """
-
-        # If actually no changes have been made stop / return the function
-        if self.text.get('1.0', tk.END) == self.script_string:
+        """
+        Register Changes made to the Editor Content
+        Called by the <<Modified>> event of the text widget, the script isn't read until it is timed or saved and
+        only lines changed since the last highlight are re-lexed, see tkhighlight.Highlighter.
+        """
+        if not self.text.edit_modified():
+            return  # no changes, or the event from resetting the modified flag
+        self.text.edit_modified(False)
+        if self._loading is not None:
+            # script_string is set once the script has loaded
+            self.schedule_highlight()
+            return
+        self._edited = True
+        self.schedule_highlight()
+        self.gutter.redraw()
+        self.schedule_timing()
+
+    def current_script(self):
+        """Return the script in the editor, reading the text widget only if it has been edited"""
+        if self._edited and self._loading is None:
+            self.script_string = self.text.get('1.0', tk.END)
+            self._edited = False
+        return self.script_string
+
+    def load_script(self, script):
+        """
+        Replace the script in the editor
+        Scripts longer than LARGE_FILE_LINES are inserted in chunks after the window has been drawn, and only
+        the visible lines are highlighted and annotated with timings.
+        """
+        if self._loading is not None:
+            self.root.after_cancel(self._loading)
+            self._loading = None
+        self.script_string = script
+        self._annotations = {}
+        lines = script.split('\n')
+        self.large_file = len(lines) > LARGE_FILE_LINES
+        chunks = ['\n'.join(lines[n:n + LOAD_CHUNK_LINES]) for n in range(0, len(lines), LOAD_CHUNK_LINES)]
+        self.text.delete('1.0', tk.END)
+        self.text.insert('1.0', chunks[0])
+        self.text.edit_modified(False)  # loading isn't an edit
+        self._edited = False
+        if len(chunks) > 1:
+            self._loading = self.root.after(1, self.load_chunk, iter(chunks[1:]))
+        self.schedule_highlight()
+
+    def load_chunk(self, chunks):
+        """Insert the next chunk of a large script, see load_script"""
+        chunk = next(chunks, None)
+        if chunk is None:
+            self._loading = None
+            self.text.edit_reset()  # loading the script can't be undone
+            self.text.edit_modified(False)
+            self.script_string = self.text.get('1.0', tk.END)
+            return
+        self.text.insert('end-1c', '\n' + chunk)
+        self._loading = self.root.after(1, self.load_chunk, chunks)
+
+    def visible_lines(self):
+        """Return first, last line numbers displayed in the editor"""
+        first = self.text.index('@0,0')
+        last = self.text.index('@0,%d' % self.text.winfo_height())
+        return int(first.split('.')[0]), int(last.split('.')[0])
+
+    def scrolled(self, first, last):
+        """Text widget yscrollcommand, updates the scrollbar, line numbers and highlighting of large scripts"""
+        self.scrollbar.set(first, last)
+        self.gutter.redraw()
+        if self.large_file:
+            self.schedule_highlight()
+
+    def schedule_highlight(self, delay=HIGHLIGHT_DELAY):
+        """Highlight changed lines after a delay, repeated calls within the delay are combined"""
+        if self._highlight_after is not None:
+            self.root.after_cancel(self._highlight_after)
+        self._highlight_after = self.root.after(delay, self.highlight)
+
+    def highlight(self):
+        """
+        Highlight lines changed since the last call, see tkhighlight.Highlighter
+        In large scripts only the visible lines are highlighted and annotated.
+        """
+        self._highlight_after = None
+        if self.large_file:
+            first, last = self.visible_lines()
+            first, last = first - VIEW_MARGIN, last + VIEW_MARGIN
+            self.highlighter.highlight(first, last)
+            self.annotate_lines(first, last)
+        else:
+            self.highlighter.highlight()
+
+    def schedule_timing(self, delay=TIMING_DELAY):
+        """Cancel any running timing job and start timing the script after a delay"""
+        self.cancel_timing()
+        if self._timing_after is not None:
+            self.root.after_cancel(self._timing_after)
+        self._timing_after = self.root.after(delay, self.start_timing)
+
+    def cancel_timing(self):
+        """Cancel running timing job"""
+        if self._timing is not None:
+            self._timing[0].set()
+            self._timing = None
+
+    def start_timing(self, annotate=False):
+        """
+        Time the script in a background thread, only blocks of the script that have changed are re-timed
+        Results are collected by poll_timing
+        :param annotate: if True, add timing comments to the script when timing finishes
+        """
+        self.cancel_timing()
+        if self._timing_after is not None:
+            self.root.after_cancel(self._timing_after)
+            self._timing_after = None
+        cancel = threading.Event()
+        results = queue.Queue()
+        script = self.current_script()
+
+        def progress(n, nblocks):
+            results.put(('progress', 100 * n // max(nblocks, 1)))
+
+        def run():
+            try:
+                total = self.timer.update(script, progress, cancel)
+                timings = timing_cache() if annotate and total is not None else None
+                if timings:
+                    timings.put(script, total, self.timer.line_times, self.timer.annotated_script(),
+                                self.timer.warnings, engine='IncrementalTimer')
+                results.put(('done', total))
+            except Exception as xx:
+                results.put(('error', xx))
+
+        job = (cancel, results, annotate)
+        self._timing = job
+        self.time_str.set('timing...')
+        threading.Thread(target=run, daemon=True).start()
+        self.root.after(POLL_TIME, self.poll_timing, job)
+
+    def poll_timing(self, job):
+        """Check for results of timing job, repeats until the job is finished or cancelled"""
+        cancel, results, annotate = job
+        if job is not self._timing:
             return
+        while not results.empty():
+            message, value = results.get()
+            if message == 'progress':
+                self.time_str.set('timing... %d%%' % value)
+            elif message == 'error':
+                self._timing = None
+                self.time_str.set('timing failed: %s' % value)
+                return
+            elif message == 'done':
+                self._timing = None
+                if value is not None:
+                    self.time_str.set(time_string(value))
+                    if annotate:
+                        self.annotate_script()
+                return
+        self.root.after(POLL_TIME, self.poll_timing, job)
+
+    def annotate_script(self):
+        """Replace the script with the script annotated with timing comments"""
+        if self.large_file:
+            # annotate lines as they are displayed
+            self._annotations = self.timer.annotated_lines()
+            self.schedule_highlight()
+            return
+        self.load_script(self.timer.annotated_script())
+        self.changes()
 
-        # Remove all tags so they can be redrawn
-        for tag in self.text.tag_names():
-            self.text.tag_remove(tag, "1.0", tk.END)
-
-        # Add tags where the search_re function found the pattern
-        i = 0
-        for pattern, color in REPL:
-            for start, end in search_re(pattern, self.text.get('1.0', tk.END)):
-                self.text.tag_add(f'{i}', start, end)
-                self.text.tag_config(f'{i}', foreground=color)
-                i += 1
-
-        # Add tags to multiline comments
-        start = None
-        for n, line in enumerate(self.text.get('1.0', tk.END).splitlines()):
-            for match in re.finditer('\'{3}|\"{3}', line):
-                if start:
-                    self.text.tag_add(f'{i}', start, f"{n + 1}.{match.end()}")
-                    self.text.tag_config(f'{i}', foreground=comments)
-                    i += 1
-                    start = None
-                else:
-                    start = f"{n + 1}.{match.start()}"
-
-        self.script_string = self.text.get('1.0', tk.END)
+    def annotate_lines(self, first, last):
+        """Add timing comments to lines first-last of large scripts, lines edited since timing are skipped"""
+        annotated = False
+        for lineno in range(max(first, 1), last + 1):
+            if lineno not in self._annotations:
+                continue
+            start, end = '%d.0' % lineno, '%d.end' % lineno
+            line, annotated_line = self._annotations[lineno]
+            if self.text.get(start, end) == line:
+                del self._annotations[lineno]
+                self.text.delete(start, end)
+                self.text.insert(start, annotated_line)
+                annotated = True
+        if annotated:
+            self.changes()
 
     def tab(self, event=None):
         if event is None:
@@ -609,8 +779,7 @@ class ScriptGenerator:
         """Overwrite"""
         answer = messagebox.askokcancel('Script editor', 'Do you want to replace the current script?')
         if answer:
-            self.text.delete('1.0', tk.END)
-            self.text.insert('1.0', SCRIPT)
+            self.load_script(SCRIPT)
             self.changes()
 
     def menu_open(self):
@@ -622,12 +791,17 @@ class ScriptGenerator:
         )
         if filename:
             with open(filename, 'r') as f:
-                self.script_string = f.read()
-            self.text.delete('1.0', tk.END)
-            self.text.insert('1.0', self.script_string)
+                script = f.read()
             self.filename.set(filename)
-            self.changes()
-            self.btn_timeit()
+            timings = timing_cache()
+            entry = timings.get(script, 'IncrementalTimer') if timings else None
+            if entry is None:
+                self.load_script(script)
+                self.start_timing(annotate=True)
+            else:
+                # script timed previously
+                self.load_script(entry.annotated)
+                self.time_str.set(time_string(entry.total))
     
     def menu_saveas(self):
         """Save as file"""
@@ -635,7 +809,7 @@ class ScriptGenerator:
         filename = filedialog.asksaveasfile(title='I16 Script', initialfile=c_filename, defaultextension='.py')
         if filename:
             with open(filename, 'w') as f:
-                f.write(self.script_string)
+                f.write(self.current_script())
             print('Written script to %s' % filename)
             self.filename.set(filename)
     
@@ -645,13 +819,25 @@ class ScriptGenerator:
         if filename == '':
             self.menu_saveas()
         with open(filename, 'w') as f:
-            f.write(self.script_string)
+            f.write(self.current_script())
         print('Written script to %s' % filename)
     
     def menu_scan(self):
         """Start ScanGenerator GUI"""
         ScanGenerator()
     
+    def menu_registry(self):
+        """Load scannables and detectors from a GDA namespace dump, see registry.load_registry"""
+        from i16_script_generator.registry import set_registry_file
+        filename = filedialog.askopenfilename(
+            title='Open GDA namespace dump',
+            filetypes=(("JSON or YAML files", "*.json *.yaml *.yml"), ("All files", "*.*"))
+        )
+        if filename:
+            set_registry_file(filename)
+            print(registry())
+            self.schedule_timing()
+
     def menu_timer(self):
         """Get script time"""
         from i16_script_generator.timing import time_script, time_string
@@ -661,7 +847,7 @@ class ScriptGenerator:
             filetypes=(("Python files", "*.py"), ("All files", "*.*"))
         )
         if filename:
-            time = time_script(filename)
+            time = time_script(filename, cache=True)
             msg = "Script: \n%s \nwill take %s" % (filename, time_string(time.total_seconds()))
             messagebox.showinfo('I16 Script Timer', msg)
 
@@ -701,11 +887,13 @@ class ScriptGenerator:
             self.changes()
 
     def btn_scan(self):
-        scan = ScanGenerator(self.root).show()
+        start = self.text.index('insert linestart')
+        stop = self.text.index('insert lineend')
+        line = self.text.get(start, stop)
+        if self.scan_generator is None:
+            self.scan_generator = ScanGenerator(self.root, reuse=True)
+        scan = self.scan_generator.show(line if 'scan' in line else None)
         if scan:
-            start = self.text.index('insert linestart')
-            stop = self.text.index('insert lineend')
-            line = self.text.get(start, stop)
             tabpos = calc_tabpos(line)
             if 'scan' in line:
                 self.text.delete(start, stop)
@@ -724,13 +912,15 @@ class ScriptGenerator:
         self.comment()
 
     def btn_timeit(self):
-        """Time the script"""
-        time, self.script_string = time_script_string(self.script_string)
-        self.time_str.set(time_string(time.total_seconds()))
-        self.text.delete('1.0', tk.END)
-        self.text.insert('1.0', self.script_string)
-        self.changes()
+        """Time the script in the background, adding timing comments to each scan and loop"""
+        self.start_timing(annotate=True)
 
     def f_exit(self):
+        self.cancel_timing()
+        for after_id in [self._loading, self._highlight_after]:
+            if after_id is not None:
+                self.root.after_cancel(after_id)
+        if self.scan_generator is not None:
+            self.scan_generator.f_exit()  # release show() if waiting
         self.root.destroy()
 
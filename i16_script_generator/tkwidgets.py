@@ -7,8 +7,10 @@ Oct 2022
 """
 
 import os, re
+import functools
 import tkinter as tk
 from tkinter import filedialog
+from tkinter import font as tkfont
 from tkinter import messagebox
 
 TF = ["Times", 12]  # entry
@@ -29,6 +31,7 @@ btn_txt = 'black'
 ety_txt = 'black'
 opt_txt = 'black'
 ttl_txt = 'red'
+SEARCH_INDEX_CACHE = 16  # number of field lists with a cached search index
 
 
 def popup_message(parent, title, message):
@@ -139,15 +142,144 @@ class StringViewer:
         self.root.destroy()
 
 
+"------------------------------------------------------------------------"
+"----------------------------Line Numbers--------------------------------"
+"------------------------------------------------------------------------"
+
+
+class LineNumbers(tk.Canvas):
+    """
+    Line number gutter for a Text widget
+    Only the numbers of visible lines are drawn, call redraw() when the text is scrolled or edited.
+        gutter = LineNumbers(frame, text)
+        gutter.pack(side=tk.LEFT, fill=tk.Y)
+        text.pack(side=tk.LEFT, fill=tk.BOTH, expand=tk.YES)
+        text.configure(yscrollcommand=lambda *args: gutter.redraw())
+    """
+
+    def __init__(self, parent, text, font=None, colour='grey', **kwargs):
+        kwargs.setdefault('highlightthickness', 0)
+        tk.Canvas.__init__(self, parent, width=1, **kwargs)
+        self.text = text
+        self.font = tkfont.Font(font=font or text.cget('font'))
+        self.colour = colour
+        self.drawn = None  # [(lineno, y)] of the last redraw
+        self.digits = 0
+
+    def visible_lines(self):
+        """Return [(lineno, y)] of lines displayed in the text widget"""
+        lines = []
+        index = self.text.index('@0,0')
+        dline = self.text.dlineinfo(index)
+        while dline is not None:
+            lines.append((int(index.split('.')[0]), dline[1]))
+            next_index = self.text.index('%s +1line' % index)
+            if next_index == index:
+                break
+            index = next_index
+            dline = self.text.dlineinfo(index)
+        return lines
+
+    def redraw(self, event=None):
+        """Draw the numbers of the visible lines, if they have changed"""
+        lines = self.visible_lines()
+        if lines == self.drawn:
+            return
+        self.drawn = lines
+        digits = len(self.text.index('end-1c').split('.')[0])
+        if digits != self.digits:
+            self.digits = digits
+            self.configure(width=self.font.measure('0' * max(digits, 3)) + 10)
+        width = int(self.cget('width'))
+        self.delete('all')
+        for lineno, y in lines:
+            self.create_text(width - 5, y, anchor=tk.NE, text='%d' % lineno, font=self.font, fill=self.colour)
+
+
 "------------------------------------------------------------------------"
 "----------------------------Selection Box-------------------------------"
 "------------------------------------------------------------------------"
 
 
+@functools.lru_cache(maxsize=SEARCH_INDEX_CACHE)
+def trigram_index(fields):
+    """
+    Return {trigram: list of field indexes} of every 3-character substring of each field
+    The index is cached, so it is only built once for each list of fields.
+    :param fields: tuple of lower case str
+    :return: dict
+    """
+    index = {}
+    for idx, field in enumerate(fields):
+        for trigram in {field[n:n + 3] for n in range(len(field) - 2)}:
+            index.setdefault(trigram, []).append(idx)
+    return index
+
+
+class SearchIndex:
+    """
+    Case-insensitive substring search of a list of strings
+    An index of every 3-character substring (trigram) of the fields is built once per list of fields, so the
+    fields containing a search string are found by intersecting the fields of each trigram in the search string.
+    When the search string extends the previous one (i.e. while typing), the previous matches are narrowed instead.
+
+        index = SearchIndex(['eta', 'chi', 'phi', 'sgu'])
+        index.search('hi')  # [1, 2]
+        index.search('phi')  # [2], narrowed from the matches of 'hi'
+
+    Matches are returned as indexes of fields, fields where the search string is a whole word first.
+    """
+
+    def __init__(self, fields):
+        self.fields = tuple('{}'.format(field).lower() for field in fields)
+        self.trigrams = trigram_index(self.fields)
+        self.previous = (None, [])  # previous search string and matching fields
+
+    def __len__(self):
+        return len(self.fields)
+
+    def find(self, search_str):
+        """Return sorted list of indexes of fields containing search_str"""
+        if len(search_str) < 3:
+            return [idx for idx, field in enumerate(self.fields) if search_str in field]
+        trigrams = {search_str[n:n + 3] for n in range(len(search_str) - 2)}
+        postings = sorted((self.trigrams.get(trigram, []) for trigram in trigrams), key=len)
+        candidates = set(postings[0])
+        for posting in postings[1:]:
+            candidates.intersection_update(posting)
+            if not candidates:
+                break
+        return sorted(idx for idx in candidates if search_str in self.fields[idx])
+
+    def search(self, search_str):
+        """
+        Return list of indexes of fields containing search_str, whole word matches first
+        :param search_str: str, case-insensitive. If empty, all fields are returned
+        :return: list of int
+        """
+        search_str = search_str.strip().lower()
+        if not search_str:
+            self.previous = (None, [])
+            return list(range(len(self.fields)))
+        previous_str, previous = self.previous
+        if previous_str is not None and search_str.startswith(previous_str):
+            matches = [idx for idx in previous if search_str in self.fields[idx]]
+        else:
+            matches = self.find(search_str)
+        self.previous = (search_str, matches)
+        whole_word = re.compile(r'\b%s\b' % re.escape(search_str))
+        words = [idx for idx in matches if whole_word.search(self.fields[idx])]
+        if len(words) == len(matches):
+            return words
+        words_set = set(words)
+        return words + [idx for idx in matches if idx not in words_set]
+
+
 class SelectionBox:
     """
     Displays all data fields and returns a selection
     Making a selection returns a list of field strings
+    Typing in the search box filters the list to fields containing the search string, see SearchIndex
 
     out = SelectionBox(['field1','field2','field3'], current_selection=['field2'], title='', multiselect=False).show()
     # Make selection and press "Select" > box disappears
@@ -160,6 +292,10 @@ class SelectionBox:
     def __init__(self, parent, data_fields, current_selection=(), title='Make a selection', multiselect=True):
         self.data_fields = data_fields
         self.initial_selection = current_selection
+        self.multiselect = multiselect
+        self.index = SearchIndex(data_fields)
+        self.shown = list(range(len(data_fields)))  # indexes of data_fields in the listbox
+        self.selected = {n for n, field in enumerate(data_fields) if field in current_selection}
 
         # Create Tk inter instance
         self.root = tk.Toplevel(parent)
@@ -197,16 +333,8 @@ class SelectionBox:
         self.lst_data.bind('<Double-Button-1>', self.fun_exitbutton)
 
         # Populate list box
-        for k in self.data_fields:
-            # if k[0] == '_': continue # Omit _OrderedDict__root/map
-            strval = '{}'.format(k)
-            self.lst_data.insert(tk.END, strval)
-
         self.lst_data.pack(side=tk.LEFT, fill=tk.BOTH, expand=tk.YES)
-        for select in current_selection:
-            if select in data_fields:
-                idx = data_fields.index(select)
-                self.lst_data.select_set(idx)
+        self.fill_list(self.shown)
 
         sclx.config(command=self.lst_data.xview)
         scly.config(command=self.lst_data.yview)
@@ -218,9 +346,11 @@ class SelectionBox:
         frm.pack(fill=tk.X, expand=tk.YES, padx=2, pady=2)
 
         self.searchbox = tk.StringVar(self.root, '')
+        self.searchbox.trace_add('write', self.fun_search)
         var = tk.Entry(frm, textvariable=self.searchbox, font=TF, bg=ety, fg=ety_txt)
-        var.bind('<Key>', self.fun_search)
+        var.bind('<Return>', self.fun_exitbutton)
         var.pack(fill=tk.X, expand=tk.YES, padx=2, pady=2)
+        var.focus_set()
 
         "----------------------------Exit Button------------------------------"
         frm_btn = tk.Frame(frame)
@@ -248,39 +378,41 @@ class SelectionBox:
         self.root.wait_window()  # wait for window
         return self.output
 
-    def fun_search(self, event=None):
-        """Search the selection for string"""
-        search_str = self.searchbox.get()
-        search_str = search_str + event.char
-        search_str = search_str.strip().lower()
-        if not search_str: return
-
-        # Clear current selection
-        self.lst_data.select_clear(0, tk.END)
-        view_idx = None
-        # Search for whole words first
-        for n, item in enumerate(self.data_fields):
-            if re.search(r'\b%s\b' % search_str, item.lower()):  # whole word search
-                self.lst_data.select_set(n)
-                view_idx = n
-        # if nothing found, search anywhere
-        if view_idx is None:
-            for n, item in enumerate(self.data_fields):
-                if search_str in item.lower():
-                    self.lst_data.select_set(n)
-                    view_idx = n
-        if view_idx is not None:
-            self.lst_data.see(view_idx)
+    def fill_list(self, indexes):
+        """Replace the listbox contents with data_fields[indexes], keeping the selection"""
+        self.shown = indexes
+        self.lst_data.delete(0, tk.END)
+        self.lst_data.insert(tk.END, *('{}'.format(self.data_fields[n]) for n in indexes))
+        for row, n in enumerate(indexes):
+            if n in self.selected:
+                self.lst_data.select_set(row)
+
+    def fun_search(self, *args):
+        """Filter the list to fields containing the search string"""
+        matches = self.index.search(self.searchbox.get())
+        self.fill_list(matches)
+        if matches and not self.multiselect:
+            # select the best match
+            self.selected = {matches[0]}
+            self.lst_data.select_set(0)
+        if matches:
+            self.lst_data.see(0)
         self.fun_listboxselect()
 
     def fun_listboxselect(self, event=None):
         """Update label on listbox selection"""
-        self.numberoffields.set('%3d Selected Fields' % len(self.lst_data.curselection()))
+        selection = {self.shown[row] for row in self.lst_data.curselection()}
+        if self.multiselect:
+            # fields hidden by the search stay selected
+            self.selected = (self.selected - set(self.shown)) | selection
+        else:
+            self.selected = selection
+        self.numberoffields.set('%3d Selected Fields' % len(self.selected))
 
     def fun_exitbutton(self, event=None):
         """Closes the current data window and generates output"""
-        selection = self.lst_data.curselection()
-        self.output = [self.data_fields[n] for n in selection]
+        self.fun_listboxselect()
+        self.output = [self.data_fields[n] for n in sorted(self.selected)]
         self.root.destroy()
 
     def f_exit(self, event=None):
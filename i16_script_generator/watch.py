@@ -0,0 +1,214 @@
+"""
+Script directory watcher
+Watches a directory of scripts, re-timing scripts as they are saved and keeping a summary of the
+predicted duration of every script.
+
+The directory is polled for modification times (os.scandir, no extra packages), only scripts that have
+changed are re-timed. Each script keeps an IncrementalTimer, so only the edited blocks of a script are
+re-timed. Scripts seen for the first time are looked up in the timing cache, see timingcache.
+
+    $ python -m i16_script_generator.watch /dls_sw/i16/scripts/2022/mm12345-1 --output visit_times.json
+
+    watcher = ScriptWatcher('/dls_sw/i16/scripts/2022/mm12345-1')
+    changed = watcher.update()  # re-time changed scripts
+    print(summary_table(watcher.results()))
+
+By Dan Porter, PhD
+Diamond Light Source Ltd
+2022
+"""
+
+import os
+import json
+import time
+import fnmatch
+import datetime
+import threading
+
+from i16_script_generator.timing import time_string, sort_summaries, summary_table
+
+POLL_INTERVAL = 2.0  # seconds between checks for changed scripts
+
+
+class ScriptWatcher:
+    """
+    Watch a directory of scripts, re-timing changed scripts
+        watcher = ScriptWatcher(directory)
+        watcher.update()  # returns list of changed or removed scripts
+        watcher.results()  # list of summary dicts, see timing.time_script_summary
+        watcher.watch(callback=report)  # poll until interrupted
+    :param directory: str directory of scripts
+    :param pattern: str glob pattern of script files
+    :param recursive: if True, also watch sub-directories
+    :param cache: if True, use the timing cache for scripts seen for the first time
+    """
+
+    def __init__(self, directory, pattern='*.py', recursive=False, cache=False):
+        self.directory = directory
+        self.pattern = pattern
+        self.recursive = recursive
+        self.cache = cache
+        self.stats = {}  # {filename: (mtime_ns, size)} of timed scripts
+        self.timers = {}  # {filename: IncrementalTimer}
+        self.summaries = {}  # {filename: summary dict}
+        self.retimed = 0  # number of scripts timed in the last update
+
+    def __repr__(self):
+        return 'ScriptWatcher(%r, %d scripts)' % (self.directory, len(self.summaries))
+
+    def files(self):
+        """Return {filename: (mtime_ns, size)} of scripts in the directory"""
+        files = {}
+        directories = [self.directory]
+        while directories:
+            try:
+                entries = list(os.scandir(directories.pop()))
+            except OSError:
+                continue  # directory removed
+            for entry in entries:
+                try:
+                    if entry.is_dir():
+                        if self.recursive:
+                            directories.append(entry.path)
+                    elif entry.is_file() and fnmatch.fnmatch(entry.name, self.pattern):
+                        stat = entry.stat()
+                        files[entry.path] = (stat.st_mtime_ns, stat.st_size)
+                except OSError:
+                    continue  # file removed
+        return files
+
+    def update(self):
+        """Re-time scripts that have changed since the last update, returns list of changed or removed files"""
+        files = self.files()
+        changed = [filename for filename in self.stats if filename not in files]
+        for filename in changed:
+            del self.stats[filename]
+            self.timers.pop(filename, None)
+            self.summaries.pop(filename, None)
+        self.retimed = 0
+        for filename, stat in files.items():
+            if self.stats.get(filename) == stat:
+                continue
+            self.stats[filename] = stat
+            self.summaries[filename] = self.time_file(filename, stat[0])
+            changed.append(filename)
+        return changed
+
+    def time_file(self, filename, mtime_ns=0):
+        """Time script, re-timing only changed blocks if the script has been timed before"""
+        from i16_script_generator.scripttimer import IncrementalTimer
+        from i16_script_generator.timingcache import timing_cache
+        summary = {
+            'file': filename,
+            'seconds': 0.0,
+            'duration': time_string(0),
+            'lines': 0,
+            'warnings': [],
+            'modified': datetime.datetime.fromtimestamp(mtime_ns / 1e9).isoformat(timespec='seconds'),
+        }
+        try:
+            with open(filename) as f:
+                script = f.read()
+            timings = timing_cache() if self.cache else None
+            entry = timings.get(script, 'IncrementalTimer') if timings and filename not in self.timers else None
+            if entry is None:
+                timer = self.timers.setdefault(filename, IncrementalTimer())
+                total = timer.update(script)
+                self.retimed += 1
+                if timings:
+                    timings.put(script, total, timer.line_times, timer.annotated_script(), timer.warnings,
+                                engine='IncrementalTimer')
+                seconds, lines, warnings = float(total), len(timer.lines), timer.warnings
+            else:
+                seconds, lines, warnings = entry.total, entry.annotated.count('\n') + 1, entry.warnings
+        except Exception as xx:
+            self.timers.pop(filename, None)
+            summary['warnings'] = ['Timing failed: %s' % xx]
+            return summary
+        summary.update(seconds=seconds, duration=time_string(seconds), lines=lines, warnings=warnings)
+        return summary
+
+    def results(self, sort='time'):
+        """Return list of summary dicts sorted by 'time', 'name' or 'lines', see timing.sort_summaries"""
+        return sort_summaries(self.summaries.values(), sort)
+
+    def summary(self, sort='time'):
+        """Return dict summary of all scripts"""
+        results = self.results(sort)
+        total = sum(r['seconds'] for r in results)
+        return {
+            'directory': self.directory,
+            'updated': datetime.datetime.now().isoformat(timespec='seconds'),
+            'seconds': total,
+            'duration': time_string(total),
+            'scripts': results,
+        }
+
+    def write_summary(self, filename, sort='time'):
+        """Write JSON summary file, replacing the file once written so readers never see a partial file"""
+        tmp_file = '%s.%d.tmp' % (filename, os.getpid())
+        with open(tmp_file, 'w') as f:
+            json.dump(self.summary(sort), f, indent=2)
+        os.replace(tmp_file, filename)
+
+    def watch(self, interval=POLL_INTERVAL, callback=None, stop=None):
+        """
+        Update every interval seconds until stop is set
+        :param interval: float seconds between checks for changed scripts
+        :param callback: None or function(watcher, changed) called after an update that changed scripts
+        :param stop: None or threading.Event
+        """
+        stop = threading.Event() if stop is None else stop
+        first = True
+        while first or not stop.wait(interval):
+            changed = self.update()
+            if (changed or first) and callback is not None:
+                callback(self, changed)
+            first = False
+
+
+def main(argv=None):
+    """
+    Command line directory watcher
+        $ python -m i16_script_generator.watch /dls_sw/i16/scripts/2022/mm12345-1 --output visit_times.json
+    """
+    import argparse
+    parser = argparse.ArgumentParser(
+        prog='python -m i16_script_generator.watch',
+        description='Re-time I16 scripts in a directory as they are saved'
+    )
+    parser.add_argument('path', help='script directory')
+    parser.add_argument('-i', '--interval', type=float, default=POLL_INTERVAL, help='seconds between checks')
+    parser.add_argument('-o', '--output', default=None, help='JSON summary file, updated when scripts change')
+    parser.add_argument('--pattern', default='*.py', help='glob pattern of script files, default: *.py')
+    parser.add_argument('-r', '--recursive', action='store_true', help='include sub-directories')
+    parser.add_argument('--sort', choices=['time', 'name', 'lines'], default='time', help='table order')
+    parser.add_argument('--once', action='store_true', help='time the scripts once and exit')
+    parser.add_argument('--registry', default=None, help='JSON or YAML dump of the GDA namespace')
+    parser.add_argument('--no-cache', action='store_true', help='re-time every script, ignoring the timing cache')
+    args = parser.parse_args(argv)
+    if args.registry:
+        from i16_script_generator.registry import set_registry_file
+        set_registry_file(args.registry)
+
+    def report(watcher, changed):
+        results = watcher.results(args.sort)
+        if args.output:
+            watcher.write_summary(args.output, args.sort)
+        print('----- %s: %d scripts, %d changed, %d timed -----' % (
+            time.strftime('%H:%M:%S'), len(results), len(changed), watcher.retimed))
+        print(summary_table(results))
+
+    watcher = ScriptWatcher(args.path, args.pattern, args.recursive, cache=not args.no_cache)
+    if args.once:
+        watcher.update()
+        report(watcher, list(watcher.summaries))
+        return
+    try:
+        watcher.watch(args.interval, report)
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+"""
+I16 Script Generator
+Import time benchmark
+
+Times importing each entry point in a fresh Python process, and lists which heavy modules were loaded.
+Use --baseline to compare with an earlier git revision of the package.
+
+    $ python import_benchmark.py
+    $ python import_benchmark.py --baseline HEAD~1 --repeat 20
+"""
+
+import os
+import sys
+import subprocess
+import tempfile
+import statistics
+
+STATEMENTS = [
+    'import i16_script_generator',
+    'from i16_script_generator.timing import time_script',
+    'from i16_script_generator.scripttimer import ScriptTimer',
+    'from i16_script_generator.scancommand import ScanCommand',
+    'from i16_script_generator import ScriptGenerator',
+]
+HEAVY_MODULES = ['tkinter', 'numpy']
+
+TIMER = """
+import sys, time
+start = time.perf_counter()
+%s
+print(time.perf_counter() - start, ','.join(m for m in %r if m in sys.modules))
+"""
+
+
+def time_import(statement, path, repeat=10):
+    """Return median import time in ms and str of heavy modules loaded, each import in a new process"""
+    env = dict(os.environ, PYTHONPATH=path)
+    times = []
+    modules = ''
+    for n in range(repeat):
+        output = subprocess.run(
+            [sys.executable, '-c', TIMER % (statement, HEAVY_MODULES)],
+            env=env, cwd=path, capture_output=True, text=True
+        )
+        if output.returncode:
+            return float('nan'), output.stderr.strip().splitlines()[-1]
+        seconds, modules = (output.stdout.split() + [''])[:2]
+        times.append(1000 * float(seconds))
+    return statistics.median(times), modules
+
+
+def checkout(revision, directory):
+    """Extract package from git revision into directory"""
+    archive = subprocess.run(['git', 'archive', revision, 'i16_script_generator'], capture_output=True, check=True)
+    subprocess.run(['tar', '-x', '-C', directory], input=archive.stdout, check=True)
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description='Time imports of i16_script_generator')
+    parser.add_argument('--baseline', default=None, help='git revision to compare with, e.g. HEAD~1')
+    parser.add_argument('--repeat', type=int, default=10, help='number of imports of each statement')
+    args = parser.parse_args()
+
+    here = os.path.dirname(os.path.abspath(__file__))
+    with tempfile.TemporaryDirectory() as baseline_dir:
+        paths = [('current', here)]
+        if args.baseline:
+            checkout(args.baseline, baseline_dir)
+            paths.insert(0, (args.baseline, baseline_dir))
+        print('Median import time of %d runs, modules loaded' % args.repeat)
+        for statement in STATEMENTS:
+            print(statement)
+            for label, path in paths:
+                ms, modules = time_import(statement, path, args.repeat)
+                print('  %12s: %7.1f ms  %s' % (label, ms, modules))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,46 @@
+"""
+I16 Script Generator
+Tests of dryrun
+"""
+
+from i16_script_generator.dryrun import dry_run
+
+SCRIPT = """x = 5
+pos x1 1
+scan x 1 2 0.1 pil 1
+for i in range(x):
+    w(10)
+w(x)
+"""
+
+
+def test_line_counts():
+    run = dry_run(SCRIPT)
+    assert run.stopped is None
+    assert run.line_counts[5] == 5
+    assert run.line_times[5] == 50
+    assert run.total == sum(run.line_times.values())
+
+
+def test_readback_loop():
+    run = dry_run('pos tset 10\nwhile abs(Ta() - 10) > 0.2:\n    w(1)\n')
+    assert run.stopped is None
+    assert run.line_counts[3] == 10
+    assert run.annotated_script().splitlines()[2] == '    w(1)  # 10 runs, 10s'
+
+
+def test_step_budget():
+    run = dry_run('while True:\n    w(1)\n', max_steps=100)
+    assert run.stopped == 'Line 1: step budget of 100 lines exceeded'
+    assert run.total == 50
+
+
+def test_time_budget():
+    run = dry_run('while True:\n    w(100)\n', max_time=1000)
+    assert run.stopped.startswith('Line 2: virtual time budget')
+
+
+def test_script_error():
+    run = dry_run('w(1)\n1/0\nw(2)')
+    assert run.stopped == 'Line 2: ZeroDivisionError: division by zero'
+    assert run.total == 1
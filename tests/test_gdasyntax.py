@@ -0,0 +1,42 @@
+"""
+I16 Script Generator
+Tests of gdasyntax
+"""
+
+from i16_script_generator.gdasyntax import scan_line, strip_comment, is_gda_command, translate_script, iter_blocks
+
+
+def test_scan_line():
+    code, splits, colon, quote, depth = scan_line('if a: pos x "1;#"; w(1)  # comment')
+    assert code == 'if a: pos x "1;#"; w(1)  '
+    assert splits == [17]
+    assert colon == 4
+    assert quote is None and depth == 0
+    assert scan_line('x = """text', None, 0)[3] == '"""'
+    assert scan_line('x = f(1,', None, 0)[4] == 1
+    assert strip_comment("print('#')  # comment") == "print('#')  "
+
+
+def test_is_gda_command():
+    assert is_gda_command('pos x 1')
+    assert is_gda_command('scan hkl [0,0,1] [0,0,2] [0,0,0.1] pil 1')
+    assert is_gda_command('  inc eta -1')
+    assert not is_gda_command('x = 1')
+    assert not is_gda_command('for i in range(3):')
+    assert not is_gda_command('a if b else c')
+    assert not is_gda_command('print (x)')
+    assert not is_gda_command('w(1)')
+
+
+def test_translate_script():
+    script = 'pos x 1\nfor i in range(2): scan x 1 2 1\nx = """\npos y 2\n"""\nw(1); go 2'
+    lines = translate_script(script).splitlines()
+    assert lines[0] == "_gda_command('pos x 1')"
+    assert lines[1] == "for i in range(2): _gda_command('scan x 1 2 1')"
+    assert lines[3] == 'pos y 2'  # inside a string
+    assert lines[5] == "w(1); _gda_command('go 2')"
+
+
+def test_iter_blocks():
+    lines = ['x = 1', 'for i in range(x):', '    w(1)', '', 'if x:', '    w(2)', 'else:', '    w(3)', 'y = (1,', '2)']
+    assert [start for start, block in iter_blocks(lines)] == [0, 1, 4, 8]
@@ -0,0 +1,37 @@
+"""
+I16 Script Generator
+Tests of params registry version tracking
+"""
+
+from i16_script_generator.params import RegistryDict, RegistryList, SCANOPTIONS, registry_version
+
+
+def changes_version(function):
+    version = registry_version()
+    function()
+    return registry_version() != version
+
+
+def test_nested_list_change():
+    detectors = RegistryDict({'pil': {'alt names': ['pil3']}})
+    assert isinstance(detectors['pil']['alt names'], RegistryList)
+    assert changes_version(lambda: detectors['pil']['alt names'].append('pil100k'))
+    assert changes_version(lambda: detectors['pil']['alt names'].remove('pil3'))
+
+
+def test_ior():
+    scannables = RegistryDict()
+    assert changes_version(lambda: scannables.__ior__({'x': {'speed': 1}}))
+    assert isinstance(scannables['x'], RegistryDict)
+
+
+def test_pop_missing_key():
+    scannables = RegistryDict({'x': {}})
+    assert not changes_version(lambda: scannables.pop('y', None))
+    assert changes_version(lambda: scannables.pop('x'))
+
+
+def test_scan_options():
+    assert isinstance(SCANOPTIONS, RegistryList)
+    assert changes_version(lambda: SCANOPTIONS.append('test_option'))
+    assert changes_version(lambda: SCANOPTIONS.remove('test_option'))
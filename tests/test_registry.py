@@ -0,0 +1,49 @@
+"""
+I16 Script Generator
+Tests of registry
+"""
+
+import os
+import json
+import stat
+
+from i16_script_generator import registry as registry_module
+from i16_script_generator.registry import Registry, load_registry, registry
+from i16_script_generator.params import SCANNABLES, DETECTORS, SCANOPTIONS
+
+DUMP = {
+    'scannables': {'newmotor': {'desc': 'new motor', 'speed': 2.0, 'stabilisation': 0.5}},
+    'detectors': {'newdet': {'cmd': 'newdet %.5g', 'alt names': ['nd'], 'regex': r'newdet\w*?'}},
+    'options': ['newoption'],
+}
+
+
+def test_registry_lookups():
+    reg = registry()
+    assert reg.detector('pil3_100k') == 'pilatus100k'
+    assert reg.classify('pil2ms') == ('detector', 'pilatus2m')
+    assert reg.classify('roi2') == ('roi', 'pilatus100k')
+    assert reg.classify('eta') == ('scannable', 'eta')
+    assert reg.classify('checkbeam') == ('option', 'checkbeam')
+    assert reg.scannable_speed('phi') == (5, 1)
+
+
+def test_load_registry_cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(registry_module, 'CACHE_DIR', str(tmp_path / 'cache'))
+    dump_file = tmp_path / 'namespace.json'
+    dump_file.write_text(json.dumps(DUMP))
+    reg = load_registry(str(dump_file), SCANNABLES, DETECTORS, SCANOPTIONS)
+    assert reg.classify('newdet2') == ('detector', 'newdet')
+    assert reg.scannable_speed('newmotor') == (2.0, 0.5)
+    assert reg.classify('pil') == ('detector', 'pilatus100k')
+
+    cache_file = registry_module.registry_cache_file(str(dump_file))
+    assert os.path.dirname(cache_file) == str(tmp_path / 'cache')
+    assert not os.path.exists(str(dump_file) + '.cache')
+    assert stat.S_IMODE(os.stat(cache_file).st_mode) == 0o600
+    with open(cache_file) as f:
+        assert 'newmotor' in json.load(f)['scannables']
+
+    cached = load_registry(str(dump_file), SCANNABLES, DETECTORS, SCANOPTIONS)
+    assert cached.digest == reg.digest
+    assert isinstance(cached, Registry)
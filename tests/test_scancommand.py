@@ -0,0 +1,56 @@
+"""
+I16 Script Generator
+Tests of scancommand
+"""
+
+from i16_script_generator.scancommand import (
+    ScanCommand, tokenize, canonical_command, parse_scan_commands, substitute_variables
+)
+
+
+def test_tokenize():
+    tokens = list(tokenize('scan hkl [0,0,1] pil 1E-1'))
+    assert tokens[0] == ('name', 'scan')
+    assert ('open', '[') in tokens
+    assert tokens[-1] == ('number', '1E-1')
+
+
+def test_canonical_command():
+    assert canonical_command('scan x  1 2.0 1E-1') == canonical_command('scan x 1.0 2 0.1') == 'scan x 1.0 2.0 0.1'
+
+
+def test_scan_command_fields():
+    scan = ScanCommand.from_string('scan eta 20.5 22.8 0.01 checkbeam pil 1 roi2')
+    assert scan.scan_type == 'scan'
+    assert scan.axes == [('eta', [20.5, 22.8, 0.01])]
+    assert scan.detectors == [('pil', 1)]
+    assert scan.options == [('checkbeam', []), ('roi2', [])]
+    assert str(scan) == 'scan eta 20.5 22.8 0.01 checkbeam pil 1 roi2'
+
+
+def test_scancn_axes():
+    scan = ScanCommand.from_string('scancn eta 0.01 101 pil 1 roi2')
+    assert scan.axes == [('eta', [0.01, 101])]
+
+
+def test_bracket_values():
+    scan = ScanCommand.from_string('scan hkl [0,0, 0] [1, 1, 1] [0.1,0.1,0.1] pil 1')
+    assert scan.fields[0] == ('hkl', [[0, 0, 0], [1, 1, 1], [0.1, 0.1, 0.1]])
+    assert scan.command() == 'scan hkl [0,0,0] [1,1,1] [0.1,0.1,0.1] pil 1'
+
+
+def test_multiple_commands():
+    scans = parse_scan_commands('pos x1 1; scan x 1 2 1; scancn y 0.1 11')
+    assert [scan.scan_type for scan in scans] == ['scan', 'scancn']
+
+
+def test_from_args():
+    scan = ScanCommand.from_args('scan', 'x', 1, 2, 0.1, 'pil', 1)
+    assert scan == ScanCommand.from_string('scan x 1 2 0.1 pil 1')
+
+
+def test_substitute_variables():
+    command = substitute_variables('scan x1 x 2 0.1 pil 1 roi2', {'x': 1, 'roi': 2})
+    assert command == 'scan x1 1 2 0.1 pil 1 roi2'
+    assert substitute_variables('scan x start 2 0.1', {'start': 'abc'}) == 'scan x 0 2 0.1'
+    assert substitute_variables('pos x 1; scan x hkl 2 1', {'hkl': [0, 0, 1]}) == 'pos x 1; scan x [0,0,1] 2 1'
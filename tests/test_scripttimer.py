@@ -0,0 +1,90 @@
+"""
+I16 Script Generator
+Tests of scripttimer
+"""
+
+from i16_script_generator.scripttimer import ScriptTimer, IncrementalTimer, parse_lines, LOOP_TIME
+from i16_script_generator.timing import scan_command_time
+
+
+MISSING_BLOCK = """
+pos x 1
+for i in range(10):
+pos y 2
+scan x 1 2 0.1 pil 1
+w(100)
+"""
+
+
+def test_missing_indented_block():
+    timer = ScriptTimer()
+    total = timer.run(MISSING_BLOCK)
+    assert total > 100
+    assert len(timer.warnings) == 1
+    assert timer.warnings[0].startswith('Line 3: expected an indented block')
+
+
+def test_missing_indented_block_incremental():
+    timer = ScriptTimer()
+    incremental = IncrementalTimer()
+    assert incremental.update(MISSING_BLOCK) == timer.run(MISSING_BLOCK)
+
+
+def test_parse_lines_unclosed_bracket():
+    warnings = []
+    tree = parse_lines(['w(1)', 'x = (1,', 'w(2)'], warnings)
+    assert tree.body[0].lineno == 1
+    assert len(warnings) == 1
+
+
+def test_bad_scan_command():
+    timer = ScriptTimer()
+    total = timer.run('w(10)\nscan hkl [0,0] [1,1,1] [0.1,0.1,0.1] pil 1\nw(5)')
+    assert total == 15
+    assert timer.warnings[0].startswith('Line 2: scan time unknown')
+
+
+SCRIPT = """x = 5
+pos x1 1
+scan x 1 2 0.1 pil 1
+for i in range(x):
+    w(10)
+w(x)
+"""
+
+EDITS = [
+    ('pos x1 1', 'pos x1 2'),  # unrelated block
+    ('x = 5', 'x = 2'),  # variable read by later blocks
+    ('w(x)\n', 'w(x)\nw(1)\n'),  # added line
+    ('for i in range(x):\n    w(10)\n', ''),  # removed loop
+    ('scan x 1 2 0.1', 'scan x 1 3 0.1'),
+]
+
+
+def test_incremental_timer_matches_full_timing():
+    incremental = IncrementalTimer()
+    script = SCRIPT
+    assert incremental.update(script) == ScriptTimer().run(script)
+    for old, new in EDITS:
+        script = script.replace(old, new)
+        timer = ScriptTimer()
+        assert incremental.update(script) == timer.run(script)
+        assert incremental.line_times == {lineno: seconds for lineno, seconds in timer.line_times.items() if seconds}
+
+
+def test_incremental_timer_retimes_dependents():
+    incremental = IncrementalTimer()
+    incremental.update(SCRIPT)
+    incremental.update(SCRIPT.replace('x = 5', 'x = 2'))
+    assert incremental.retimed == 4  # x = 2, the scan and loop that read x, and w(x)
+    incremental.update(SCRIPT.replace('x = 5', 'x = 2').replace('pos x1 1', 'pos x1 2'))
+    assert incremental.retimed == 1
+    incremental.update(SCRIPT.replace('x = 5', 'x = 2').replace('pos x1 1', 'pos x1 2'))
+    assert incremental.retimed == 0
+
+
+def test_loop_variable_in_scan():
+    seconds, points = scan_command_time('scan eta 1 2 0.1 pil 1')
+    for script in ['for st in [0.1, 0.2]:\n    scan eta 1 2 st pil 1', 'for t in [1, 2]:\n    scan eta 1 2 0.1 pil t']:
+        assert ScriptTimer().run(script) == 2 * (seconds + LOOP_TIME)
+        assert IncrementalTimer().update(script) == 2 * (seconds + LOOP_TIME)
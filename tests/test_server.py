@@ -0,0 +1,97 @@
+"""
+I16 Script Generator
+Tests of the timing server
+"""
+
+import os
+import stat
+import json
+import threading
+import http.client
+
+import pytest
+
+from i16_script_generator import server as server_module
+from i16_script_generator.server import make_server, run_request, TimingClient
+from i16_script_generator.timing import scan_command_time
+
+
+@pytest.fixture
+def private_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(server_module, 'TOKEN_FILE', str(tmp_path / 'timing.token'))
+    monkeypatch.delenv(server_module.TOKEN_ENV, raising=False)
+    monkeypatch.setenv('I16_TIMING_CACHE', 'off')
+    return tmp_path
+
+
+def serve(server):
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+def test_run_request():
+    result = run_request('scan_command_time', {'command': 'scancn eta 0.01 101 pil 1'})
+    seconds, points = scan_command_time('scancn eta 0.01 101 pil 1')
+    assert result['seconds'] == seconds
+    assert result['points'] == points
+    results = run_request('batch', {'requests': [
+        {'method': 'scan_command_time', 'command': 'scan x 1 2 0.1'}, {'method': 'unknown'}
+    ]})['results']
+    assert 'seconds' in results[0]
+    assert 'error' in results[1]
+
+
+def test_script_code_is_not_run(tmp_path):
+    marker = tmp_path / 'marker'
+    script = "for i in range(__import__('os').system('touch %s') + 1):\n    pos x 1\n" % marker
+    script += "y = __import__('os').system('touch %s')\n" % marker
+    run_request('time_script_string', {'script': script, 'cache': False})
+    assert not marker.exists()
+
+
+def test_unix_socket(private_dir):
+    socket_file = str(private_dir / 'timing.sock')
+    server = serve(make_server(socket_file=socket_file))
+    try:
+        assert stat.S_IMODE(os.stat(socket_file).st_mode) == 0o600
+        client = TimingClient(socket_file=socket_file)
+        assert client.scan_command_time('scan x 1 2 0.1 pil 1') == scan_command_time('scan x 1 2 0.1 pil 1')
+        seconds, annotated = client.time_script_string('pos x 1\nw(10)', cache=False)
+        assert seconds == 11
+        assert client.status()['requests'] == 2
+        client.close()
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_tcp_requires_token(private_dir):
+    server = serve(make_server(port=0))
+    host, port = server.server_address[:2]
+    try:
+        token_file = private_dir / 'timing.token'
+        assert stat.S_IMODE(os.stat(token_file).st_mode) == 0o600
+        assert token_file.read_text() == server.token
+
+        client = TimingClient(host, port)  # token read from the token file
+        assert client.scan_command_time('scan x 1 2 0.1')[1] == 11
+        client.close()
+
+        with pytest.raises(RuntimeError):
+            TimingClient(host, port, token='wrong').scan_command_time('scan x 1 2 0.1')
+
+        body = json.dumps({'command': 'scan x 1 2 0.1'})
+        connection = http.client.HTTPConnection(host, port)
+        connection.request('POST', '/scan_command_time', body, {'Content-Type': 'text/plain'})
+        assert connection.getresponse().status == 401
+        connection.close()
+
+        connection = http.client.HTTPConnection(host, port)
+        headers = {'Content-Type': 'text/plain', 'Authorization': 'Bearer %s' % server.token}
+        connection.request('POST', '/scan_command_time', body, headers)
+        assert connection.getresponse().status == 415
+        connection.close()
+    finally:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,65 @@
+"""
+I16 Script Generator
+Tests of timeline
+"""
+
+import time
+
+from i16_script_generator.timeline import script_timeline
+
+
+NESTED_LOOPS = """
+for a in range(3):
+    for b in range(4):
+        w(10)
+"""
+
+
+def test_nested_loop_iterations():
+    timeline = script_timeline(NESTED_LOOPS)
+    assert timeline.total == 120
+    assert [record.iterations for record in timeline] == [(a, b) for a in range(3) for b in range(4)]
+    assert timeline.iteration_start(2, 2) == 80
+    assert timeline.iteration_start(3, 1, 0) == 40
+    assert timeline.iteration_start(3, 1, 3) == 70
+    assert timeline.at(75).iterations == (1, 3)
+
+
+def test_one_line_loop():
+    timeline = script_timeline('for i in range(3): w(10)\n')
+    assert [record.iterations for record in timeline] == [(0,), (1,), (2,)]
+    assert timeline.iteration_starts == {(1, (0,)): 0, (1, (1,)): 10, (1, (2,)): 20}
+
+
+def test_nested_one_line_loop():
+    timeline = script_timeline('for i in range(2):\n    for j in range(3): w(1)\n    w(5)\n')
+    iterations = [record.iterations for record in timeline]
+    assert iterations == [(0, 0), (0, 1), (0, 2), (0,), (1, 0), (1, 1), (1, 2), (1,)]
+    assert timeline.iteration_start(1, 1) == 8
+    assert timeline.iteration_start(2, 1, 2) == 10
+    assert timeline.iteration_start(2, 1, 3) is None
+
+
+def test_nested_loop_in_function():
+    script = 'def f():\n    for b in range(2):\n        w(5)\nfor a in range(3):\n    f()\n'
+    timeline = script_timeline(script)
+    assert [record.iterations for record in timeline] == [(a, b) for a in range(3) for b in range(2)]
+    assert timeline.iteration_start(4, 2) == 20
+
+
+def test_while_loop():
+    timeline = script_timeline('i = 0\nwhile i < 3:\n    i += 1\n    w(5)\n')
+    assert [record.iterations for record in timeline] == [(0,), (1,), (2,)]
+    assert timeline.remaining(4) == 15
+    assert timeline.iteration_start(2, 3) is None
+
+    timeline = script_timeline('i = 0\nwhile True:\n    i += 1\n    w(2)\n    if i > 2:\n        break\nw(1)\n')
+    assert [record.iterations for record in timeline] == [(0,), (1,), (2,), ()]
+
+
+def test_large_nested_loop():
+    start = time.time()
+    timeline = script_timeline('for a in range(200):\n    for b in range(200):\n        w(1)\n')
+    assert time.time() - start < 10
+    assert timeline.total == 40000
+    assert timeline[-1].iterations == (199, 199)
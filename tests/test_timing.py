@@ -0,0 +1,100 @@
+"""
+I16 Script Generator
+Tests of timing
+"""
+
+import os
+import sys
+import subprocess
+
+import numpy as np
+
+from i16_script_generator.timing import (
+    calculate_scan_command_time, scan_command_time, scan_command_time_many, scan_time_model,
+    lazy_frange, frange, eval_range
+)
+
+COMMANDS = [
+    'scan x 1 2 0.1 pil 1',
+    'scan x 1 2 0.01 pil 0.5',
+    'scancn eta 0.01 101 pil 1 roi2',
+    'scancn eta 0.02 51 pil 2 roi2',
+    'cscan eta 0.5 0.01 t 1',
+    'scan hkl [0,0,0] [1,1,1] [0.1,0.1,0.1] pil 1 roi2',
+    'scan hkl [0,0,0] [0,0,1] [0,0,0.01] pil 1 roi2',
+    'pos x1 1; scan x 1 2 1',
+]
+
+
+def test_scan_command_time_many():
+    times, points = scan_command_time_many(COMMANDS)
+    for command, seconds, npoints in zip(COMMANDS, times, points):
+        expected_seconds, expected_points = calculate_scan_command_time(command)
+        assert np.isclose(seconds, expected_seconds)
+        assert npoints == expected_points
+
+
+def test_scan_time_model_time_many():
+    model = scan_time_model('scancn', ['eta'])
+    times, points = model.time_many([[[0.01, 101], [0.02, 51]]], exposure=[1, 2])
+    assert np.allclose(times, scan_command_time_many(COMMANDS[2:4])[0])
+    assert list(points) == [101, 51]
+
+    model = scan_time_model('scan', ['hkl'])
+    values = [[[[0, 0, 0], [1, 1, 1], [0.1, 0.1, 0.1]], [[0, 0, 0], [0, 0, 1], [0, 0, 0.01]]]]
+    times, points = model.time_many(values, exposure=1)
+    assert np.allclose(times, scan_command_time_many(COMMANDS[5:7])[0])
+
+
+def test_scan_command_time_cached():
+    assert scan_command_time('scan x  1 2.0 1E-1 pil 1') == calculate_scan_command_time('scan x 1 2 0.1 pil 1')
+
+
+def test_lazy_frange():
+    assert np.allclose(np.asarray(lazy_frange(84, 96, 2)), frange(84, 96, 2))
+    assert len(lazy_frange(0, 360, 0.01)) == len(frange(0, 360, 0.01))
+    assert len(lazy_frange(10, 100, 5) + lazy_frange(110, 300, 10)) == 39
+
+
+def test_eval_range():
+    assert len(eval_range('frange(ini - 5, ini + 5, 1)', {'ini': 0})) == 11
+    assert len(eval_range('range(n)', {'n': 4})) == 4
+
+
+FUNCTION_SCRIPT = """
+def f():
+    w(10)
+f()
+f()
+"""
+
+
+def test_function_script_totals_agree(tmp_path):
+    from i16_script_generator.timing import time_script, time_script_string, write_script_timing
+    filename = tmp_path / 'script.py'
+    filename.write_text(FUNCTION_SCRIPT)
+    assert time_script_string(FUNCTION_SCRIPT, cache=False)[0].total_seconds() == 20
+    assert time_script(str(filename), cache=False).total_seconds() == 20
+    assert write_script_timing(str(filename), str(tmp_path / 'out.py')).total_seconds() == 20
+
+
+def test_bad_loop_range_json(tmp_path, capsys, monkeypatch):
+    import json
+    from i16_script_generator.timing import main
+    monkeypatch.setenv('I16_TIMING_CACHE', 'off')
+    (tmp_path / 'bad_loop.py').write_text('for a in 1/0:\n    w(5)\n')
+    main([str(tmp_path), '--json', '--no-cache', '--jobs', '1'])
+    results = json.loads(capsys.readouterr().out)
+    assert results[0]['warnings'] == ['Line 1: loop length unknown: division by zero']
+
+
+def test_loop_timing_without_numpy():
+    code = (
+        'import sys\n'
+        'from i16_script_generator.timing import time_script_string\n'
+        'script = "for i in range(3):\\n    w(1)\\nfor e in frange(1, 2, 0.1):\\n    pos x e"\n'
+        'assert time_script_string(script)[0].total_seconds() == 28\n'
+        'assert "numpy" not in sys.modules\n'
+    )
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    subprocess.run([sys.executable, '-c', code], cwd=root, check=True)
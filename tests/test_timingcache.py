@@ -0,0 +1,89 @@
+"""
+I16 Script Generator
+Tests of timingcache
+"""
+
+import os
+import stat
+
+import pytest
+
+from i16_script_generator import timingcache
+from i16_script_generator.timingcache import TimingCache, script_key
+from i16_script_generator.timing import time_script_string, script_file_timing
+
+SCRIPT = 'pos x 1\nscan x 1 2 0.1 pil 1\n'
+
+
+@pytest.fixture
+def cache_file(tmp_path, monkeypatch):
+    filename = tmp_path / 'timing.sqlite'
+    monkeypatch.setenv(timingcache.CACHE_ENV, str(filename))
+    return filename
+
+
+def test_put_get(tmp_path):
+    cache = TimingCache(str(tmp_path / 'timing.sqlite'))
+    assert cache.get(SCRIPT) is None
+    cache.put(SCRIPT, 10.0, {1: 1.0, 2: 9.0}, 'annotated', ['warning'])
+    entry = cache.get(SCRIPT)
+    assert entry.total == 10.0
+    assert entry.line_times == {1: 1.0, 2: 9.0}
+    assert entry.annotated == 'annotated'
+    assert entry.warnings == ['warning']
+    assert cache.info()['entries'] == 1
+    cache.clear()
+    assert cache.get(SCRIPT) is None
+
+
+def test_private_files(tmp_path):
+    cache = TimingCache(str(tmp_path / 'cache' / 'timing.sqlite'))
+    cache.put(SCRIPT, 12.0, {2: 11.0}, SCRIPT)
+    assert stat.S_IMODE(os.stat(tmp_path / 'cache').st_mode) == 0o700
+    assert stat.S_IMODE(os.stat(cache.filename).st_mode) == 0o600
+    os.chmod(cache.filename, 0o644)
+    assert cache.get(SCRIPT).total == 12.0
+    assert stat.S_IMODE(os.stat(cache.filename).st_mode) == 0o600
+
+
+def test_engines_have_separate_keys(tmp_path):
+    assert script_key(SCRIPT, 'ScriptTimer') != script_key(SCRIPT, 'IncrementalTimer')
+    cache = TimingCache(str(tmp_path / 'timing.sqlite'))
+    cache.put(SCRIPT, 10.0, {}, 'annotated', engine='IncrementalTimer')
+    assert cache.get(SCRIPT, 'ScriptTimer') is None
+    assert cache.get(SCRIPT, 'IncrementalTimer').total == 10.0
+
+
+def test_key_includes_code_digest(monkeypatch):
+    key = script_key(SCRIPT)
+    monkeypatch.setattr(timingcache, 'code_digest', lambda: 'changed')
+    assert script_key(SCRIPT) != key
+
+
+def test_evict(tmp_path):
+    cache = TimingCache(str(tmp_path / 'timing.sqlite'), max_bytes=100)
+    for n in range(10):
+        cache.put('w(%d)' % n, n, {}, 'x' * 40)
+    assert cache.info()['bytes'] <= 100
+    assert cache.get('w(9)') is not None
+
+
+def test_library_default_is_uncached(cache_file):
+    time_script_string(SCRIPT)
+    assert not cache_file.exists()
+
+
+def test_time_script_string_cached(cache_file):
+    total, annotated = time_script_string(SCRIPT, cache=True)
+    cache = TimingCache(str(cache_file))
+    assert cache.get(SCRIPT, 'ScriptTimer').total == total.total_seconds()
+    assert time_script_string(SCRIPT, cache=True) == (total, annotated)
+
+
+def test_script_file_timing_cached(cache_file, tmp_path):
+    filename = tmp_path / 'script.py'
+    filename.write_text(SCRIPT)
+    entry = script_file_timing(str(filename), cache=True)
+    cache = TimingCache(str(cache_file))
+    assert cache.get(SCRIPT, 'ScriptTimer') is None
+    assert cache.get(SCRIPT, 'iter_script_timing') == entry
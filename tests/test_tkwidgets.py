@@ -0,0 +1,32 @@
+"""
+I16 Script Generator
+Tests of tkwidgets.SearchIndex
+"""
+
+import pytest
+
+tkwidgets = pytest.importorskip('i16_script_generator.tkwidgets')
+
+
+def test_search():
+    index = tkwidgets.SearchIndex(['eta', 'chi', 'phi', 'sgu'])
+    assert index.search('hi') == [1, 2]
+    assert index.search('phi') == [2]
+    assert index.search('') == [0, 1, 2, 3]
+    assert index.search('xyz') == []
+
+
+def test_search_matches_substring():
+    fields = ['sample rotation parallel to beam', 'sample translation x', 'Detector rotation', 'diode']
+    index = tkwidgets.SearchIndex(fields)
+    for search in ['rot', 'ROTATION', 'sample t', 'ion x', 'de', 'to beam', 'o']:
+        expected = [idx for idx, field in enumerate(fields) if search.lower() in field.lower()]
+        assert sorted(index.search(search)) == expected
+
+
+def test_whole_word_first():
+    index = tkwidgets.SearchIndex(['rotation eta', 'eta'])
+    assert index.search('eta') == [0, 1]
+    assert index.search('rotation') == [0]
+    index = tkwidgets.SearchIndex(['betas', 'eta x'])
+    assert index.search('eta') == [1, 0]
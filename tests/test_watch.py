@@ -0,0 +1,43 @@
+"""
+I16 Script Generator
+Tests of watch
+"""
+
+import os
+import json
+
+from i16_script_generator.watch import ScriptWatcher
+
+
+def write(filename, text, mtime_ns):
+    filename.write_text(text)
+    os.utime(filename, ns=(mtime_ns, mtime_ns))
+
+
+def test_update(tmp_path):
+    first, second = tmp_path / 'first.py', tmp_path / 'second.py'
+    write(first, 'w(10)\n', 10 ** 18)
+    write(second, 'w(5)\nw(5)\n', 10 ** 18)
+    (tmp_path / 'notes.txt').write_text('w(100)')
+    watcher = ScriptWatcher(str(tmp_path))
+    assert sorted(watcher.update()) == [str(first), str(second)]
+    assert watcher.update() == []
+    assert watcher.retimed == 0
+
+    write(first, 'w(10)\nw(20)\n', 2 * 10 ** 18)
+    assert watcher.update() == [str(first)]
+    assert watcher.retimed == 1
+    assert [(r['file'], r['seconds']) for r in watcher.results()] == [(str(first), 30), (str(second), 10)]
+
+    second.unlink()
+    assert watcher.update() == [str(second)]
+    assert watcher.summary()['seconds'] == 30
+
+
+def test_write_summary(tmp_path):
+    write(tmp_path / 'script.py', 'w(10)\n', 10 ** 18)
+    watcher = ScriptWatcher(str(tmp_path))
+    watcher.update()
+    watcher.write_summary(str(tmp_path / 'summary.json'))
+    with open(tmp_path / 'summary.json') as f:
+        assert json.load(f)['scripts'][0]['seconds'] == 10
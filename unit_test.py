@@ -136,4 +136,4 @@ tot_time, new_script = time_script_string(script)
 print('Example Script\n---------------------')
 print(new_script)
 print('Total time: %s' % time_string(tot_time.total_seconds()))
-print(' Should be: 47 hours, 57 mins, 23s')
+print(' Should be: 49 hours, 3 mins, 49s')